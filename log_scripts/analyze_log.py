@@ -2,19 +2,25 @@
 """
 日志统计脚本 - 解析 bqbq_download_full-*.log 并统计各变量求和
 支持命令行参数指定日志文件路径
+
+使用方式：
+    python analyze_log.py [日志文件] [--incremental]
+
+--incremental: 增量模式，在 <日志文件>.stats.json 中保存检查点，之后只解析新追加的内容
 """
 
 import sys
-from log_utils import DEFAULT_LOG_FILE, parse_log_stats, print_log_stats, LogStats
+from log_utils import DEFAULT_LOG_FILE, parse_log_stats, parse_log_stats_incremental, print_log_stats, LogStats
 
 
-def parse_log(log_path: str = None, silent: bool = False) -> dict:
+def parse_log(log_path: str = None, silent: bool = False, incremental: bool = False) -> dict:
     """
     解析日志文件并统计（兼容旧接口）
 
     Args:
         log_path: 日志文件路径，默认使用 DEFAULT_LOG_FILE
         silent: 静默模式，不打印输出
+        incremental: 增量模式，只解析上次检查点之后追加的内容
 
     Returns:
         dict: 统计结果字典
@@ -22,7 +28,7 @@ def parse_log(log_path: str = None, silent: bool = False) -> dict:
     if log_path is None:
         log_path = DEFAULT_LOG_FILE
 
-    stats = parse_log_stats(log_path)
+    stats = parse_log_stats_incremental(log_path) if incremental else parse_log_stats(log_path)
 
     if not silent:
         print_log_stats(stats)
@@ -41,5 +47,6 @@ def parse_log(log_path: str = None, silent: bool = False) -> dict:
 
 
 if __name__ == "__main__":
-    log_path = sys.argv[1] if len(sys.argv) > 1 else None
-    parse_log(log_path)
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    log_path = args[0] if args else None
+    parse_log(log_path, incremental='--incremental' in sys.argv)
@@ -4,23 +4,41 @@
 
 功能：
 1. 扫描指定目录下所有 bqbq_download_full-*.log 文件
-2. 对每个文件执行：统计处理前状态 -> 重处理失败记录 -> 统计处理后状态
-3. 输出前后对比统计
+2. 默认（跨文件计划）：一次扫描所有日志，按 (md5, 文件名) 合并各日志中的失败记录，
+   每张图片优先用最新的 URL 下载一次（失败时再换用其他引用的 URL），结果回填到所有引用它的日志行
+3. --per-file：逐个文件执行 统计处理前状态 -> 重处理失败记录 -> 统计处理后状态
+4. 输出前后对比统计和去重节省的下载次数
 
 使用方式：
-    python batch_reprocess_logs.py [日志目录]
+    python batch_reprocess_logs.py [日志目录] [--per-file] [--concurrency 8] [--max-connections 20] [--host-rate 5]
 """
 
 import os
 import sys
 import glob
 import asyncio
+from dataclasses import dataclass, field
 
 from log_utils import (
     DEFAULT_LOG_DIR, LOG_PATTERN, FAIL_STATUSES,
-    parse_log_stats, count_failed
+    scan_log, count_failed, filter_failed_records
 )
-from reprocess_failed_logs import reprocess_failed_records
+from reprocess_failed_logs import (
+    reprocess_failed_records, build_arg_parser, process_records, apply_result, write_line_updates,
+    load_rkey_usage, save_rkey_usage
+)
+
+
+@dataclass
+class BatchPlan:
+    """跨文件重处理计划"""
+    scans: dict                                  # log_file -> LogScan
+    work: dict = field(default_factory=dict)     # work_key(...) -> [(log_file, LogRecord), ...]
+
+    @property
+    def total_refs(self) -> int:
+        """所有日志中失败记录的总数"""
+        return sum(len(refs) for refs in self.work.values())
 
 
 def find_log_files(log_dir: str) -> list:
@@ -52,14 +70,15 @@ def print_comparison(before, after, reprocess_stats: dict):
     print("=" * 70)
 
 
-async def process_single_log(log_file: str) -> dict:
-    """处理单个日志文件"""
+async def process_single_log(log_file: str, **options) -> dict:
+    """处理单个日志文件，options 透传给 reprocess_failed_records（并发参数）"""
     print("\n" + "#" * 70)
     print(f"# 处理文件: {os.path.basename(log_file)}")
     print("#" * 70)
 
-    # 处理前统计
-    before = parse_log_stats(log_file)
+    # 处理前统计：单遍同时得到统计、记录和原始行，重处理时直接复用
+    scan = scan_log(log_file)
+    before = scan.stats
     fail_count = count_failed(before)
     print(f"\n>>> 处理前: 总记录={before.parsed_lines} 失败={fail_count}")
 
@@ -70,16 +89,119 @@ async def process_single_log(log_file: str) -> dict:
 
     # 执行重处理
     print("\n>>> 开始重处理")
-    reprocess_stats = await reprocess_failed_records(log_file)
+    reprocess_stats = await reprocess_failed_records(log_file, scan=scan, **options)
 
-    # 处理后统计
-    after = parse_log_stats(log_file)
+    # 处理后统计：无改写时与处理前相同，有改写时为叠加旁路日志后的统计
+    after = reprocess_stats.pop("log_stats", before)
     print_comparison(before, after, reprocess_stats)
 
     return {"file": log_file, "before": before, "after": after, "reprocess": reprocess_stats}
 
 
-async def batch_process(log_dir: str):
+def work_key(log_file: str, rec) -> tuple:
+    """
+    去重键：(md5, 文件名)。文件名为空（无法确定是哪张图片）的记录以 (日志, 行号) 为键，
+    每条单独下载，不会与其他记录合并
+    """
+    md5 = rec.file_name.split(".")[0] if rec.file_name else ""
+    if not md5:
+        return ("", log_file, rec.line_index)
+    return (md5, rec.file_name)
+
+
+def is_failed(result) -> bool:
+    """与 apply_result 一致：异常或下载失败（预查重命中不算失败）"""
+    return result is None or (not result.success and result.download_method != "PRE_DUP")
+
+
+def candidate_records(refs: list) -> list:
+    """
+    同一图片的各处引用按从新到旧排列并按 URL 去重：日志按文件名排序、记录按行号追加，
+    越靠后的引用越新，其 rkey/fileid 更可能仍然有效
+    """
+    seen = set()
+    candidates = []
+    for _, rec in reversed(refs):
+        if rec.url not in seen:
+            seen.add(rec.url)
+            candidates.append(rec)
+    return candidates
+
+
+def plan_batch(log_files: list) -> BatchPlan:
+    """
+    一次扫描所有日志，建立全局工作集：同一 (md5, 文件名) 在多个日志/多行中失败时只保留一个下载任务
+    """
+    plan = BatchPlan(scans={})
+    for log_file in log_files:
+        scan = scan_log(log_file)
+        plan.scans[log_file] = scan
+        for rec in filter_failed_records(scan.records):
+            plan.work.setdefault(work_key(log_file, rec), []).append((log_file, rec))
+    return plan
+
+
+async def batch_process_planned(log_files: list, **options) -> list:
+    """
+    跨文件计划模式：并发处理去重后的工作集，再把结果回填到每个日志
+
+    Returns:
+        list: 与 process_single_log 相同结构的结果列表
+    """
+    plan = plan_batch(log_files)
+    keys = list(plan.work)
+    total_refs = plan.total_refs
+    print(f"\n[计划] {len(log_files)} 个日志共 {total_refs} 条失败记录，去重后 {len(keys)} 个下载任务")
+
+    results = {}
+    if keys:
+        # 每个任务先用最新一处引用的 URL 下载，失败时依次改用其他不同的 URL，
+        # 全部失败才把失败回填到所有引用（与 --per-file 模式能恢复的记录一致）
+        load_rkey_usage()
+        candidates = {key: candidate_records(plan.work[key]) for key in keys}
+        todo = keys
+        attempt = 0
+        while todo:
+            if attempt:
+                print(f"\n[重试] {len(todo)} 个任务改用第 {attempt + 1} 个 URL")
+            await process_records([candidates[key][attempt] for key in todo],
+                                  lambda idx, rec, result, todo=todo: results.__setitem__(todo[idx], result),
+                                  **options)
+            attempt += 1
+            todo = [key for key in todo if is_failed(results[key]) and attempt < len(candidates[key])]
+        save_rkey_usage()
+
+    # 回填：同一图片只有第一处引用记为新增，其余记为重复
+    per_file = {f: {"total": 0, "success_new": 0, "success_dup": 0, "fail": 0} for f in log_files}
+    line_updates = {f: {} for f in log_files}
+    for key in keys:
+        result = results.get(key)
+        for i, (log_file, rec) in enumerate(plan.work[key]):
+            per_file[log_file]["total"] += 1
+            apply_result(rec, result, per_file[log_file], line_updates[log_file],
+                         is_new=None if i == 0 else False)
+
+    summary = []
+    for log_file in log_files:
+        scan = plan.scans[log_file]
+        before = scan.stats
+        after = before
+        if line_updates[log_file]:
+            after = write_line_updates(log_file, filter_failed_records(scan.records),
+                                       line_updates[log_file], before)
+        if count_failed(before):
+            print("\n" + "#" * 70)
+            print(f"# {os.path.basename(log_file)}")
+            print("#" * 70)
+            print_comparison(before, after, per_file[log_file])
+        summary.append({"file": log_file, "before": before, "after": after, "reprocess": per_file[log_file]})
+
+    print("\n【去重统计】")
+    print(f"  失败记录={total_refs} 下载任务={len(keys)} 节省下载={total_refs - len(keys)}")
+    return summary
+
+
+async def batch_process(log_dir: str, per_file: bool = False, **options):
     """批量处理所有日志文件"""
     print("=" * 70)
     print(f"批量重处理日志 | 目录: {log_dir} | 模式: {LOG_PATTERN}")
@@ -94,7 +216,10 @@ async def batch_process(log_dir: str):
     for f in log_files:
         print(f"  - {os.path.basename(f)}")
 
-    results = [await process_single_log(f) for f in log_files]
+    if per_file:
+        results = [await process_single_log(f, **options) for f in log_files]
+    else:
+        results = await batch_process_planned(log_files, **options)
 
     # 汇总
     print("\n" + "=" * 70)
@@ -115,8 +240,13 @@ async def batch_process(log_dir: str):
 
 
 if __name__ == "__main__":
-    log_dir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_LOG_DIR
+    parser = build_arg_parser("批量重处理日志目录中的失败记录")
+    parser.add_argument('log_dir', nargs='?', default=DEFAULT_LOG_DIR)
+    parser.add_argument('--per-file', action='store_true', help="逐个文件处理，不做跨文件去重")
+    args = parser.parse_args()
+    log_dir = args.log_dir
     if not os.path.isdir(log_dir):
         print(f"[错误] 目录不存在: {log_dir}")
         sys.exit(1)
-    asyncio.run(batch_process(log_dir))
+    asyncio.run(batch_process(log_dir, per_file=args.per_file, concurrency=args.concurrency,
+                              max_connections=args.max_connections, host_rate=args.host_rate))
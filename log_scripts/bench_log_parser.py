@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+日志解析性能测试 - 对比旧的 readlines/双遍解析与单遍流式解析
+
+生成合成日志（头部行 + URL 行 + 普通日志行），分别计时：
+1. legacy: 旧版 parse_log_records + parse_log_stats（batch_reprocess_logs 中每个文件至少读两遍）
+2. scan_log: 单遍同时得到记录和统计
+3. scan_log(use_mmap=True): mmap 读取
+4. parse_log_stats: 只统计的快速路径
+并校验各方式的结果一致。
+
+使用方式：
+    python bench_log_parser.py [记录数，默认 200000] [--keep 保留生成的日志文件]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from log_utils import (
+    LogRecord, LogStats, _STATS_PATTERN, _RECORD_PATTERN, _FILE_PATTERN, _URL_PATTERN,
+    scan_log, parse_log_stats
+)
+
+STATUSES = ["NEW", "DUP", "PRE_DUP", "FALLBACK_NEW", "RKEY_EXPIRED", "RKEY_FAIL_HTTP", "UPLOAD_FAIL"]
+
+
+# ==========================
+#   旧版实现（对照组）
+# ==========================
+# 以下两个函数为改写前 log_utils 中的实现，原样保留作为基准
+def legacy_parse_log_records(file_path: str) -> tuple[list[str], list[LogRecord]]:
+    """
+    解析日志文件，返回原始行列表和记录列表
+
+    Args:
+        file_path: 日志文件路径
+
+    Returns:
+        (lines: list[str], records: list[LogRecord])
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    records = []
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+
+        res_match = _RECORD_PATTERN.match(line)
+        if res_match:
+            status = res_match.group(1)
+
+            # 提取文件名
+            file_match = _FILE_PATTERN.search(line)
+            file_name = file_match.group(1) if file_match else ""
+
+            # 下一行是 URL
+            url_line = ""
+            url = ""
+            if i + 1 < len(lines):
+                url_line = lines[i + 1].strip()
+                url_match = _URL_PATTERN.match(url_line)
+                if url_match:
+                    url = url_match.group(1)
+
+            records.append(LogRecord(
+                line_index=i,
+                header_line=line,
+                url_line=url_line,
+                status=status,
+                file_name=file_name,
+                url=url,
+            ))
+            i += 2
+        else:
+            i += 1
+
+    return lines, records
+
+
+def legacy_parse_log_stats(file_path: str) -> LogStats:
+    """
+    解析日志文件并统计
+
+    Args:
+        file_path: 日志文件路径
+
+    Returns:
+        LogStats 统计结果
+    """
+    res_counts = defaultdict(int)
+    check_counts = defaultdict(int)
+    down_counts = defaultdict(int)
+    fb_counts = {"Yes": 0, "No": 0}
+    sums = {
+        "T": 0, "D": 0, "N": 0, "DD": 0,
+        "CS": 0, "CF": 0, "FS": 0, "FF": 0,
+        "CN": 0, "CD": 0, "FN": 0, "FD": 0
+    }
+
+    total_lines = 0
+    parsed_lines = 0
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            total_lines += 1
+            match = _STATS_PATTERN.search(line)
+            if match:
+                parsed_lines += 1
+                g = match.groups()
+
+                res_counts[g[0]] += 1
+                check_counts[g[1]] += 1
+                down_counts[g[2]] += 1
+
+                sums["T"] += int(g[3])
+                sums["D"] += int(g[4])
+                sums["N"] += int(g[5])
+                sums["DD"] += int(g[6])
+                sums["CS"] += int(g[7])
+                sums["CF"] += int(g[8])
+                sums["FS"] += int(g[9])
+                sums["FF"] += int(g[10])
+                sums["CN"] += int(g[11])
+                sums["CD"] += int(g[12])
+                sums["FN"] += int(g[13])
+                sums["FD"] += int(g[14])
+
+                if g[15] in fb_counts:
+                    fb_counts[g[15]] += 1
+
+    return LogStats(
+        log_path=file_path,
+        total_lines=total_lines,
+        parsed_lines=parsed_lines,
+        res_counts=dict(res_counts),
+        check_counts=dict(check_counts),
+        down_counts=dict(down_counts),
+        sums=sums,
+        fb_counts=fb_counts,
+    )
+
+
+# ==========================
+#   合成日志
+# ==========================
+def generate_log(path: str, records: int, noise_per_record: int = 3, seed: int = 42):
+    rnd = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(records):
+            for _ in range(noise_per_record):
+                f.write(f"2025-01-01 12:00:{i % 60:02d} [INFO] 群消息处理中 group={rnd.randint(1, 99999)} "
+                        f"msg_id={rnd.getrandbits(48)}\n")
+            status = rnd.choice(STATUSES)
+            md5 = '%032x' % rnd.getrandbits(128)
+            nums = ' '.join(f"{k}:{rnd.randint(0, 9)}" for k in ("T", "D", "N", "DD"))
+            nums2 = ' '.join(f"{k}:{rnd.randint(0, 9)}" for k in ("CS", "CF", "FS", "FF"))
+            nums3 = ' '.join(f"{k}:{rnd.randint(0, 9)}" for k in ("CN", "CD", "FN", "FD"))
+            try_part = "[Try:2] " if rnd.random() < 0.2 else ""
+            f.write(f"[Res: {status}] [Check: 200] [Down: {rnd.choice([200, 403, 0])}] | "
+                    f"[{nums} | {nums2} | {nums3}] | {try_part}[FB:{rnd.choice(['Yes', 'No'])}] "
+                    f"[File: {md5}.gif]\n")
+            f.write(f"[https://gchat.qpic.cn/download?appid=1407&fileid={md5}&rkey=CAESM{md5}&spec=0]\n")
+
+
+def timed(label, func, rounds=3):
+    best = float('inf')
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<40} {best:8.3f}s")
+    return result, best
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    n = int(args[0]) if args else 200000
+    keep = '--keep' in sys.argv
+
+    fd, path = tempfile.mkstemp(prefix='bench-log-', suffix='.log')
+    os.close(fd)
+    try:
+        generate_log(path, n)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"合成日志: {path} ({n} 条记录, {size_mb:.1f} MB)")
+        print("-" * 60)
+
+        def legacy():
+            # batch_reprocess_logs 原流程：处理前统计 + 解析记录
+            return legacy_parse_log_stats(path), legacy_parse_log_records(path)
+
+        (legacy_stats, (_, legacy_records)), t_legacy = timed("legacy (stats + records, 2 passes)", legacy)
+        _, t_legacy_stats = timed("legacy parse_log_stats only", lambda: legacy_parse_log_stats(path))
+        scan, t_scan = timed("scan_log (1 pass)", lambda: scan_log(path, keep_lines=True))
+        scan_mm, t_mmap = timed("scan_log(use_mmap=True) (1 pass)", lambda: scan_log(path, use_mmap=True))
+        stats_text, t_stats = timed("parse_log_stats", lambda: parse_log_stats(path))
+        stats_mm, t_stats_mm = timed("parse_log_stats(use_mmap=True)", lambda: parse_log_stats(path, use_mmap=True))
+
+        # 结果校验（每条记录都有一行统计行，确认对照组确实解析到了它们，否则比较没有意义）
+        assert legacy_stats.parsed_lines == n, f"generator/pattern mismatch: {legacy_stats.parsed_lines} != {n}"
+        for label, s in (("scan_log", scan.stats), ("mmap", scan_mm.stats),
+                         ("stats", stats_text), ("mmap stats", stats_mm)):
+            assert s == legacy_stats, f"{label} stats mismatch: {s} != {legacy_stats}"
+        for label, recs in (("scan_log", scan.records), ("mmap", scan_mm.records)):
+            assert recs == legacy_records, f"{label} records mismatch"
+
+        print("-" * 60)
+        print(f"  结果一致 ✓ ({legacy_stats.parsed_lines} 行统计)  单遍加速: {t_legacy / t_scan:.2f}x "
+              f"(mmap {t_legacy / t_mmap:.2f}x), 仅统计: {t_legacy_stats / t_stats:.2f}x "
+              f"(mmap {t_legacy_stats / t_stats_mm:.2f}x)")
+    finally:
+        if keep:
+            print(f"保留日志文件: {path}")
+        else:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+旁路日志压缩脚本
+
+功能：
+把重处理记录在 <日志>.patches.jsonl 中的状态改写合并回日志文件本身，然后删除旁路日志。
+请在 bot 不再写入这些日志时执行（例如日志轮转之后）。
+
+使用方式：
+    python compact_logs.py [日志文件或目录 ...]
+"""
+
+import os
+import sys
+import glob
+
+from log_utils import DEFAULT_LOG_DIR, LOG_PATTERN, PATCH_JOURNAL_SUFFIX, compact_log
+
+
+def find_journaled_logs(paths: list) -> list:
+    """展开目录参数，返回存在旁路日志的日志文件"""
+    log_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            log_files.extend(sorted(glob.glob(os.path.join(path, LOG_PATTERN))))
+        else:
+            log_files.append(path)
+    return [f for f in log_files if os.path.exists(f + PATCH_JOURNAL_SUFFIX)]
+
+
+def main():
+    paths = sys.argv[1:] or [DEFAULT_LOG_DIR]
+    log_files = find_journaled_logs(paths)
+    if not log_files:
+        print("[完成] 没有需要压缩的旁路日志")
+        return
+
+    total = 0
+    for log_file in log_files:
+        count = compact_log(log_file)
+        total += count
+        print(f"[压缩] {os.path.basename(log_file)}: 写回 {count} 行")
+    print(f"[完成] {len(log_files)} 个日志，共写回 {total} 行")
+
+
+if __name__ == "__main__":
+    main()
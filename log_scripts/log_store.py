@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+日志入库脚本 - 把 bqbq_download_full-*.log 写入可查询的 SQLite 库
+
+LogStats 只有整个文件的总计；入库后可以按时间、状态、appid、节点做聚合，无需重新解析日志。
+
+功能：
+1. ingest: 流式解析日志，每条记录一行（状态、计数器、时间戳、URL 解码字段）
+   - 增量：按字节偏移只读取新追加的完整行；日志被轮转/覆盖时重新入库该文件
+   - 旁路日志（重处理结果）有更新时只改写受影响的记录
+2. report: 基于按小时汇总表（由触发器随记录增删改自动维护）出报表，几个月的数据也是毫秒级
+
+记录时间取自 fileid 中的上传时间（日志行本身没有时间戳），URL 无法解析的记录不计入时间序列。
+
+使用方式：
+    python log_store.py ingest [日志文件或目录 ...]
+    python log_store.py report hourly [--days 7]
+    python log_store.py report status [--days 7]
+    python log_store.py report nodes [--days 7] [--top 20]
+    python log_store.py report files
+"""
+
+import os
+import sys
+import glob
+import time
+import sqlite3
+import argparse
+
+from log_utils import (
+    DEFAULT_LOG_DIR, LOG_PATTERN, FAIL_STATUSES, SUM_KEYS, LogScanner, LogStats, load_patches, journal_size,
+    parse_header, is_record_header, parse_url_line, head_fingerprint, iter_complete_lines, last_line_end
+)
+
+# qq_url 位于仓库根目录
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from qq_url import parse_url, QQUrlError
+
+# ==========================
+#   配置
+# ==========================
+DEFAULT_STORE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_store.db")
+INSERT_BATCH = 5000
+
+_COUNTER_COLUMNS = tuple(k.lower() for k in SUM_KEYS)
+_RECORD_COLUMNS = ("log_file", "line_index", "status", "check_code", "down_code", "fb") + _COUNTER_COLUMNS + (
+    "file_name", "md5", "url", "ts", "appid", "node", "env", "sha1", "size")
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS log_records (
+    log_file TEXT NOT NULL, line_index INTEGER NOT NULL,
+    status TEXT NOT NULL, check_code INTEGER, down_code INTEGER, fb TEXT,
+    {', '.join(f'{c} INTEGER' for c in _COUNTER_COLUMNS)},
+    file_name TEXT, md5 TEXT, url TEXT,
+    ts INTEGER,                 -- 上传时间（秒，来自 fileid）
+    appid INTEGER, node TEXT, env TEXT, sha1 TEXT, size INTEGER,
+    PRIMARY KEY (log_file, line_index)
+);
+CREATE INDEX IF NOT EXISTS idx_log_records_ts ON log_records(ts);
+CREATE INDEX IF NOT EXISTS idx_log_records_md5 ON log_records(md5);
+
+-- 按小时汇总（hour = ts / 3600；无时间戳为 -1，无 appid 为 -1，无节点为 ''）
+CREATE TABLE IF NOT EXISTS log_hourly (
+    hour INTEGER NOT NULL, status TEXT NOT NULL, appid INTEGER NOT NULL, node TEXT NOT NULL,
+    n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, status, appid, node)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_log_records_ins AFTER INSERT ON log_records BEGIN
+    INSERT INTO log_hourly (hour, status, appid, node, n)
+    VALUES (COALESCE(NEW.ts / 3600, -1), NEW.status, COALESCE(NEW.appid, -1), COALESCE(NEW.node, ''), 1)
+    ON CONFLICT (hour, status, appid, node) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_log_records_del AFTER DELETE ON log_records BEGIN
+    UPDATE log_hourly SET n = n - 1
+    WHERE hour = COALESCE(OLD.ts / 3600, -1) AND status = OLD.status
+      AND appid = COALESCE(OLD.appid, -1) AND node = COALESCE(OLD.node, '');
+END;
+CREATE TRIGGER IF NOT EXISTS trg_log_records_upd AFTER UPDATE OF status, ts, appid, node ON log_records BEGIN
+    UPDATE log_hourly SET n = n - 1
+    WHERE hour = COALESCE(OLD.ts / 3600, -1) AND status = OLD.status
+      AND appid = COALESCE(OLD.appid, -1) AND node = COALESCE(OLD.node, '');
+    INSERT INTO log_hourly (hour, status, appid, node, n)
+    VALUES (COALESCE(NEW.ts / 3600, -1), NEW.status, COALESCE(NEW.appid, -1), COALESCE(NEW.node, ''), 1)
+    ON CONFLICT (hour, status, appid, node) DO UPDATE SET n = n + 1;
+END;
+
+-- 每个日志文件的入库进度
+CREATE TABLE IF NOT EXISTS log_files (
+    log_file TEXT PRIMARY KEY,
+    inode INTEGER, head TEXT,
+    offset INTEGER NOT NULL DEFAULT 0,       -- 已入库到的字节偏移（总在完整行之后）
+    line_count INTEGER NOT NULL DEFAULT 0,   -- 偏移之前的行数
+    journal INTEGER NOT NULL DEFAULT 0,      -- 已应用的旁路日志大小
+    updated_at REAL
+);
+"""
+
+
+def get_conn(db_path: str = DEFAULT_STORE_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# ==========================
+#   记录解析
+# ==========================
+def record_row(log_file: str, line_index: int, header: str, url: str) -> tuple:
+    """把一条记录（头部行 + URL）转为 log_records 的一行"""
+    fields = parse_header(header)
+    status, file_name = fields.status, fields.file_name
+    if fields.counters is not None:
+        counters = (fields.check, fields.down, fields.fb) + tuple(fields.counters[k] for k in SUM_KEYS)
+    else:
+        counters = (None,) * (3 + len(_COUNTER_COLUMNS))
+
+    ts = appid = node = env = sha1 = size = None
+    if url and 'fileid=' in url:
+        try:
+            info = parse_url(url)
+        except QQUrlError:
+            info = None
+        if info is not None:
+            appid = info.appid
+            if info.fileid:
+                fid = info.fileid
+                if fid.upload_time_us:
+                    ts = fid.upload_time_us // 1_000_000
+                appid = appid if appid is not None else fid.appid
+                node, env, sha1, size = fid.node, fid.env, fid.sha1, fid.size
+
+    return (log_file, line_index, status) + counters + (
+        file_name, file_name.split('.')[0] if file_name else "", url, ts, appid, node, env, sha1, size)
+
+
+_UPSERT_SQL = (
+    f"INSERT INTO log_records ({', '.join(_RECORD_COLUMNS)}) VALUES ({', '.join('?' * len(_RECORD_COLUMNS))}) "
+    f"ON CONFLICT (log_file, line_index) DO UPDATE SET "
+    + ', '.join(f"{c}=excluded.{c}" for c in _RECORD_COLUMNS[2:])
+)
+
+
+# ==========================
+#   入库
+# ==========================
+class _OffsetTracker:
+    """包装 bytes 行迭代器，记录最近一行的起始字节偏移"""
+
+    def __init__(self, lines, start: int):
+        self._lines = lines
+        self.pos = start
+        self.last_start = start
+
+    def __iter__(self):
+        for raw in self._lines:
+            self.last_start = self.pos
+            self.pos += len(raw)
+            yield raw
+
+
+def _apply_journal(conn, log_file: str, patches: dict, line_count: int) -> int:
+    """把旁路日志中的改写应用到已入库的记录，返回更新的记录数"""
+    if not patches:
+        return 0
+    rows = []
+    for index, text in patches.items():
+        if index >= line_count or not is_record_header(text):
+            continue
+        url_line = patches.get(index + 1)
+        if url_line is None:
+            row = conn.execute("SELECT url FROM log_records WHERE log_file=? AND line_index=?",
+                               (log_file, index)).fetchone()
+            url = row['url'] if row else ""
+        else:
+            url = parse_url_line(url_line)
+        rows.append(record_row(log_file, index, text.strip(), url))
+    conn.executemany(_UPSERT_SQL, rows)
+    return len(rows)
+
+
+def ingest_log(conn, log_file: str) -> dict:
+    """
+    增量入库一个日志文件
+
+    Returns:
+        dict: {"inserted": 新增记录数, "patched": 按旁路日志更新的记录数, "reset": 是否重新入库}
+    """
+    log_file = os.path.abspath(log_file)
+    state = conn.execute("SELECT * FROM log_files WHERE log_file=?", (log_file,)).fetchone()
+    patches = load_patches(log_file)
+    patch_size = journal_size(log_file)
+    result = {"inserted": 0, "patched": 0, "reset": False}
+
+    with open(log_file, 'rb') as f:
+        st = os.fstat(f.fileno())
+        offset = line_count = 0
+        if state:
+            if (state['inode'] == st.st_ino and state['offset'] <= st.st_size
+                    and state['head'] == head_fingerprint(f, state['offset'])):
+                offset, line_count = state['offset'], state['line_count']
+            else:
+                print(f"[入库] 日志已被截断或轮转，重新入库: {log_file}")
+                result["reset"] = True
+
+        conn.execute("BEGIN")
+        try:
+            if result["reset"]:
+                conn.execute("DELETE FROM log_records WHERE log_file=?", (log_file,))
+            elif state and state['journal'] != patch_size:
+                result["patched"] = _apply_journal(conn, log_file, patches, line_count)
+
+            # 只读到最后一个换行符为止
+            complete_end = last_line_end(f, offset, st.st_size)
+
+            f.seek(offset)
+            tracker = _OffsetTracker(iter_complete_lines(f, complete_end), offset)
+            base = LogStats(log_path=log_file, total_lines=line_count, parsed_lines=0, res_counts={},
+                            check_counts={}, down_counts={}, sums=dict.fromkeys(SUM_KEYS, 0),
+                            fb_counts={"Yes": 0, "No": 0})
+            scanner = LogScanner(tracker, log_file, binary=True, base=base, patches=patches)
+
+            end_offset, end_lines = complete_end, None
+            batch = []
+            for rec in scanner:
+                if not rec.url_line and rec.line_index == scanner.total_lines - 1 and rec.line_index >= line_count:
+                    # 最后一行是头部行、URL 行还没写入：留到下次
+                    end_offset, end_lines = tracker.last_start, rec.line_index
+                    break
+                batch.append(record_row(log_file, rec.line_index, rec.header_line, rec.url))
+                if len(batch) >= INSERT_BATCH:
+                    conn.executemany(_UPSERT_SQL, batch)
+                    result["inserted"] += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany(_UPSERT_SQL, batch)
+                result["inserted"] += len(batch)
+
+            conn.execute(
+                """INSERT OR REPLACE INTO log_files (log_file, inode, head, offset, line_count, journal, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (log_file, st.st_ino, head_fingerprint(f, end_offset), end_offset,
+                 scanner.total_lines if end_lines is None else end_lines, patch_size, time.time())
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return result
+
+
+def find_logs(paths: list) -> list:
+    log_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            log_files.extend(sorted(glob.glob(os.path.join(path, LOG_PATTERN))))
+        else:
+            log_files.append(path)
+    return log_files
+
+
+# ==========================
+#   报表
+# ==========================
+def _since(days: float) -> int:
+    """起始小时（hour 编号）；days 为 0 表示不限"""
+    return int((time.time() - days * 86400) // 3600) if days else 0
+
+
+def _fail_placeholders() -> tuple:
+    statuses = sorted(FAIL_STATUSES)
+    return ', '.join('?' * len(statuses)), statuses
+
+
+def report_hourly(conn, days: float = 7) -> list:
+    """每小时的记录数、失败数、失败率"""
+    marks, statuses = _fail_placeholders()
+    return conn.execute(
+        f"""SELECT strftime('%Y-%m-%d %H:00', hour * 3600, 'unixepoch', 'localtime') AS bucket,
+                   SUM(n) AS total, SUM(CASE WHEN status IN ({marks}) THEN n ELSE 0 END) AS failed
+            FROM log_hourly WHERE hour >= ? GROUP BY hour HAVING total > 0 ORDER BY hour""",
+        (*statuses, _since(days))
+    ).fetchall()
+
+
+def report_status(conn, days: float = 0) -> list:
+    """各状态的记录数（days=0 时包含没有时间戳的记录）"""
+    hour_min = _since(days) if days else -1
+    return conn.execute(
+        "SELECT status, SUM(n) AS total FROM log_hourly WHERE hour >= ? GROUP BY status "
+        "HAVING total > 0 ORDER BY total DESC", (hour_min,)
+    ).fetchall()
+
+
+def report_nodes(conn, days: float = 0, top: int = 20) -> list:
+    """按 appid / 服务器节点统计失败数和失败率，失败最多的在前"""
+    marks, statuses = _fail_placeholders()
+    hour_min = _since(days) if days else -1
+    return conn.execute(
+        f"""SELECT appid, node, SUM(n) AS total,
+                   SUM(CASE WHEN status IN ({marks}) THEN n ELSE 0 END) AS failed
+            FROM log_hourly WHERE hour >= ? GROUP BY appid, node HAVING total > 0
+            ORDER BY failed DESC, total DESC LIMIT ?""",
+        (*statuses, hour_min, top)
+    ).fetchall()
+
+
+def report_files(conn) -> list:
+    return conn.execute(
+        """SELECT f.log_file, f.line_count, f.offset, COUNT(r.line_index) AS records
+           FROM log_files f LEFT JOIN log_records r ON r.log_file = f.log_file
+           GROUP BY f.log_file ORDER BY f.log_file"""
+    ).fetchall()
+
+
+def _rate(failed: int, total: int) -> str:
+    return f"{failed / total * 100:.1f}%" if total else "-"
+
+
+def print_report(conn, kind: str, days: float, top: int):
+    start = time.perf_counter()
+    if kind == 'hourly':
+        rows = report_hourly(conn, days)
+        print(f"{'时间':<18} {'记录':>8} {'失败':>8} {'失败率':>8}")
+        for r in rows:
+            print(f"{r['bucket']:<18} {r['total']:>8} {r['failed']:>8} {_rate(r['failed'], r['total']):>8}")
+    elif kind == 'status':
+        rows = report_status(conn, days)
+        total = sum(r['total'] for r in rows)
+        print(f"{'状态':<18} {'记录':>8} {'占比':>8}")
+        for r in rows:
+            print(f"{r['status']:<18} {r['total']:>8} {_rate(r['total'], total):>8}")
+    elif kind == 'nodes':
+        rows = report_nodes(conn, days, top)
+        print(f"{'appid':>6} {'节点':<24} {'记录':>8} {'失败':>8} {'失败率':>8}")
+        for r in rows:
+            appid = r['appid'] if r['appid'] >= 0 else '-'
+            print(f"{appid:>6} {r['node'] or '-':<24} {r['total']:>8} {r['failed']:>8} "
+                  f"{_rate(r['failed'], r['total']):>8}")
+    elif kind == 'files':
+        for r in report_files(conn):
+            print(f"{r['records']:>8} 条  {r['line_count']:>9} 行  {r['log_file']}")
+    print(f"({(time.perf_counter() - start) * 1000:.1f} ms)")
+
+
+# ==========================
+#   命令行
+# ==========================
+def main():
+    parser = argparse.ArgumentParser(description="日志入库与聚合报表")
+    parser.add_argument('--db', default=DEFAULT_STORE_DB, help="入库数据库路径")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_ingest = sub.add_parser('ingest', help="增量入库日志")
+    p_ingest.add_argument('paths', nargs='*', default=[DEFAULT_LOG_DIR])
+
+    p_report = sub.add_parser('report', help="聚合报表")
+    p_report.add_argument('kind', choices=['hourly', 'status', 'nodes', 'files'])
+    p_report.add_argument('--days', type=float, default=None, help="只统计最近 N 天（hourly 默认 7，其余默认不限）")
+    p_report.add_argument('--top', type=int, default=20)
+
+    args = parser.parse_args()
+    conn = get_conn(args.db)
+    try:
+        if args.command == 'ingest':
+            start = time.perf_counter()
+            total = 0
+            for log_file in find_logs(args.paths):
+                result = ingest_log(conn, log_file)
+                total += result["inserted"]
+                print(f"[入库] {os.path.basename(log_file)}: 新增 {result['inserted']} 条"
+                      + (f"，旁路日志更新 {result['patched']} 条" if result["patched"] else ""))
+            print(f"[完成] 新增 {total} 条，用时 {time.perf_counter() - start:.1f}s")
+        else:
+            days = args.days if args.days is not None else (7 if args.kind == 'hourly' else 0)
+            print_report(conn, args.kind, days, args.top)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,9 +8,12 @@
 3. 统一的失败类型定义
 """
 
+import hashlib
+import json
+import os
 import re
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from typing import Optional
 
 # ==========================
@@ -20,6 +23,13 @@ DEFAULT_LOG_DIR = r"D:\bqbq_bot_dev\nonebot2-2.4.4\nonebot\plugins\bqbq"
 DEFAULT_LOG_FILE = r"D:\bqbq_bot_dev\nonebot2-2.4.4\nonebot\plugins\bqbq\bqbq_download_full-日志1.log"
 LOG_PATTERN = "bqbq_download_full-*.log"
 
+# 增量统计检查点：与日志同目录，文件名为 <日志名><后缀>
+STATS_CHECKPOINT_SUFFIX = ".stats.json"
+# 用文件开头这么多字节的哈希识别"同一个文件"（检测被轮转/覆盖）
+CHECKPOINT_HEAD_BYTES = 4096
+# 重处理结果的旁路日志：<日志名><后缀>，按行号记录改写后的内容，读取时叠加，compact_log 时写回
+PATCH_JOURNAL_SUFFIX = ".patches.jsonl"
+
 # 失败状态类型（用于筛选需要重处理的记录）
 FAIL_STATUSES = frozenset([
     "RKEY_FAIL_HTTP", "RKEY_FAIL_NET", "RKEY_API_FAIL", "RKEY_EXPIRED",
@@ -76,85 +86,199 @@ _FILE_PATTERN = re.compile(r'\[File:\s*([^\]]+)\]')
 _URL_PATTERN = re.compile(r'^\[(.+)\]$')
 
 
-def parse_log_records(file_path: str) -> tuple[list[str], list[LogRecord]]:
-    """
-    解析日志文件，返回原始行列表和记录列表
+# 预过滤子串：记录行和统计行都包含 "[Res:"，先用 in 判断，避免对每行执行正则
+_RES_MARKER = '[Res:'
+_RES_MARKER_BYTES = b'[Res:'
 
-    Args:
-        file_path: 日志文件路径
+SUM_KEYS = ("T", "D", "N", "DD", "CS", "CF", "FS", "FF", "CN", "CD", "FN", "FD")
 
-    Returns:
-        (lines: list[str], records: list[LogRecord])
-    """
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+# mmap 模式下每次切分的块大小
+_MMAP_CHUNK = 8 * 1024 * 1024
 
-    records = []
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
 
-        res_match = _RECORD_PATTERN.match(line)
-        if res_match:
-            status = res_match.group(1)
+@dataclass
+class HeaderFields:
+    """头部行中的字段；没有统计部分时 check / down / fb / counters 为 None"""
+    status: str
+    file_name: str
+    check: Optional[int] = None
+    down: Optional[int] = None
+    fb: Optional[str] = None
+    counters: Optional[dict] = None  # SUM_KEYS -> int
 
-            # 提取文件名
-            file_match = _FILE_PATTERN.search(line)
-            file_name = file_match.group(1) if file_match else ""
 
-            # 下一行是 URL
-            url_line = ""
-            url = ""
-            if i + 1 < len(lines):
-                url_line = lines[i + 1].strip()
-                url_match = _URL_PATTERN.match(url_line)
-                if url_match:
-                    url = url_match.group(1)
+def is_record_header(line: str) -> bool:
+    """是否为记录的头部行（以 [Res: ...] 开头）"""
+    return _RECORD_PATTERN.match(line.strip()) is not None
 
-            records.append(LogRecord(
-                line_index=i,
-                header_line=line,
-                url_line=url_line,
-                status=status,
-                file_name=file_name,
-                url=url,
-            ))
-            i += 2
-        else:
-            i += 1
 
-    return lines, records
+def parse_header(line: str) -> HeaderFields:
+    """解析头部行：状态、文件名，以及统计部分（Check / Down / FB / 各计数器）"""
+    res = _RECORD_PATTERN.search(line)
+    file_match = _FILE_PATTERN.search(line)
+    fields = HeaderFields(status=res.group(1) if res else "", file_name=file_match.group(1) if file_match else "")
+    match = _STATS_PATTERN.search(line)
+    if match:
+        g = match.groups()
+        fields.status = g[0]
+        fields.check, fields.down, fields.fb = int(g[1]), int(g[2]), g[15]
+        fields.counters = {key: int(value) for key, value in zip(SUM_KEYS, g[3:15])}
+    return fields
 
 
-def parse_log_stats(file_path: str) -> LogStats:
-    """
-    解析日志文件并统计
+def parse_url_line(line: str) -> str:
+    """URL 行 "[url]" 中的 URL，格式不符时返回空字符串"""
+    match = _URL_PATTERN.match(line.strip())
+    return match.group(1) if match else ""
 
-    Args:
-        file_path: 日志文件路径
 
-    Returns:
-        LogStats 统计结果
+@dataclass
+class LogScan:
+    """单次扫描的结果：原始行（可选）、记录列表、统计"""
+    lines: Optional[list]
+    records: list
+    stats: LogStats
+
+
+class LogScanner:
     """
-    res_counts = defaultdict(int)
-    check_counts = defaultdict(int)
-    down_counts = defaultdict(int)
-    fb_counts = {"Yes": 0, "No": 0}
-    sums = {
-        "T": 0, "D": 0, "N": 0, "DD": 0,
-        "CS": 0, "CF": 0, "FS": 0, "FF": 0,
-        "CN": 0, "CD": 0, "FN": 0, "FD": 0
-    }
+    单遍流式日志解析器：逐行读取，同时产出 LogRecord 并累计 LogStats
 
-    total_lines = 0
-    parsed_lines = 0
+    用法:
+        scanner = LogScanner(lines, file_path)
+        for rec in scanner:
+            ...
+        stats = scanner.stats   # 迭代结束后可用
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            total_lines += 1
-            match = _STATS_PATTERN.search(line)
+    Args:
+        lines: 行迭代器，可来自文件对象、iter_log_lines 或内存中的行列表
+        file_path: 写入 LogStats.log_path
+        keep_lines: 保留原始行（用于改写日志文件）
+        binary: lines 为 utf-8 bytes 行；只有需要解析的行才会被解码
+        base: 已有的统计结果，在其基础上继续累计（增量统计），行号从 base.total_lines 开始
+        patches: {行号: 改写后的行内容}，读取时替换对应行（见 load_patches）
+    """
+
+    def __init__(self, lines, file_path: str = "", keep_lines: bool = False, binary: bool = False,
+                 base: LogStats = None, patches: dict = None):
+        self._lines = lines
+        self._binary = binary
+        self._patches = patches or None
+        self.file_path = file_path
+        self.lines = [] if keep_lines else None
+        self.total_lines = base.total_lines if base else 0
+        self.parsed_lines = base.parsed_lines if base else 0
+        self.res_counts = defaultdict(int, base.res_counts if base else {})
+        self.check_counts = defaultdict(int, base.check_counts if base else {})
+        self.down_counts = defaultdict(int, base.down_counts if base else {})
+        self.fb_counts = dict(base.fb_counts) if base else {"Yes": 0, "No": 0}
+        self.sums = dict(base.sums) if base else dict.fromkeys(SUM_KEYS, 0)
+
+    def _count_stats(self, line: str):
+        match = _STATS_PATTERN.search(line)
+        if not match:
+            return
+        self.parsed_lines += 1
+        g = match.groups()
+        self.res_counts[g[0]] += 1
+        self.check_counts[g[1]] += 1
+        self.down_counts[g[2]] += 1
+        sums = self.sums
+        sums["T"] += int(g[3])
+        sums["D"] += int(g[4])
+        sums["N"] += int(g[5])
+        sums["DD"] += int(g[6])
+        sums["CS"] += int(g[7])
+        sums["CF"] += int(g[8])
+        sums["FS"] += int(g[9])
+        sums["FF"] += int(g[10])
+        sums["CN"] += int(g[11])
+        sums["CD"] += int(g[12])
+        sums["FN"] += int(g[13])
+        sums["FD"] += int(g[14])
+        if g[15] in self.fb_counts:
+            self.fb_counts[g[15]] += 1
+
+    def __iter__(self):
+        keep = self.lines
+        binary = self._binary
+        patches = self._patches
+        pending = None  # 等待下一行 URL 的头部行
+        index = self.total_lines - 1
+        for index, raw in enumerate(self._lines, self.total_lines):
+            if patches and index in patches:
+                raw = patches[index] + '\n'
+            elif binary:
+                if keep is None and pending is None and _RES_MARKER_BYTES not in raw:
+                    continue
+                raw = raw.decode('utf-8').replace('\r\n', '\n')
+            if keep is not None:
+                keep.append(raw)
+
+            if pending is not None:
+                # 头部行的下一行固定视为 URL 行（与 parse_log_records 的原有语义一致）
+                status, file_name, header, header_index = pending
+                pending = None
+                url_line = raw.strip()
+                url_match = _URL_PATTERN.match(url_line)
+                yield LogRecord(line_index=header_index, header_line=header, url_line=url_line,
+                                status=status, file_name=file_name,
+                                url=url_match.group(1) if url_match else "")
+                if _RES_MARKER in raw:
+                    self._count_stats(raw)
+                continue
+
+            if _RES_MARKER not in raw:
+                continue
+            self._count_stats(raw)
+            line = raw.strip()
+            res_match = _RECORD_PATTERN.match(line)
+            if res_match:
+                file_match = _FILE_PATTERN.search(line)
+                pending = (res_match.group(1), file_match.group(1) if file_match else "", line, index)
+
+        self.total_lines = index + 1
+        if pending is not None:
+            # 文件末尾的头部行没有 URL 行
+            status, file_name, header, header_index = pending
+            yield LogRecord(line_index=header_index, header_line=header, url_line="",
+                            status=status, file_name=file_name, url="")
+
+    def _patched(self, lines):
+        """按行号替换旁路日志中的改写（binary 模式下编码回 bytes）"""
+        patches = self._patches
+        binary = self._binary
+        for index, raw in enumerate(lines, self.total_lines):
+            if index in patches:
+                raw = patches[index] + '\n'
+                if binary:
+                    raw = raw.encode('utf-8')
+            yield raw
+
+    def count_only(self) -> LogStats:
+        """
+        只累计统计的快速路径：不构造记录，也不保留原始行
+
+        与旧版 parse_log_stats 相同的紧凑循环：计数器都是局部变量，每行只做一次正则搜索
+        （正则以字面量开头，不匹配的行由 C 层快速跳过，不需要额外的子串预过滤）。
+        binary 模式下只解码包含 "[Res:" 的行。
+        """
+        lines = self._patched(self._lines) if self._patches else self._lines
+        search = _STATS_PATTERN.search
+        res_counts, check_counts, down_counts = self.res_counts, self.check_counts, self.down_counts
+        fb_counts, sums = self.fb_counts, self.sums
+        total = self.total_lines
+        parsed = 0
+        binary = self._binary
+        for line in lines:
+            total += 1
+            if binary:
+                if _RES_MARKER_BYTES not in line:
+                    continue
+                line = line.decode('utf-8')
+            match = search(line)
             if match:
-                parsed_lines += 1
+                parsed += 1
                 g = match.groups()
 
                 res_counts[g[0]] += 1
@@ -177,16 +301,367 @@ def parse_log_stats(file_path: str) -> LogStats:
                 if g[15] in fb_counts:
                     fb_counts[g[15]] += 1
 
-    return LogStats(
-        log_path=file_path,
-        total_lines=total_lines,
-        parsed_lines=parsed_lines,
-        res_counts=dict(res_counts),
-        check_counts=dict(check_counts),
-        down_counts=dict(down_counts),
-        sums=sums,
-        fb_counts=fb_counts,
-    )
+        self.total_lines = total
+        self.parsed_lines += parsed
+        return self.stats
+
+    @property
+    def stats(self) -> LogStats:
+        return LogStats(
+            log_path=self.file_path,
+            total_lines=self.total_lines,
+            parsed_lines=self.parsed_lines,
+            res_counts=dict(self.res_counts),
+            check_counts=dict(self.check_counts),
+            down_counts=dict(self.down_counts),
+            sums=dict(self.sums),
+            fb_counts=dict(self.fb_counts),
+        )
+
+
+def iter_log_lines(file_path: str, use_mmap: bool = False):
+    """
+    逐行读取日志文件，保留换行符
+
+    use_mmap=False 时产出 str；use_mmap=True 时通过 mmap 读取并产出 bytes 行（交给
+    LogScanner(binary=True)），只解码包含 "[Res:" 的行。
+    按 bench_log_parser.py 的测量，mmap 并不比文本模式快（基本持平或略慢），因此默认不使用。
+    """
+    if not use_mmap:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            yield from f
+        return
+
+    import mmap
+    with open(file_path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法 mmap
+            return
+        with mm:
+            # 按大块切分行（C 层 splitlines），比逐次 mm.readline() 快得多
+            size = len(mm)
+            pos = 0
+            while pos < size:
+                end = mm.find(b'\n', min(pos + _MMAP_CHUNK, size) - 1)
+                end = size if end < 0 else end + 1
+                yield from mm[pos:end].splitlines(keepends=True)
+                pos = end
+
+
+def _scanner(file_path: str, keep_lines: bool = False, use_mmap: bool = False, overlay: bool = True) -> LogScanner:
+    patches = load_patches(file_path) if overlay else None
+    return LogScanner(iter_log_lines(file_path, use_mmap), file_path, keep_lines=keep_lines, binary=use_mmap,
+                      patches=patches)
+
+
+def iter_log_records(file_path: str, use_mmap: bool = False, overlay: bool = True):
+    """流式产出 LogRecord（不保留原始行）"""
+    yield from _scanner(file_path, use_mmap=use_mmap, overlay=overlay)
+
+
+def scan_log(file_path: str, keep_lines: bool = False, use_mmap: bool = False, overlay: bool = True) -> LogScan:
+    """
+    单遍扫描日志文件，同时得到记录列表和统计
+
+    Args:
+        file_path: 日志文件路径
+        keep_lines: 保留原始行（改写日志时需要）
+        use_mmap: 通过 mmap 读取
+        overlay: 叠加旁路日志中的重处理结果（默认开启）
+
+    Returns:
+        LogScan
+    """
+    scanner = _scanner(file_path, keep_lines, use_mmap, overlay)
+    records = list(scanner)
+    return LogScan(lines=scanner.lines, records=records, stats=scanner.stats)
+
+
+def scan_lines(lines: list, file_path: str = "") -> LogScan:
+    """扫描内存中的行列表（例如改写后的日志内容），无需重新读取文件"""
+    scanner = LogScanner(lines, file_path)
+    records = list(scanner)
+    return LogScan(lines=lines, records=records, stats=scanner.stats)
+
+
+def parse_log_records(file_path: str, overlay: bool = True) -> tuple[list[str], list[LogRecord]]:
+    """
+    解析日志文件，返回原始行列表和记录列表
+
+    Args:
+        file_path: 日志文件路径
+        overlay: 叠加旁路日志中的重处理结果
+
+    Returns:
+        (lines: list[str], records: list[LogRecord])
+    """
+    scan = scan_log(file_path, keep_lines=True, overlay=overlay)
+    return scan.lines, scan.records
+
+
+def parse_log_stats(file_path: str, use_mmap: bool = False, overlay: bool = True) -> LogStats:
+    """
+    解析日志文件并统计
+
+    Args:
+        file_path: 日志文件路径
+        use_mmap: 通过 mmap 读取（大文件）
+        overlay: 叠加旁路日志中的重处理结果
+
+    Returns:
+        LogStats 统计结果
+    """
+    return _scanner(file_path, use_mmap=use_mmap, overlay=overlay).count_only()
+
+
+def adjust_stats(stats: LogStats, removed_lines, added_lines) -> LogStats:
+    """
+    在已有统计上替换若干行：减去 removed_lines 的贡献、加上 added_lines 的贡献，
+    用于改写少量行后得到新统计而无需重读整个文件
+    """
+    removed = LogScanner(removed_lines).count_only()
+    scanner = LogScanner(added_lines, stats.log_path, base=stats)
+    scanner.count_only()
+    scanner.total_lines = stats.total_lines
+    scanner.parsed_lines -= removed.parsed_lines
+    for name in ("res_counts", "check_counts", "down_counts"):
+        counts = getattr(scanner, name)
+        for key, value in getattr(removed, name).items():
+            counts[key] -= value
+            if not counts[key]:
+                del counts[key]
+    for key, value in removed.fb_counts.items():
+        scanner.fb_counts[key] -= value
+    for key, value in removed.sums.items():
+        scanner.sums[key] -= value
+    return scanner.stats
+
+
+# ==========================
+#   旁路状态日志（重处理结果）
+# ==========================
+def _journal_path(file_path: str) -> str:
+    return file_path + PATCH_JOURNAL_SUFFIX
+
+
+def _log_identity(file_path: str, head_len: int = None) -> dict:
+    """
+    日志文件的身份：inode + 前 head_len 字节的指纹，用于判断旁路日志是否仍对应这个文件。
+    head_len 在创建旁路日志时确定（文件较小时之后的追加不会改变这部分内容）。
+    """
+    with open(file_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if head_len is None:
+            head_len = min(st.st_size, CHECKPOINT_HEAD_BYTES)
+        return {"inode": st.st_ino, "head_len": head_len, "head": head_fingerprint(f, head_len)}
+
+
+def load_patches(file_path: str) -> dict:
+    """
+    读取旁路日志，返回 {行号: 改写后的行内容}（同一行以最后一次记录为准）
+
+    旁路日志第一行记录日志文件的 inode 和文件头指纹；日志被轮转/覆盖后旁路日志作废并被忽略。
+    日志只会被追加，行号在追加后保持不变。
+    """
+    path = _journal_path(file_path)
+    if not os.path.exists(path):
+        return {}
+
+    patches = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        header = None
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # 最后一行可能因中断而不完整
+                continue
+            if header is None:
+                header = entry
+                if header != _log_identity(file_path, header.get("head_len", CHECKPOINT_HEAD_BYTES)):
+                    print(f"[旁路日志] 与日志文件不匹配（已被轮转或覆盖），忽略: {path}")
+                    return {}
+                continue
+            patches[entry["line"]] = entry["text"]
+    return patches
+
+
+def append_patches(file_path: str, updates: dict):
+    """
+    把 {行号: 新内容} 追加到旁路日志，不改动日志文件本身（与正在追加日志的 bot 互不干扰）
+    """
+    if not updates:
+        return
+    path = _journal_path(file_path)
+    new_journal = not os.path.exists(path)
+    with open(path, 'a', encoding='utf-8') as f:
+        if new_journal:
+            f.write(json.dumps(_log_identity(file_path)) + "\n")
+        for line_index in sorted(updates):
+            f.write(json.dumps({"line": line_index, "text": updates[line_index]}, ensure_ascii=False) + "\n")
+
+
+def journal_size(file_path: str) -> int:
+    try:
+        return os.path.getsize(_journal_path(file_path))
+    except OSError:
+        return 0
+
+
+def compact_log(file_path: str) -> int:
+    """
+    离线压缩：把旁路日志中的改写合并回日志文件，然后删除旁路日志和增量统计检查点
+
+    应在 bot 不写入该日志时执行；写回期间若文件又被追加，追加的内容会原样保留。
+
+    Returns:
+        int: 写回的行数
+    """
+    patches = load_patches(file_path)
+    if not patches:
+        if os.path.exists(_journal_path(file_path)):
+            os.remove(_journal_path(file_path))
+        return 0
+
+    tmp_path = file_path + ".compact.tmp"
+    with open(file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        for index, raw in enumerate(iter(src.readline, b'')):
+            if index in patches:
+                ending = b'\r\n' if raw.endswith(b'\r\n') else b'\n'
+                raw = patches[index].encode('utf-8') + ending
+            dst.write(raw)
+    os.replace(tmp_path, file_path)
+    os.remove(_journal_path(file_path))
+    checkpoint = _checkpoint_path(file_path)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return len(patches)
+
+
+# ==========================
+#   增量统计
+# ==========================
+def _checkpoint_path(file_path: str) -> str:
+    return file_path + STATS_CHECKPOINT_SUFFIX
+
+
+def head_fingerprint(f, length: int) -> str:
+    """文件开头 length 字节的 sha1，用于识别文件被轮转或覆盖"""
+    f.seek(0)
+    return hashlib.sha1(f.read(min(length, CHECKPOINT_HEAD_BYTES))).hexdigest()
+
+
+def _load_checkpoint(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_checkpoint(path: str, checkpoint: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def iter_complete_lines(f, end: int):
+    """
+    从当前位置读到 end，逐行产出以换行结尾的完整行 (bytes)
+
+    按 _MMAP_CHUNK 分块读取；块末尾未结束的半行留到下一块拼接，不会被拆成两行。
+    """
+    remaining = end - f.tell()
+    carry = b''
+    while remaining > 0:
+        chunk = f.read(min(_MMAP_CHUNK, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        chunk = carry + chunk
+        cut = chunk.rfind(b'\n') + 1
+        carry = chunk[cut:]
+        yield from chunk[:cut].splitlines(keepends=True)
+    if carry:
+        yield carry
+
+
+def last_line_end(f, start: int, end: int) -> int:
+    """[start, end) 范围内最后一个换行符之后的偏移，没有换行符时返回 start（从后往前分块查找）"""
+    pos = end
+    while pos > start:
+        block_start = max(start, pos - _MMAP_CHUNK)
+        f.seek(block_start)
+        i = f.read(pos - block_start).rfind(b'\n')
+        if i >= 0:
+            return block_start + i + 1
+        pos = block_start
+    return start
+
+
+def parse_log_stats_incremental(file_path: str, checkpoint_path: str = None) -> LogStats:
+    """
+    增量统计：从检查点记录的字节偏移继续解析追加的内容，结果与 parse_log_stats 一致
+
+    检查点保存 (偏移, inode, 文件头指纹, 截至偏移的 LogStats)。偏移总是落在完整行之后，
+    末尾尚未写完的半行只计入本次结果、不写入检查点，下次会重新读取。
+    文件变小、inode 变化或文件头不一致（被截断/轮转）时回退为全量扫描。
+
+    Args:
+        file_path: 日志文件路径
+        checkpoint_path: 检查点文件路径，默认为 <日志路径>.stats.json
+
+    Returns:
+        LogStats 统计结果
+    """
+    checkpoint_path = checkpoint_path or _checkpoint_path(file_path)
+    checkpoint = _load_checkpoint(checkpoint_path)
+    patches = load_patches(file_path)
+    patch_size = journal_size(file_path)
+
+    with open(file_path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        base = None
+        offset = 0
+        if checkpoint:
+            offset = checkpoint.get("offset", 0)
+            if checkpoint.get("journal", 0) != patch_size:
+                # 旁路日志有新的改写，可能涉及检查点之前的行
+                print(f"[增量统计] 旁路日志已更新，重新全量统计: {file_path}")
+                offset = 0
+            elif (checkpoint.get("inode") == st.st_ino and offset <= st.st_size
+                    and checkpoint.get("head") == head_fingerprint(f, offset)):
+                base = LogStats(**checkpoint["stats"])
+                base.log_path = file_path
+            else:
+                print(f"[增量统计] 日志已被截断或轮转，重新全量统计: {file_path}")
+                offset = 0
+
+        # 只处理到最后一个换行符为止，末尾半行单独处理
+        complete_end = last_line_end(f, offset, st.st_size)
+
+        f.seek(offset)
+        scanner = LogScanner(iter_complete_lines(f, complete_end), file_path, binary=True, base=base,
+                             patches=patches)
+        stats = scanner.count_only()
+
+        _save_checkpoint(checkpoint_path, {
+            "offset": complete_end,
+            "inode": st.st_ino,
+            "head": head_fingerprint(f, complete_end),
+            "journal": patch_size,
+            "stats": asdict(stats),
+        })
+
+        f.seek(complete_end)
+        partial = f.read(st.st_size - complete_end)
+        if partial:
+            stats = LogScanner([partial], file_path, binary=True, base=stats, patches=patches).count_only()
+
+    return stats
 
 
 def print_log_stats(stats: LogStats):
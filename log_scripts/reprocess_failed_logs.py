@@ -4,13 +4,19 @@
 功能：
 1. 读取 bqbq_download_full-*.log 中的失败记录
 2. 使用公共 image_downloader 模块重新下载并上传
-3. 成功后更新日志状态
+3. 成功后把新状态记录到旁路日志（<日志>.patches.jsonl），读取统计时自动叠加
+4. 可选并发模式：--concurrency / --max-connections / --host-rate
+
+使用方式：
+    python reprocess_failed_logs.py [日志文件] [--concurrency 8] [--max-connections 20] [--host-rate 5]
 """
 
 import re
 import sys
 import httpx
 import asyncio
+import argparse
+from collections import defaultdict
 
 # ==========================
 #   导入公共模块
@@ -22,7 +28,7 @@ if BQBQ_PLUGIN_DIR not in sys.path:
 from image_downloader import ImageDownloader, DownloadContext
 from rkey_manager import load_rkey_usage, save_rkey_usage
 from log_utils import (
-    DEFAULT_LOG_FILE, parse_log_records, filter_failed_records
+    DEFAULT_LOG_FILE, LogScan, LogStats, scan_log, filter_failed_records, append_patches, adjust_stats
 )
 
 # ==========================
@@ -31,17 +37,168 @@ from log_utils import (
 BACKEND_BASE_URL = "http://127.0.0.1:5001"
 _downloader = ImageDownloader(backend_url=BACKEND_BASE_URL)
 
+# 并发模式默认参数
+DEFAULT_CONCURRENCY = 1          # 同时处理的记录数（1 = 与原来一样逐条处理）
+DEFAULT_MAX_CONNECTIONS = 20     # httpx 连接池大小
+DEFAULT_HOST_RATE = 0            # 每个 host 每秒最多发起的请求数（0 = 不限速）
+
+
+class HostRateLimiter:
+    """
+    按 host 的令牌桶限速，挂在 httpx 的 request 事件钩子上，对下载器内部发出的每个请求生效。
+
+    Args:
+        rate: 每个 host 每秒允许的请求数
+        burst: 令牌桶容量（允许的瞬时突发），默认等于 rate
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._buckets = {}  # host -> (tokens, last_time)
+        self._locks = defaultdict(asyncio.Lock)
+
+    async def acquire(self, host: str):
+        # 同一 host 的请求排队取令牌，不同 host 互不影响
+        async with self._locks[host]:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            tokens, last = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                wait = (1 - tokens) / self.rate
+                await asyncio.sleep(wait)
+                now += wait
+                tokens = 1
+            self._buckets[host] = (tokens - 1, now)
+
+    async def on_request(self, request: httpx.Request):
+        await self.acquire(request.url.host)
+
+
+def apply_result(rec, result, stats: dict, line_updates: dict, is_new: bool = None):
+    """
+    根据处理结果更新统计，并记录需要改写的日志行（按行号存储，与完成顺序无关）
+
+    Args:
+        is_new: 覆盖 result.is_new（跨文件去重时，同一图片只有第一处引用记为新增）
+    """
+    if result is None:
+        stats["fail"] += 1
+        return
+
+    if result.success and result.download_method != "PRE_DUP":
+        is_new = result.is_new if is_new is None else is_new
+        new_status = "FALLBACK_NEW" if is_new else "FALLBACK_DUP"
+        stats["success_new" if is_new else "success_dup"] += 1
+        print(f"  成功: {rec.file_name} -> {new_status}")
+
+        # 更新行
+        new_header = re.sub(r'\[Res:\s*\S+\]', f'[Res: {new_status}]', rec.header_line)
+        new_header = re.sub(r'\[Down:\s*\d+\]', '[Down: 200]', new_header)
+        line_updates[rec.line_index] = new_header
+        line_updates[rec.line_index + 1] = f"[{result.final_url}]"
+
+    elif result.download_method == "PRE_DUP":
+        print(f"  跳过: {rec.file_name} 图片已存在（预查重）")
+        stats["success_dup"] += 1
+        new_header = re.sub(r'\[Res:\s*\S+\]', '[Res: PRE_DUP]', rec.header_line)
+        line_updates[rec.line_index] = new_header
 
-async def reprocess_failed_records(log_file: str = None) -> dict:
+    else:
+        print(f"  失败: {rec.file_name} {result.error_info or 'UNKNOWN'}")
+        stats["fail"] += 1
+
+
+async def process_records(records: list, on_result, concurrency: int = DEFAULT_CONCURRENCY,
+                          max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                          host_rate: float = DEFAULT_HOST_RATE, downloader=None, transport=None):
+    """
+    并发下载/上传一组记录，每条完成时调用 on_result(idx, rec, result)（result 为 None 表示异常）
+
+    所有协程运行在同一个事件循环线程中，on_result 内直接修改 dict 是安全的。
+
+    Args:
+        transport: 传给 httpx.AsyncClient 的 transport（测试时可用 httpx.MockTransport 代替真实网络）
+    """
+    downloader = downloader or _downloader
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    done = 0
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    event_hooks = {}
+    if host_rate and host_rate > 0:
+        event_hooks["request"] = [HostRateLimiter(host_rate).on_request]
+    print(f"[并发] 并发数={concurrency} 连接池={max_connections} "
+          f"每host限速={host_rate or '不限'}/s")
+
+    async def handle(idx, rec):
+        nonlocal done
+        async with semaphore:
+            if "rkey=" not in rec.url:
+                print(f"continue  跳过: URL 不包含 rkey")
+
+            md5_val = rec.file_name.split(".")[0] if rec.file_name else ""
+            ctx = DownloadContext(md5=md5_val, original_url=rec.url, file_name=rec.file_name)
+            try:
+                result = await downloader.process(client, ctx)
+            except Exception as e:
+                print(f"  异常: {rec.file_name} {e!r}")
+                result = None
+
+        done += 1
+        print(f"\n[{done}/{len(records)}] 完成: {rec.file_name} (第 {idx + 1} 条)")
+        on_result(idx, rec, result)
+
+    async with httpx.AsyncClient(timeout=30.0, limits=limits, event_hooks=event_hooks,
+                                 transport=transport) as client:
+        await asyncio.gather(*(handle(idx, rec) for idx, rec in enumerate(records)))
+
+
+def write_line_updates(log_file: str, records: list, line_updates: dict, before: LogStats) -> LogStats:
+    """
+    把改写内容追加到旁路日志（不重写日志文件本身），并据此推算新的统计（无需重读文件）
+
+    Args:
+        records: 被重处理的记录（用于取得被替换行的当前内容）
+        line_updates: {行号: 新内容}
+        before: 改写前的统计
+
+    Returns:
+        LogStats
+    """
+    current = {}
+    for rec in records:
+        current[rec.line_index] = rec.header_line
+        current[rec.line_index + 1] = rec.url_line
+
+    print(f"\n[写入] {log_file}: 记录 {len(line_updates)} 行改写到旁路日志...")
+    append_patches(log_file, line_updates)
+    print("[完成] 旁路日志已更新（可用 compact_logs.py 离线写回日志）")
+    return adjust_stats(before, [current.get(i, "") for i in line_updates], list(line_updates.values()))
+
+
+async def reprocess_failed_records(log_file: str = None, scan: LogScan = None,
+                                   concurrency: int = DEFAULT_CONCURRENCY,
+                                   max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                                   host_rate: float = DEFAULT_HOST_RATE,
+                                   downloader=None) -> dict:
     """
     重处理失败记录
 
     Args:
         log_file: 日志文件路径，默认使用 DEFAULT_LOG_FILE
+        scan: 调用方已有的 scan_log 结果，传入时不再重复读取日志
+        concurrency: 同时处理的记录数（asyncio.Semaphore 控制）
+        max_connections: httpx 连接池大小
+        host_rate: 每个 host 每秒最多请求数，0 表示不限速
+        downloader: 自定义下载器（需提供 process(client, ctx) / get_stats_string()），
+                    默认使用 BACKEND_BASE_URL 的 ImageDownloader，测试时可指向本地替身服务
 
     Returns:
-        dict: 处理统计结果
+        dict: 处理统计结果；有改写时额外包含 "log_stats"（叠加改写后的统计，无需重读文件）
     """
+    downloader = downloader or _downloader
     load_rkey_usage()
 
     if log_file is None:
@@ -49,8 +206,10 @@ async def reprocess_failed_records(log_file: str = None) -> dict:
 
     print(f"[开始] 读取日志文件: {log_file}")
 
-    # 解析日志
-    lines, records = parse_log_records(log_file)
+    # 解析日志（单遍读取）
+    if scan is None:
+        scan = scan_log(log_file)
+    records = scan.records
     print(f"[解析] 共 {len(records)} 条记录")
 
     # 筛选失败记录
@@ -62,61 +221,42 @@ async def reprocess_failed_records(log_file: str = None) -> dict:
         return {"total": 0, "success_new": 0, "success_dup": 0, "fail": 0}
 
     stats = {"total": len(failed), "success_new": 0, "success_dup": 0, "fail": 0}
+    # 改写时按行号排序应用，结果与处理完成的先后顺序无关
     line_updates = {}
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for idx, rec in enumerate(failed):
-            print(f"\n[{idx + 1}/{len(failed)}] 处理: {rec.file_name}")
-
-            if "rkey=" not in rec.url:
-                print(f"continue  跳过: URL 不包含 rkey")
-                
-
-            md5_val = rec.file_name.split(".")[0] if rec.file_name else ""
-            ctx = DownloadContext(md5=md5_val, original_url=rec.url, file_name=rec.file_name)
-            result = await _downloader.process(client, ctx)
-
-            if result.success and result.download_method != "PRE_DUP":
-                new_status = "FALLBACK_NEW" if result.is_new else "FALLBACK_DUP"
-                stats["success_new" if result.is_new else "success_dup"] += 1
-                print(f"  成功: {new_status}")
-
-                # 更新行
-                new_header = re.sub(r'\[Res:\s*\S+\]', f'[Res: {new_status}]', rec.header_line)
-                new_header = re.sub(r'\[Down:\s*\d+\]', '[Down: 200]', new_header)
-                line_updates[rec.line_index] = new_header
-                line_updates[rec.line_index + 1] = f"[{result.final_url}]"
-
-            elif result.download_method == "PRE_DUP":
-                print(f"  跳过: 图片已存在（预查重）")
-                stats["success_dup"] += 1
-                new_header = re.sub(r'\[Res:\s*\S+\]', '[Res: PRE_DUP]', rec.header_line)
-                line_updates[rec.line_index] = new_header
-
-            else:
-                print(f"  失败: {result.error_info or 'UNKNOWN'}")
-                stats["fail"] += 1
+    await process_records(
+        failed, lambda idx, rec, result: apply_result(rec, result, stats, line_updates),
+        concurrency=concurrency, max_connections=max_connections, host_rate=host_rate, downloader=downloader)
 
     # 写入更新
     if line_updates:
-        print(f"\n[写入] 更新 {len(line_updates)} 行...")
-        for idx, content in line_updates.items():
-            lines[idx] = content + "\n"
-        with open(log_file, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
-        print("[完成] 日志已更新")
+        stats["log_stats"] = write_line_updates(log_file, failed, line_updates, scan.stats)
 
     # 输出统计
     print("\n" + "=" * 50)
     print(f"处理统计: 总数={stats['total']} 新增={stats['success_new']} 重复={stats['success_dup']} 失败={stats['fail']}")
     print("=" * 50)
     print("\n下载器统计:")
-    print(_downloader.get_stats_string())
+    print(downloader.get_stats_string())
 
     save_rkey_usage()
     return stats
 
 
+def build_arg_parser(description: str) -> argparse.ArgumentParser:
+    """并发相关的命令行参数（batch_reprocess_logs 共用）"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help="同时处理的记录数")
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS,
+                        help="httpx 连接池大小")
+    parser.add_argument('--host-rate', type=float, default=DEFAULT_HOST_RATE,
+                        help="每个 host 每秒最多请求数，0 表示不限速")
+    return parser
+
+
 if __name__ == "__main__":
-    log_file = sys.argv[1] if len(sys.argv) > 1 else None
-    asyncio.run(reprocess_failed_records(log_file))
+    parser = build_arg_parser("重处理日志中的失败记录")
+    parser.add_argument('log_file', nargs='?', default=None)
+    args = parser.parse_args()
+    asyncio.run(reprocess_failed_records(args.log_file, concurrency=args.concurrency,
+                                         max_connections=args.max_connections, host_rate=args.host_rate))
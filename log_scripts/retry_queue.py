@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+失败下载的持久化重试队列
+
+功能：
+1. enqueue: 扫描日志中的失败记录（FAIL_STATUSES）写入 SQLite 队列，已在队列中的记录保持原有进度
+2. run: 常驻异步 worker，按到期时间取出记录重新下载，成功后把新状态写入旁路日志
+3. 按失败类型指数退避；RKEY_EXPIRED 记录等到有新的 rkey（rkey 代数增加）后才重试
+4. 取出记录时先写入租约时间，同一记录在退避窗口内不会被处理两次（多个 worker 也一样）
+5. 输出吞吐量和成功率统计
+
+使用方式：
+    python retry_queue.py enqueue [日志文件或目录 ...]
+    python retry_queue.py run [--concurrency 8] [--max-connections 20] [--host-rate 5] [--once]
+    python retry_queue.py stats
+    python retry_queue.py bump-rkey          # 手动通知已获取到新的 rkey
+"""
+
+import os
+import glob
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+from urllib.parse import urlparse, parse_qs
+
+from log_utils import (
+    DEFAULT_LOG_DIR, LOG_PATTERN, FAIL_STATUSES, LogRecord,
+    scan_log, filter_failed_records, append_patches
+)
+from reprocess_failed_logs import (
+    process_records, apply_result, load_rkey_usage, save_rkey_usage,
+    DEFAULT_CONCURRENCY, DEFAULT_MAX_CONNECTIONS, DEFAULT_HOST_RATE
+)
+
+# ==========================
+#   配置
+# ==========================
+DEFAULT_QUEUE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retry_queue.db")
+
+# 各失败类型的退避参数: (首次间隔秒, 最大间隔秒)
+BACKOFF = {
+    "RKEY_EXPIRED": (60, 6 * 3600),
+    "RKEY_FAIL_HTTP": (300, 6 * 3600),
+    "RKEY_FAIL_NET": (30, 1800),
+    "RKEY_API_FAIL": (60, 3600),
+    "RKEY_SKIPPED": (300, 6 * 3600),
+    "FALL_FAIL_HTTP": (600, 12 * 3600),
+    "UPLOAD_FAIL": (30, 1800),
+}
+DEFAULT_BACKOFF = (300, 6 * 3600)
+MAX_ATTEMPTS = 8            # 超过后标记为 gave_up
+LEASE_SECONDS = 600         # 取出后的租约时间，超时未完成（worker 崩溃）会被重新取出
+BATCH_SIZE = 50             # 每轮最多取出的记录数
+POLL_INTERVAL = 30          # 没有到期记录时的等待时间
+METRICS_INTERVAL = 60       # 统计输出间隔
+
+
+# ==========================
+#   队列存储
+# ==========================
+def get_conn(db_path: str = DEFAULT_QUEUE_DB) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS retry_items (
+        log_file TEXT NOT NULL, line_index INTEGER NOT NULL,
+        file_name TEXT, url TEXT, header_line TEXT, url_line TEXT,
+        failure_class TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0, next_attempt_at REAL DEFAULT 0, rkey_generation INTEGER DEFAULT 0,
+        last_error TEXT, created_at REAL, updated_at REAL,
+        PRIMARY KEY (log_file, line_index)
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_retry_due ON retry_items(state, next_attempt_at)")
+    conn.execute("CREATE TABLE IF NOT EXISTS retry_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.commit()
+    return conn
+
+
+def _get_meta(conn, key: str, default=None):
+    row = conn.execute("SELECT value FROM retry_meta WHERE key=?", (key,)).fetchone()
+    return row['value'] if row else default
+
+
+def _set_meta(conn, key: str, value):
+    conn.execute("INSERT OR REPLACE INTO retry_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def rkey_generation(conn) -> int:
+    return int(_get_meta(conn, "rkey_generation", 0))
+
+
+def bump_rkey_generation(conn, rkey: str = None) -> int:
+    """rkey 代数 +1：所有等待新 rkey 的 RKEY_EXPIRED 记录变为可重试"""
+    generation = rkey_generation(conn) + 1
+    _set_meta(conn, "rkey_generation", generation)
+    if rkey:
+        _set_meta(conn, "last_rkey", rkey)
+    conn.commit()
+    return generation
+
+
+def _extract_rkey(url: str) -> str:
+    """取 URL 中第一个非空的 rkey 参数"""
+    for value in parse_qs(urlparse(url or "").query).get("rkey", []):
+        if value:
+            return value
+    return ""
+
+
+def backoff_delay(failure_class: str, attempts: int) -> float:
+    """指数退避（带 ±20% 抖动，避免同一批记录同时到期）"""
+    base, cap = BACKOFF.get(failure_class, DEFAULT_BACKOFF)
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def enqueue_records(conn, log_file: str, records: list) -> int:
+    """写入失败记录，已存在的 (log_file, line_index) 保持原有进度，返回新增数量"""
+    now = time.time()
+    generation = rkey_generation(conn)
+    before = conn.total_changes
+    conn.executemany(
+        """INSERT OR IGNORE INTO retry_items
+           (log_file, line_index, file_name, url, header_line, url_line, failure_class,
+            next_attempt_at, rkey_generation, created_at, updated_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        [(os.path.abspath(log_file), r.line_index, r.file_name, r.url, r.header_line, r.url_line, r.status,
+          now, generation, now, now) for r in records]
+    )
+    conn.commit()
+    return conn.total_changes - before
+
+
+def claim_due(conn, limit: int = BATCH_SIZE) -> list:
+    """
+    取出到期记录并立即写入租约（next_attempt_at = now + LEASE_SECONDS）。
+    RKEY_EXPIRED 记录只有在 rkey 代数大于入队/上次失败时的代数后才会被取出。
+    BEGIN IMMEDIATE 保证多个 worker 进程不会取到同一条记录。
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        generation = rkey_generation(conn)
+        rows = conn.execute(
+            """SELECT * FROM retry_items
+               WHERE state='pending' AND next_attempt_at <= ?
+                 AND (failure_class != 'RKEY_EXPIRED' OR rkey_generation < ?)
+               ORDER BY next_attempt_at LIMIT ?""",
+            (now, generation, limit)
+        ).fetchall()
+        conn.executemany("UPDATE retry_items SET next_attempt_at=?, updated_at=? WHERE log_file=? AND line_index=?",
+                         [(now + LEASE_SECONDS, now, r['log_file'], r['line_index']) for r in rows])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return rows
+
+
+def classify_failure(result, previous: str) -> str:
+    """从下载结果的错误信息中识别失败类型，无法识别时沿用之前的类型"""
+    info = (getattr(result, "error_info", None) or "") if result is not None else ""
+    for status in FAIL_STATUSES:
+        if status in info:
+            return status
+    return previous
+
+
+# ==========================
+#   Worker
+# ==========================
+class RetryMetrics:
+    """吞吐量与成功率统计"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.attempts = 0
+        self.success = 0
+        self.fail = 0
+        self.gave_up = 0
+        self.by_class = {}  # failure_class -> [attempts, success]
+
+    def record(self, failure_class: str, ok: bool):
+        self.attempts += 1
+        if ok:
+            self.success += 1
+        else:
+            self.fail += 1
+        entry = self.by_class.setdefault(failure_class, [0, 0])
+        entry[0] += 1
+        entry[1] += ok
+
+    def summary(self) -> str:
+        elapsed = max(1e-9, time.time() - self.started_at)
+        rate = self.success / self.attempts * 100 if self.attempts else 0.0
+        lines = [f"[指标] 运行 {elapsed:.0f}s 尝试={self.attempts} 成功={self.success} 失败={self.fail} "
+                 f"放弃={self.gave_up} 成功率={rate:.1f}% 吞吐={self.attempts / elapsed * 60:.1f}/min"]
+        for cls, (attempts, success) in sorted(self.by_class.items()):
+            lines.append(f"       {cls:<16} 尝试={attempts} 成功率={success / attempts * 100:.1f}%")
+        return "\n".join(lines)
+
+
+async def run_once(conn, metrics: RetryMetrics, **options) -> int:
+    """处理一批到期记录，返回处理数量"""
+    rows = claim_due(conn)
+    if not rows:
+        return 0
+
+    records = [LogRecord(line_index=r['line_index'], header_line=r['header_line'], url_line=r['url_line'],
+                         status=r['failure_class'], file_name=r['file_name'], url=r['url']) for r in rows]
+    results = {}
+    await process_records(records, lambda idx, rec, result: results.__setitem__(idx, result), **options)
+
+    now = time.time()
+    generation = rkey_generation(conn)
+    line_updates = {}   # log_file -> {行号: 新内容}
+    for idx, row in enumerate(rows):
+        result = results.get(idx)
+        stats = {"success_new": 0, "success_dup": 0, "fail": 0}
+        updates = line_updates.setdefault(row['log_file'], {})
+        apply_result(records[idx], result, stats, updates)
+        key = (row['log_file'], row['line_index'])
+
+        if not stats["fail"]:
+            metrics.record(row['failure_class'], True)
+            conn.execute("UPDATE retry_items SET state='done', attempts=attempts+1, last_error=NULL, updated_at=? "
+                         "WHERE log_file=? AND line_index=?", (now, *key))
+            # 成功下载使用了新的 rkey：唤醒等待新 rkey 的记录
+            rkey = _extract_rkey(getattr(result, "final_url", ""))
+            if rkey and rkey != _get_meta(conn, "last_rkey"):
+                generation = bump_rkey_generation(conn, rkey)
+                print(f"[rkey] 检测到新的 rkey，代数 -> {generation}")
+            continue
+
+        metrics.record(row['failure_class'], False)
+        failure_class = classify_failure(result, row['failure_class'])
+        attempts = row['attempts'] + 1
+        error = (getattr(result, "error_info", None) or "EXCEPTION") if result is not None else "EXCEPTION"
+        if attempts >= MAX_ATTEMPTS:
+            metrics.gave_up += 1
+            conn.execute("UPDATE retry_items SET state='gave_up', attempts=?, failure_class=?, last_error=?, "
+                         "updated_at=? WHERE log_file=? AND line_index=?",
+                         (attempts, failure_class, error, now, *key))
+        else:
+            conn.execute("UPDATE retry_items SET attempts=?, failure_class=?, last_error=?, next_attempt_at=?, "
+                         "rkey_generation=?, updated_at=? WHERE log_file=? AND line_index=?",
+                         (attempts, failure_class, error, now + backoff_delay(failure_class, attempts),
+                          generation, now, *key))
+    conn.commit()
+
+    for log_file, updates in line_updates.items():
+        append_patches(log_file, updates)
+    return len(rows)
+
+
+async def run_worker(db_path: str = DEFAULT_QUEUE_DB, once: bool = False, **options):
+    """常驻 worker：循环取出到期记录处理；once=True 时处理完当前到期记录后退出"""
+    conn = get_conn(db_path)
+    metrics = RetryMetrics()
+    last_report = time.time()
+    load_rkey_usage()
+    try:
+        while True:
+            processed = await run_once(conn, metrics, **options)
+            if time.time() - last_report >= METRICS_INTERVAL:
+                print(metrics.summary())
+                last_report = time.time()
+            if processed:
+                continue
+            if once:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        save_rkey_usage()
+        print(metrics.summary())
+        conn.close()
+
+
+# ==========================
+#   命令行
+# ==========================
+def cmd_enqueue(paths: list, db_path: str):
+    conn = get_conn(db_path)
+    total = 0
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, LOG_PATTERN))) if os.path.isdir(path) else [path]
+        for log_file in files:
+            failed = filter_failed_records(scan_log(log_file).records)
+            added = enqueue_records(conn, log_file, failed)
+            total += added
+            print(f"[入队] {os.path.basename(log_file)}: 失败 {len(failed)} 条，新增 {added} 条")
+    print(f"[完成] 新增 {total} 条")
+    conn.close()
+
+
+def cmd_stats(db_path: str):
+    conn = get_conn(db_path)
+    now = time.time()
+    print(f"rkey 代数: {rkey_generation(conn)}")
+    print(f"{'状态':<10} {'失败类型':<16} {'数量':>8} {'已到期':>8}")
+    for row in conn.execute("""SELECT state, failure_class, COUNT(*) AS n, SUM(next_attempt_at <= ?) AS due
+                               FROM retry_items GROUP BY state, failure_class ORDER BY state, failure_class""",
+                            (now,)):
+        print(f"{row['state']:<10} {row['failure_class']:<16} {row['n']:>8} {row['due'] or 0:>8}")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="失败下载的持久化重试队列")
+    parser.add_argument('--db', default=DEFAULT_QUEUE_DB, help="队列数据库路径")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_enqueue = sub.add_parser('enqueue', help="把日志中的失败记录加入队列")
+    p_enqueue.add_argument('paths', nargs='*', default=[DEFAULT_LOG_DIR])
+
+    p_run = sub.add_parser('run', help="运行重试 worker")
+    p_run.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    p_run.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS)
+    p_run.add_argument('--host-rate', type=float, default=DEFAULT_HOST_RATE)
+    p_run.add_argument('--once', action='store_true', help="处理完当前到期记录后退出")
+
+    sub.add_parser('stats', help="查看队列状态")
+    sub.add_parser('bump-rkey', help="通知已获取到新的 rkey")
+
+    args = parser.parse_args()
+    if args.command == 'enqueue':
+        cmd_enqueue(args.paths, args.db)
+    elif args.command == 'run':
+        asyncio.run(run_worker(args.db, once=args.once, concurrency=args.concurrency,
+                               max_connections=args.max_connections, host_rate=args.host_rate))
+    elif args.command == 'stats':
+        cmd_stats(args.db)
+    elif args.command == 'bump-rkey':
+        conn = get_conn(args.db)
+        print(f"rkey 代数 -> {bump_rkey_generation(conn)}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
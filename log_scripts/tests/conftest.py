@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def plugin_modules(monkeypatch):
+    """
+    bot 插件目录（image_downloader / rkey_manager）不在本机时，用最小的替身模块代替，
+    使重处理脚本可以导入；测试通过 downloader 参数注入自己的下载器
+    """
+    try:
+        import image_downloader  # noqa: F401
+    except ImportError:
+        downloader_mod = types.ModuleType("image_downloader")
+        downloader_mod.DownloadContext = lambda **kw: types.SimpleNamespace(**kw)
+        downloader_mod.ImageDownloader = lambda **kw: None
+        rkey_mod = types.ModuleType("rkey_manager")
+        rkey_mod.load_rkey_usage = rkey_mod.save_rkey_usage = lambda: None
+        monkeypatch.setitem(sys.modules, "image_downloader", downloader_mod)
+        monkeypatch.setitem(sys.modules, "rkey_manager", rkey_mod)
+    for name in ("reprocess_failed_logs", "batch_reprocess_logs"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import types
+
+import httpx
+import pytest
+
+import log_utils
+
+STATS = "[Check: 200] [Down: 0] | [T:1 D:0 N:0 DD:0 | CS:0 CF:0 FS:0 FF:0 | CN:0 CD:0 FN:0 FD:0] | [FB:No]"
+
+
+def _write_log(path, entries):
+    """entries: [(文件名, URL)]，文件名为空时头部行不带 [File:]"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for file_name, url in entries:
+            file_part = f" [File: {file_name}]" if file_name else ""
+            f.write(f"[Res: RKEY_EXPIRED] {STATS}{file_part}\n[{url}]\n")
+    return str(path)
+
+
+@pytest.fixture
+def batch(plugin_modules):
+    import batch_reprocess_logs
+    return batch_reprocess_logs
+
+
+@pytest.fixture
+def logs(tmp_path):
+    md5 = "ab" * 16
+    log_a = _write_log(tmp_path / "bqbq_download_full-a.log", [
+        ("", "https://q.example/download?fileid=1&rkey=x"),
+        ("", "https://q.example/download?fileid=2&rkey=x"),
+        (f"{md5}.gif", "https://q.example/download?fileid=3&rkey=x"),
+    ])
+    log_b = _write_log(tmp_path / "bqbq_download_full-b.log", [
+        ("", "https://q.example/download?fileid=4&rkey=x"),
+        (f"{md5}.gif", "https://q.example/download?fileid=5&rkey=x"),
+    ])
+    return log_a, log_b
+
+
+def test_records_without_file_name_are_not_merged(batch, logs):
+    plan = batch.plan_batch(list(logs))
+    assert plan.total_refs == 5
+    # 三条无文件名的记录各自一个任务，同一 md5 的两条合并为一个
+    assert len(plan.work) == 4
+    assert sorted(len(refs) for refs in plan.work.values()) == [1, 1, 1, 2]
+
+
+def test_results_are_written_to_their_own_lines(batch, logs):
+    class Downloader:
+        async def process(self, client, ctx):
+            return types.SimpleNamespace(success=True, download_method="FALLBACK", is_new=True,
+                                         final_url=ctx.original_url + "&fixed=1", error_info=None)
+
+    asyncio.run(batch.batch_process_planned(
+        list(logs), downloader=Downloader(), transport=httpx.MockTransport(lambda r: httpx.Response(200))))
+
+    for log_file in logs:
+        original = {r.line_index: r.url for r in log_utils.scan_log(log_file, overlay=False).records}
+        for rec in log_utils.scan_log(log_file).records:
+            assert rec.status in ("FALLBACK_NEW", "FALLBACK_DUP")
+            if not rec.file_name:
+                # 无文件名的记录各自下载，新 URL 来自它自己的结果
+                assert rec.url == original[rec.line_index] + "&fixed=1"
+
+
+def test_newest_reference_is_tried_first_and_failures_fall_back(batch, logs):
+    tried = []
+
+    class Downloader:
+        async def process(self, client, ctx):
+            tried.append(ctx.original_url)
+            # 最新的 URL 失效，较旧的仍可下载
+            ok = "fileid=5" not in ctx.original_url
+            return types.SimpleNamespace(success=ok, download_method="FALLBACK", is_new=True,
+                                         final_url=ctx.original_url + "&fixed=1", error_info=None)
+
+    summary = asyncio.run(batch.batch_process_planned(
+        list(logs), downloader=Downloader(), transport=httpx.MockTransport(lambda r: httpx.Response(200))))
+
+    shared = [url for url in tried if "fileid=3" in url or "fileid=5" in url]
+    assert shared == ["https://q.example/download?fileid=5&rkey=x", "https://q.example/download?fileid=3&rkey=x"]
+    assert all(r["reprocess"]["fail"] == 0 for r in summary)
+    for log_file in logs:
+        assert all(rec.status in ("FALLBACK_NEW", "FALLBACK_DUP") for rec in log_utils.scan_log(log_file).records)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import log_store
+import log_utils
+from bench_log_parser import generate_log
+
+
+def test_ingest_keeps_line_indexes_across_chunk_boundaries(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_utils, "_MMAP_CHUNK", 1000)
+    log_file = str(tmp_path / "bqbq_download_full-test.log")
+    generate_log(log_file, 300)
+    with open(log_file, 'rb') as f:
+        content = f.read()
+
+    conn = log_store.get_conn(str(tmp_path / "store.db"))
+    # 先入库前半部分（截在一行中间），再追加剩余内容后增量入库
+    split = len(content) // 2
+    with open(log_file, 'wb') as f:
+        f.write(content[:split])
+    log_store.ingest_log(conn, log_file)
+    with open(log_file, 'ab') as f:
+        f.write(content[split:])
+    log_store.ingest_log(conn, log_file)
+
+    expected = [(r.line_index, r.status, r.url) for r in log_utils.scan_log(log_file).records]
+    rows = [tuple(r) for r in conn.execute("SELECT line_index, status, url FROM log_records ORDER BY line_index")]
+    assert len(expected) == 300
+    assert rows == expected
+    state = conn.execute("SELECT line_count, offset FROM log_files").fetchone()
+    assert (state['line_count'], state['offset']) == (1500, len(content))
+
+
+def test_record_row_parses_header_fields():
+    header = ("[Res: NEW] [Check: 200] [Down: 403] | [T:1 D:2 N:3 DD:4 | CS:5 CF:6 FS:7 FF:8 | "
+              "CN:9 CD:10 FN:11 FD:12] | [Try:2] [FB:Yes] [File: abc.gif]")
+    row = dict(zip(log_store._RECORD_COLUMNS, log_store.record_row("a.log", 7, header, "")))
+    assert (row['status'], row['check_code'], row['down_code'], row['fb']) == ("NEW", 200, 403, "Yes")
+    assert (row['t'], row['fd']) == (1, 12)
+    assert (row['file_name'], row['md5']) == ("abc.gif", "abc")
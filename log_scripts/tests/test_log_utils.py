@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import log_utils
+from bench_log_parser import generate_log, legacy_parse_log_records, legacy_parse_log_stats
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = str(tmp_path / "bqbq_download_full-test.log")
+    generate_log(path, 300)
+    return path
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_stats_match_legacy_parser(log_file, use_mmap):
+    legacy = legacy_parse_log_stats(log_file)
+    assert legacy.parsed_lines == 300  # 生成的每条记录都有一行统计行
+
+    assert log_utils.parse_log_stats(log_file, use_mmap=use_mmap) == legacy
+    assert log_utils.scan_log(log_file, use_mmap=use_mmap).stats == legacy
+
+
+def test_records_match_legacy_parser(log_file):
+    _, legacy_records = legacy_parse_log_records(log_file)
+    assert log_utils.scan_log(log_file).records == legacy_records
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """很小的分块，让大量行跨越块边界"""
+    monkeypatch.setattr(log_utils, "_MMAP_CHUNK", 1000)
+
+
+def test_incremental_stats_match_full_parse_across_chunk_boundaries(log_file, small_chunks):
+    with open(log_file, 'rb') as f:
+        content = f.read()
+    # 先写入前半部分（截在一行中间），再追加剩余内容
+    split = len(content) // 2
+    with open(log_file, 'wb') as f:
+        f.write(content[:split])
+    first = log_utils.parse_log_stats_incremental(log_file)
+    assert first == log_utils.parse_log_stats(log_file)
+
+    with open(log_file, 'ab') as f:
+        f.write(content[split:])
+    second = log_utils.parse_log_stats_incremental(log_file)
+    full = log_utils.parse_log_stats(log_file)
+    assert second == full
+    assert (full.total_lines, full.parsed_lines) == (1500, 300)
+
+    # 没有新内容时直接使用检查点
+    assert log_utils.parse_log_stats_incremental(log_file) == full
+
+
+def test_complete_lines_are_not_split(log_file, small_chunks):
+    with open(log_file, 'rb') as f:
+        expected = f.readlines()
+        f.seek(0)
+        assert list(log_utils.iter_complete_lines(f, len(b''.join(expected)))) == expected
+
+
+def test_partial_line_longer_than_chunk(log_file, small_chunks):
+    with open(log_file, 'a', encoding='utf-8') as f:
+        f.write("x" * 5000)
+    stats = log_utils.parse_log_stats_incremental(log_file)
+    assert stats == log_utils.parse_log_stats(log_file)
+    assert stats.total_lines == 1501
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from log_utils import LogRecord
+
+
+@pytest.fixture
+def reprocess(plugin_modules):
+    import reprocess_failed_logs
+    return reprocess_failed_logs
+
+
+def _records(host, count):
+    return [LogRecord(line_index=i * 2, header_line="", url_line="", status="RKEY_EXPIRED",
+                      file_name=f"{i:032x}.gif", url=f"https://{host}/download?fileid={i}&rkey=x")
+            for i in range(count)]
+
+
+class FakeDownloader:
+    """通过传入的 client 请求原始 URL，并记录同时在处理中的数量"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def process(self, client, ctx):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await client.get(ctx.original_url)
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        return None
+
+
+def _run(reprocess, records, downloader, **kwargs):
+    sent = []  # (host, time)
+
+    def handler(request):
+        sent.append((request.url.host, time.monotonic()))
+        return httpx.Response(200, content=b"ok")
+
+    results = []
+    asyncio.run(reprocess.process_records(
+        records, lambda idx, rec, result: results.append(idx), downloader=downloader,
+        transport=httpx.MockTransport(handler), **kwargs))
+    assert sorted(results) == list(range(len(records)))
+    return sent
+
+
+def test_concurrency_is_bounded_by_semaphore(reprocess):
+    downloader = FakeDownloader(delay=0.02)
+    _run(reprocess, _records("a.example", 12), downloader, concurrency=3)
+    assert downloader.max_in_flight == 3
+
+
+def test_host_rate_spaces_requests_per_host(reprocess):
+    rate = 50  # 令牌桶容量默认等于 rate：前 50 个请求立即发出，之后每 1/rate 秒一个
+    records = _records("a.example", rate + 10) + _records("b.example", 5)
+    sent = _run(reprocess, records, FakeDownloader(), concurrency=100, host_rate=rate)
+
+    times_a = [t for host, t in sent if host == "a.example"]
+    # 突发阶段结束后桶已空，之后相邻请求的间隔为 1/rate（第一个间隔中包含了突发期间补充的令牌）
+    gaps = [b - a for a, b in zip(times_a[rate:], times_a[rate + 1:])]
+    assert len(gaps) == 9
+    assert min(gaps) >= 0.9 / rate
+    # 整体上：60 个请求至少要等 (60 - 50) / rate 秒
+    assert times_a[-1] - times_a[0] >= 10 * 0.9 / rate
+
+    # 另一个 host 有自己的令牌桶，不会排在 a.example 后面
+    times_b = [t for host, t in sent if host == "b.example"]
+    assert max(times_b) - times_a[0] < 5 / rate
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+QQ 图片 URL 解析库 - 可导入使用的 fileid / rkey 解码模块
+
+parse_qq_url.py / parse_qq_url_v2.py 是逐字段打印的分析脚本，本模块把其中的结论整理成
+结构化记录，供下载器、日志脚本批量调用：
+
+    from qq_url import parse_url
+    info = parse_url(url)
+    info.fileid.sha1, info.fileid.size, info.rkey.key
+
+fileid 字段（根据样本逆向，未出现的字段保持为 None）：
+  - Field 2: 文件 SHA1 (20 bytes)
+  - Field 3: 文件大小 (bytes)
+  - Field 4: appid (1407 = 群聊图片)
+  - Field 5: 上传时间 (微秒时间戳)
+  - Field 6: 环境标识 ("prod")
+  - Field 10: 有效期 (秒)
+  - Field 16: 服务器节点标识
+
+rkey 字段：
+  - Field 1: 版本/类型
+  - Field 2: 签名数据
+
+解析基于 memoryview，嵌套的 length-delimited 字段只是原缓冲区上的切片视图，不会复制字节。
+
+命令行（批量 / 流式）：
+    python qq_url.py [日志文件 ...]          # 从文件或 stdin 中提取 URL，每行输出一条 NDJSON
+    python qq_url.py --bench [N]             # 解码吞吐量测试
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import re
+import sys
+import time
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional
+
+# fileid 字段号
+FILEID_SHA1 = 2
+FILEID_SIZE = 3
+FILEID_APPID = 4
+FILEID_UPLOAD_TIME = 5
+FILEID_ENV = 6
+FILEID_TTL = 10
+FILEID_NODE = 16
+
+# rkey 字段号
+RKEY_VERSION = 1
+RKEY_KEY = 2
+
+SAMPLE_URL = ("https://gchat.qpic.cn/download?appid=1407&fileid=EhQ5BLRT4bxJ_-4xGJw0CPyUSdNP-hjxoQMg_woo97TXi4H5kQMyBHByb2RQ"
+              "gL2jAVoQkb0x_JXLKvxDpXsdrqdBoHoCz7SCAQJuag&rkey=&rkey=CAESMIuKzOqW5Fxa-fJorEbU5BS5SdbeWIWkxO8HSQRpVEP30LYI"
+              "yb6kOct8Bqz2fcH20g&spec=0")
+
+# 从日志行等任意文本中提取 URL
+_URL_RE = re.compile(r'https?://[^\s\[\]"\'<>]+')
+
+
+class QQUrlError(ValueError):
+    """URL / fileid / rkey 无法解析"""
+
+
+# ==========================
+#   数据类
+# ==========================
+@dataclass
+class FileId:
+    """fileid 解析结果"""
+    sha1: Optional[str] = None         # 文件 SHA1 (hex)
+    size: Optional[int] = None         # 文件大小
+    appid: Optional[int] = None        # 应用类型
+    upload_time_us: Optional[int] = None  # 上传时间（微秒）
+    env: Optional[str] = None          # 环境标识
+    ttl: Optional[int] = None          # 有效期（秒）
+    node: Optional[str] = None         # 服务器节点
+
+
+@dataclass
+class RKey:
+    """rkey 解析结果"""
+    version: Optional[int] = None
+    key: Optional[bytes] = None        # 签名数据原始字节
+
+
+@dataclass
+class QQImageUrl:
+    """一条 QQ 图片 URL 的解析结果"""
+    url: str
+    appid: Optional[int] = None        # URL 参数中的 appid
+    spec: Optional[str] = None
+    fileid: Optional[FileId] = None
+    rkey: Optional[RKey] = None
+
+    def to_dict(self) -> dict:
+        """转为可 JSON 序列化的扁平字典（rkey 字节以 hex 表示）"""
+        d = {"url": self.url, "appid": self.appid, "spec": self.spec}
+        if self.fileid:
+            fid = dict(vars(self.fileid))
+            # URL 参数中的 appid 优先，缺失时使用 fileid 内的 appid
+            if d["appid"] is None:
+                d["appid"] = fid["appid"]
+            del fid["appid"]
+            d.update(fid)
+        if self.rkey:
+            d["rkey_version"] = self.rkey.version
+            d["rkey"] = self.rkey.key.hex() if self.rkey.key is not None else None
+        return d
+
+
+# ==========================
+#   protobuf 解码
+# ==========================
+def decode_url_safe_base64(data: str) -> bytes:
+    """解码 URL-safe base64（自动补齐 padding）"""
+    try:
+        return base64.b64decode(data + '=' * (-len(data) % 4), altchars=b'-_', validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise QQUrlError(f"invalid base64: {e}") from None
+
+
+def read_varint(buf: memoryview, pos: int) -> tuple:
+    """读取 varint，返回 (value, new_pos)"""
+    result = 0
+    shift = 0
+    end = len(buf)
+    while pos < end:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+    raise QQUrlError("truncated varint")
+
+
+def iter_fields(buf) -> Iterator[tuple]:
+    """
+    逐个产出 protobuf 字段 (field_number, wire_type, value)，不做嵌套猜测。
+
+    varint 的 value 为 int；其余类型的 value 为原缓冲区上的 memoryview 切片（零拷贝），
+    需要嵌套解析时直接把切片再传给 iter_fields 即可。
+    """
+    buf = buf if isinstance(buf, memoryview) else memoryview(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        tag, pos = read_varint(buf, pos)
+        field_number = tag >> 3
+        wire_type = tag & 0x07
+        if field_number == 0:
+            raise QQUrlError("invalid field number 0")
+
+        if wire_type == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(buf, pos)
+            if length > end - pos:
+                raise QQUrlError("length-delimited field overruns buffer")
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            if pos + 8 > end:
+                raise QQUrlError("truncated fixed64")
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            if pos + 4 > end:
+                raise QQUrlError("truncated fixed32")
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise QQUrlError(f"unsupported wire type {wire_type}")
+        yield field_number, wire_type, value
+
+
+def parse_fileid(fileid) -> FileId:
+    """解析 fileid（base64 字符串或已解码的 bytes）"""
+    data = decode_url_safe_base64(fileid) if isinstance(fileid, str) else fileid
+    result = FileId()
+    for field_number, wire_type, value in iter_fields(data):
+        if wire_type == 0:
+            if field_number == FILEID_SIZE:
+                result.size = value
+            elif field_number == FILEID_APPID:
+                result.appid = value
+            elif field_number == FILEID_UPLOAD_TIME:
+                result.upload_time_us = value
+            elif field_number == FILEID_TTL:
+                result.ttl = value
+        elif wire_type == 2:
+            if field_number == FILEID_SHA1 and len(value) == 20:
+                result.sha1 = value.hex()
+            elif field_number == FILEID_NODE:
+                result.node = str(value, 'utf-8', 'replace')
+            elif field_number == FILEID_ENV:
+                result.env = str(value, 'utf-8', 'replace')
+    return result
+
+
+def parse_rkey(rkey) -> RKey:
+    """解析 rkey（base64 字符串或已解码的 bytes）"""
+    data = decode_url_safe_base64(rkey) if isinstance(rkey, str) else rkey
+    result = RKey()
+    for field_number, wire_type, value in iter_fields(data):
+        if field_number == RKEY_VERSION and wire_type == 0:
+            result.version = value
+        elif field_number == RKEY_KEY and wire_type == 2:
+            result.key = value.tobytes()
+    return result
+
+
+def _query_params(url: str) -> dict:
+    """
+    取出 URL 查询参数，重复参数取第一个非空值（QQ 链接常见 rkey=&rkey=xxx）。
+    fileid / rkey 都是 URL-safe base64，无需 unquote。
+    """
+    q = url.find('?')
+    params = {}
+    if q < 0:
+        return params
+    for part in url[q + 1:].split('&'):
+        key, sep, value = part.partition('=')
+        if sep and value and not params.get(key):
+            params[key] = value
+    return params
+
+
+def parse_url(url: str) -> QQImageUrl:
+    """
+    解析一条 QQ 图片 URL
+
+    Raises:
+        QQUrlError: fileid / rkey 无法解码
+    """
+    params = _query_params(url)
+    appid = params.get('appid')
+    result = QQImageUrl(url=url, appid=int(appid) if appid and appid.isdigit() else None,
+                        spec=params.get('spec'))
+    if 'fileid' in params:
+        result.fileid = parse_fileid(params['fileid'])
+    if 'rkey' in params:
+        result.rkey = parse_rkey(params['rkey'])
+    return result
+
+
+def extract_urls(text: str) -> list:
+    """从一行文本中提取包含 fileid 的 URL"""
+    if 'fileid=' not in text:
+        return []
+    return [u for u in _URL_RE.findall(text) if 'fileid=' in u]
+
+
+def parse_urls(urls: Iterable[str]) -> Iterator[dict]:
+    """
+    批量解析，逐条产出 dict；解析失败的 URL 产出 {"url": ..., "error": ...}，不中断整批。
+    """
+    for url in urls:
+        try:
+            yield parse_url(url).to_dict()
+        except QQUrlError as e:
+            yield {"url": url, "error": str(e)}
+
+
+def iter_urls_from_lines(lines: Iterable[str]) -> Iterator[str]:
+    """从日志行中流式提取 URL"""
+    for line in lines:
+        yield from extract_urls(line)
+
+
+# ==========================
+#   命令行
+# ==========================
+def run_benchmark(n: int):
+    """解码吞吐量测试：对样例 URL 重复解析 n 次"""
+    urls = [SAMPLE_URL] * n
+
+    start = time.perf_counter()
+    for _ in parse_urls(urls):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"parse_urls:      {n} urls in {elapsed:.3f}s -> {n / elapsed:,.0f} urls/s")
+
+    start = time.perf_counter()
+    for url in urls:
+        parse_fileid(_query_params(url)['fileid'])
+    elapsed = time.perf_counter() - start
+    print(f"parse_fileid:    {n} urls in {elapsed:.3f}s -> {n / elapsed:,.0f} urls/s")
+
+    text = [f"[{SAMPLE_URL}]\n"] * n
+    start = time.perf_counter()
+    count = sum(1 for _ in iter_urls_from_lines(text))
+    elapsed = time.perf_counter() - start
+    print(f"extract (lines): {count} urls in {elapsed:.3f}s -> {count / elapsed:,.0f} lines/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode QQ image URLs (fileid / rkey) into NDJSON")
+    parser.add_argument('files', nargs='*', help="log files to scan for URLs (default: stdin)")
+    parser.add_argument('--bench', type=int, nargs='?', const=200000, metavar='N',
+                        help="run a decoding throughput benchmark with N urls")
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.bench)
+        return
+
+    # Windows 控制台默认编码不是 utf-8
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stdin.reconfigure(encoding='utf-8', errors='replace')
+    out = sys.stdout
+    write = out.write
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def emit(lines):
+        for record in parse_urls(iter_urls_from_lines(lines)):
+            write(dumps(record))
+            write('\n')
+
+    if args.files:
+        for path in args.files:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                emit(f)
+    else:
+        emit(sys.stdin)
+    out.flush()
+
+
+if __name__ == "__main__":
+    main()
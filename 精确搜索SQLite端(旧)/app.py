@@ -1,41 +1,548 @@
 # -*- coding: utf-8 -*-
 import os
+import bisect
+import heapq
 import json
 import time
 import sqlite3
 import hashlib
 import random  # 新增: 用于随机抽取帧
+import re
+import tarfile
+import tempfile
 import threading
-from flask import Flask, send_file, send_from_directory, request, jsonify
+import unicodedata
+import uuid
+import zipfile
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import Flask, send_file, send_from_directory, request, jsonify, g, has_request_context
 from flask_cors import CORS
 from PIL import Image
 from flask import abort
 
 # --- Configuration ---
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+# 图片目录和数据库所在目录，可用环境变量 BQBQ_DATA_DIR 指向其他位置（例如基准测试使用的临时库）
+DATA_DIR = os.path.abspath(os.environ.get('BQBQ_DATA_DIR') or BASE_DIR)
 FOLDERS = {
-    'img': os.path.join(BASE_DIR, 'meme_images'),
-    'thumb': os.path.join(BASE_DIR, 'meme_images_thumbnail')
+    'img': os.path.join(DATA_DIR, 'meme_images'),
+    'thumb': os.path.join(DATA_DIR, 'meme_images_thumbnail')
 }
-DB_PATH = os.path.join(BASE_DIR, 'meme.db')
+DB_PATH = os.path.join(DATA_DIR, 'meme.db')
 THUMBNAIL_MAX_SIZE = 600  # 新增: 缩略图最大尺寸
+DEBUG = True
+
+# 分片目录布局: <md5 前2位>/<md5 第3-4位>/<文件名>，避免单目录下文件过多
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传流式读取的块大小
+BATCH_UPLOAD_WORKERS = min(8, os.cpu_count() or 4)  # 批量上传时并行读取/哈希的线程数
+BATCH_UPLOAD_MAX_FILES = 1000  # 单次批量上传的最大文件数
+ARCHIVE_MAX_MEMBERS = 10000  # 压缩包条目总数上限（含目录和非图片文件）
+ARCHIVE_MAX_TOTAL_SIZE = 2 * 1024 * 1024 * 1024  # 压缩包内图片解压后的总大小上限（单个成员另受 MAX_UPLOAD_SIZE 限制）
+
+# 分块续传上传
+MAX_UPLOAD_SIZE = 100 * 1024 * 1024  # 单个文件大小上限（同时作为单次请求体上限）
+CHUNKED_UPLOAD_DIR = os.path.join(FOLDERS['img'], '.chunked')  # 以 . 开头，扫描时忽略
+CHUNKED_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024  # 建议客户端使用的分块大小
+CHUNKED_SESSION_TTL = 24 * 3600  # 超过该时间未活动的会话会被回收
+
+CHECK_MD5_BATCH_MAX = 1000  # /api/check_md5/batch、/api/check_sha1/batch 单次最多检查的数量
+
+# 目录监听：运行期间自动导入放入 meme_images 的新文件
+WATCH_FOLDER_ENABLED = True
+WATCH_POLL_INTERVAL = 5.0  # 未安装 watchdog 时的轮询间隔（秒）
+WATCH_SETTLE_SECONDS = 2.0  # 文件大小/修改时间保持不变多久才视为写入完成
+WATCH_BATCH_SIZE = 200  # 每批导入的文件数
+
+# 上传后处理（缩略图、尺寸提取）队列，持久化在 SQLite 的 jobs 表中
+ASYNC_POSTPROCESS = True  # False 时退回到上传请求内同步处理
+JOB_WORKERS = 2  # 后台 worker 线程数
+JOB_POLL_INTERVAL = 2.0  # 队列为空时的轮询间隔（秒）
+JOB_MAX_ATTEMPTS = 3  # 单个任务最多尝试次数
+JOB_RETENTION_SECONDS = 24 * 3600  # 已完成任务的保留时间
+
+# 运行指标：/metrics 以 Prometheus 文本格式输出（每次观测只是一次加锁的计数，可在生产环境常开）
+METRICS_ENABLED = True
+
+# 慢查询日志：超过阈值的语句连同 EXPLAIN QUERY PLAN 记录到环形缓冲区，见 /api/admin/slow_queries
+SLOW_QUERY_LOG_ENABLED = True
+SLOW_QUERY_THRESHOLD_MS = 50
+SLOW_QUERY_LOG_SIZE = 200
+
+# 标签补全：/api/meta/tags/suggest 默认和最多返回的条数
+TAG_SUGGEST_DEFAULT_LIMIT = 10
+TAG_SUGGEST_MAX_LIMIT = 100
+
+# 标签共现：表中保存精确计数，查询时每个标签只取共现次数最多的 K 个邻居，见 /api/meta/tags/related
+TAG_COOCCURRENCE_TOP_K = 50
+TAG_RELATED_DEFAULT_LIMIT = 10
+TAG_RELATED_MAX_LIMIT = 50
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 CORS(app)
 
 # Ensure directories exist
-for p in FOLDERS.values():
+for p in list(FOLDERS.values()) + [CHUNKED_UPLOAD_DIR]:
     os.makedirs(p, exist_ok=True)
 
+# --- 运行指标（Prometheus 文本格式） ---
+class MetricCounter:
+    """只增计数器，按标签值分别计数"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {} if labelnames else {(): 0}
+        self._lock = threading.Lock()
+        Metrics.register(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{Metrics.format_labels(self.labelnames, labels)} {value}"
+
+
+class MetricHistogram:
+    """固定分桶的直方图；observe 只做一次二分查找和计数"""
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [各桶计数（最后一个为 +Inf）, 总和]
+        self._lock = threading.Lock()
+        Metrics.register(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield (f"{self.name}_bucket"
+                       f"{Metrics.format_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}")
+            label_text = Metrics.format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {total}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Metrics:
+    """指标注册表；gauge 类指标在输出时通过回调现取，不在热路径上维护"""
+    _registry = []
+    _gauges = []  # (name, help, callback)，callback 返回 [(labels dict, value), ...]
+
+    @staticmethod
+    def register(metric):
+        Metrics._registry.append(metric)
+
+    @staticmethod
+    def gauge(name, help_text, callback):
+        Metrics._gauges.append((name, help_text, callback))
+
+    @staticmethod
+    def format_labels(names, values):
+        if not names:
+            return ""
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+        return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+    @staticmethod
+    def render():
+        lines = []
+        for metric in Metrics._registry:
+            lines.extend(metric.collect())
+        for name, help_text, callback in Metrics._gauges:
+            try:
+                samples = callback()
+            except Exception as e:
+                # 某个 gauge 取值失败（例如数据库繁忙）不影响其他指标
+                print(f"[Metrics] Gauge {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{Metrics.format_labels(tuple(labels), tuple(labels.values()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+METRIC_HTTP_LATENCY = MetricHistogram(
+    "bqbq_http_request_duration_seconds", "HTTP request latency by route, method and status",
+    ("route", "method", "status"))
+METRIC_DB_CONNECT = MetricHistogram(
+    "bqbq_db_connect_seconds", "Time to open a SQLite connection",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1))
+METRIC_DB_LOCK_WAIT = MetricHistogram(
+    "bqbq_db_lock_wait_seconds", "Time spent acquiring the exclusive write lock in try_write")
+METRIC_DB_TRANSACTION = MetricHistogram(
+    "bqbq_db_transaction_seconds", "try_write transaction duration by outcome", ("outcome",))
+METRIC_RULE_CONFLICTS = MetricCounter(
+    "bqbq_rule_conflicts_total", "Rule writes rejected with 409 because base_version was stale")
+METRIC_THUMBNAIL = MetricHistogram(
+    "bqbq_thumbnail_render_seconds", "Thumbnail generation time by result (ok / fallback / failed)", ("result",))
+METRIC_UPLOAD_SIZE = MetricHistogram(
+    "bqbq_upload_size_bytes", "Size of uploaded files",
+    buckets=(16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2))
+METRIC_SLOW_QUERIES = MetricCounter(
+    "bqbq_slow_queries_total", "Statements slower than SLOW_QUERY_THRESHOLD_MS")
+
+
+# --- 慢查询日志 ---
+class SlowQueryLog:
+    """
+    慢查询环形缓冲区。每条记录包含归一化后的 SQL、参数形态（类型和 LIKE 通配位置，不含参数值）
+    和 EXPLAIN QUERY PLAN 结果；同一归一化 SQL 只 EXPLAIN 一次（结果缓存）。
+    """
+    _entries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+    _summary = {}  # 归一化 SQL -> {"count", "total_ms", "max_ms"}
+    _plans = {}  # (归一化 SQL, 参数个数) -> plan
+    _lock = threading.Lock()
+    _SUMMARY_MAX = 500
+
+    _WS_RE = re.compile(r'\s+')
+    _PLACEHOLDER_LIST_RE = re.compile(r'\?(?:\s*,\s*\?)+')
+    _NUMBER_RE = re.compile(r'\b\d+\b')
+    _EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+    @staticmethod
+    def normalize(sql):
+        """合并空白、把 ?, ?, ? 列表和数字字面量折叠掉，使同一形态的动态 SQL 归为一类"""
+        sql = SlowQueryLog._WS_RE.sub(' ', sql).strip()
+        sql = SlowQueryLog._PLACEHOLDER_LIST_RE.sub('?, ...', sql)
+        return SlowQueryLog._NUMBER_RE.sub('N', sql)
+
+    @staticmethod
+    def param_shape(value):
+        if isinstance(value, str):
+            if '%' in value:
+                # LIKE 模式：前导 % 意味着无法使用索引
+                return f"like:{'%' if value.startswith('%') else ''}x{'%' if value.endswith('%') else ''}"
+            return f"str[{len(value)}]"
+        if isinstance(value, (bytes, memoryview)):
+            return f"bytes[{len(value)}]"
+        return type(value).__name__
+
+    @staticmethod
+    def param_shapes(params, limit=20):
+        if isinstance(params, dict):
+            shapes = {k: SlowQueryLog.param_shape(v) for k, v in list(params.items())[:limit]}
+        else:
+            params = list(params or ())
+            shapes = [SlowQueryLog.param_shape(v) for v in params[:limit]]
+            if len(params) > limit:
+                shapes.append(f"... ({len(params)} total)")
+        return shapes
+
+    @staticmethod
+    def explain(conn, sql, params, normalized):
+        if not sql.lstrip()[:7].upper().startswith(SlowQueryLog._EXPLAINABLE):
+            return None
+        key = (normalized, len(params or ()))
+        plan = SlowQueryLog._plans.get(key)
+        if plan is None:
+            try:
+                rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+                plan = [row[3] for row in rows]
+            except sqlite3.Error as e:
+                plan = [f"<explain failed: {e}>"]
+            if len(SlowQueryLog._plans) < SlowQueryLog._SUMMARY_MAX:
+                SlowQueryLog._plans[key] = plan
+        return plan
+
+    @staticmethod
+    def record(conn, sql, params, elapsed):
+        elapsed_ms = elapsed * 1000
+        normalized = SlowQueryLog.normalize(sql)
+        plan = SlowQueryLog.explain(conn, sql, params, normalized)
+        entry = {
+            "at": time.time(),
+            "duration_ms": round(elapsed_ms, 2),
+            "sql": normalized,
+            "params": SlowQueryLog.param_shapes(params),
+            "plan": plan,
+            # SCAN（包括 SCAN ... USING INDEX）会遍历整张表/索引，SEARCH 才是按索引定位
+            "full_scan": any(d.startswith('SCAN') and 'CONSTANT ROW' not in d for d in plan or ()),
+            "route": request.path if has_request_context() else None,
+            "thread": threading.current_thread().name,
+        }
+        METRIC_SLOW_QUERIES.inc()
+        with SlowQueryLog._lock:
+            SlowQueryLog._entries.append(entry)
+            stats = SlowQueryLog._summary.get(normalized)
+            if stats is None and len(SlowQueryLog._summary) < SlowQueryLog._SUMMARY_MAX:
+                stats = SlowQueryLog._summary[normalized] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+            if stats is not None:
+                stats['count'] += 1
+                stats['total_ms'] += elapsed_ms
+                stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+    @staticmethod
+    def snapshot(limit=50):
+        """最近的慢查询（新的在前）和按归一化 SQL 汇总的统计（总耗时高的在前）"""
+        with SlowQueryLog._lock:
+            entries = list(SlowQueryLog._entries)[-limit:][::-1] if limit > 0 else []
+            summary = [{"sql": sql, **stats, "total_ms": round(stats['total_ms'], 2),
+                        "max_ms": round(stats['max_ms'], 2)}
+                       for sql, stats in SlowQueryLog._summary.items()]
+        summary.sort(key=lambda s: s['total_ms'], reverse=True)
+        return {"threshold_ms": SLOW_QUERY_THRESHOLD_MS, "entries": entries, "summary": summary}
+
+    @staticmethod
+    def clear():
+        with SlowQueryLog._lock:
+            SlowQueryLog._entries.clear()
+            SlowQueryLog._summary.clear()
+            SlowQueryLog._plans.clear()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    把 fetchall / fetchmany 的取数耗时计入语句总耗时，结果取完时再判断是否为慢查询
+    （全表扫描的大部分时间花在取数上）。未取完就丢弃的游标只在 close() 时记录。
+    逐行迭代和 fetchone 不计时（每行一次 Python 调用会让大结果集的遍历慢近一倍），
+    这类语句只按 execute 的耗时（执行到第一行）判断。
+    """
+    _sql = None
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def _finish(self):
+        if self._elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            SlowQueryLog.record(self.connection, self._sql, self._params, self._elapsed)
+        self._sql = None
+
+    def fetchmany(self, size=None):
+        if self._sql is None:
+            return super().fetchmany(size or self.arraysize)
+        size = size or self.arraysize
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        if self._sql is None:
+            return super().fetchall()
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def close(self):
+        if self._sql is not None:
+            self._finish()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """为 execute / executemany 计时的连接，超过 SLOW_QUERY_THRESHOLD_MS 的语句写入 SlowQueryLog"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        cursor = self.cursor(InstrumentedCursor)
+        cursor.execute(sql, parameters)
+        elapsed = time.perf_counter() - start
+        if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            SlowQueryLog.record(self, sql, parameters, elapsed)
+        else:
+            # 交给游标累计取数耗时，结果取完后再判断
+            cursor._sql, cursor._params, cursor._elapsed = sql, parameters, elapsed
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_parameters)
+        elapsed = time.perf_counter() - start
+        if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+            # 参数已被迭代消耗，不做 EXPLAIN
+            SlowQueryLog.record(self, "/* executemany */ " + sql, None, elapsed)
+        return cursor
+
+
 # --- Database Service ---
 class MemeService:
     @staticmethod
     def get_conn():
-        conn = sqlite3.connect(DB_PATH)
+        start = time.perf_counter()
+        conn = sqlite3.connect(DB_PATH, factory=InstrumentedConnection if SLOW_QUERY_LOG_ENABLED else sqlite3.Connection)
         conn.row_factory = sqlite3.Row
+        METRIC_DB_CONNECT.observe(time.perf_counter() - start)
         return conn
 
+    # --- 文件布局（分片目录 + 旧平铺目录兼容） ---
+
+    @staticmethod
+    def shard_subdir(name):
+        """根据文件名（以 md5 开头）计算分片子目录，例如 'ab/cd'"""
+        key = name.lower()
+        return os.path.join(*[key[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)])
+
+    @staticmethod
+    def sharded_path(kind, name):
+        """文件在分片布局下的标准路径（kind: 'img' 或 'thumb'）"""
+        return os.path.join(FOLDERS[kind], MemeService.shard_subdir(name), name)
+
+    @staticmethod
+    def thumb_name(md5):
+        return f"{md5}_thumbnail.jpg"
+
+    @staticmethod
+    def resolve_path(kind, name):
+        """
+        查找文件的实际位置，同时兼容分片布局和旧的平铺布局。
+
+        迁移工具可能在两次检查之间移动文件，所以最后会再检查一次分片路径。
+
+        Returns:
+            str | None: 存在的文件路径，找不到时返回 None
+        """
+        if not name or os.path.basename(name) != name or name.startswith('.'):
+            return None
+        sharded = MemeService.sharded_path(kind, name)
+        flat = os.path.join(FOLDERS[kind], name)
+        for p in (sharded, flat, sharded):
+            if os.path.isfile(p):
+                return p
+        return None
+
+    @staticmethod
+    def migrate_to_sharded_layout(kind, batch_size=500, pause=0.0, dry_run=False):
+        """
+        将平铺目录中的文件分批移动到分片目录（可在服务运行时执行）。
+
+        - 只处理以 32 位 md5 开头的文件，未导入的文件留给 scan_and_import_folder
+        - 每次运行都重新扫描根目录，已移动的文件不会再出现，因此中断后重新执行即可续传
+        - os.replace 是原子操作，配合 resolve_path 的双布局查找，迁移期间访问不受影响
+
+        Returns:
+            dict: {'moved', 'duplicates', 'skipped', 'errors'}
+        """
+        root = FOLDERS[kind]
+        counters = {'moved': 0, 'duplicates': 0, 'skipped': 0, 'errors': 0}
+
+        def is_md5_name(name):
+            stem = name[:32]
+            return len(stem) == 32 and all(c in '0123456789abcdef' for c in stem.lower())
+
+        batch = []
+        moved_paths = []
+
+        def flush():
+            for entry_name in batch:
+                src = os.path.join(root, entry_name)
+                dst = MemeService.sharded_path(kind, entry_name)
+                try:
+                    if os.path.exists(dst):
+                        # 分片目录中已有同名文件（内容由 md5 保证一致），删除平铺副本
+                        if not dry_run:
+                            os.remove(src)
+                        counters['duplicates'] += 1
+                        continue
+                    if not dry_run:
+                        os.makedirs(os.path.dirname(dst), exist_ok=True)
+                        os.replace(src, dst)
+                        moved_paths.append((src, dst))
+                    counters['moved'] += 1
+                except FileNotFoundError:
+                    counters['skipped'] += 1
+                except OSError as e:
+                    print(f"[Layout Migration] Move failed {src} -> {dst}: {e}")
+                    counters['errors'] += 1
+            batch.clear()
+            if kind == 'img' and moved_paths:
+                # 同步更新扫描清单中的路径，避免下次扫描重新计算 md5
+                with MemeService.get_conn() as conn:
+                    conn.executemany("UPDATE OR REPLACE scan_manifest SET path=? WHERE path=?",
+                                     [(MemeService._manifest_key(dst), MemeService._manifest_key(src))
+                                      for src, dst in moved_paths])
+                    conn.commit()
+                moved_paths.clear()
+            done = counters['moved'] + counters['duplicates']
+            print(f"[Layout Migration] {kind}: {done} files migrated so far...")
+            if pause:
+                time.sleep(pause)
+
+        with os.scandir(root) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                if not is_md5_name(entry.name):
+                    counters['skipped'] += 1
+                    continue
+                batch.append(entry.name)
+                if len(batch) >= batch_size:
+                    flush()
+        if batch:
+            flush()
+
+        return counters
+
+    @staticmethod
+    def _hash_file(path):
+        """分块计算文件 md5 和 sha1（一次读取），返回 (md5, sha1, size)"""
+        md5_hasher = hashlib.md5()
+        sha1_hasher = hashlib.sha1()
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                md5_hasher.update(chunk)
+                sha1_hasher.update(chunk)
+                size += len(chunk)
+        return md5_hasher.hexdigest(), sha1_hasher.hexdigest(), size
+
+    @staticmethod
+    def _manifest_key(path):
+        """扫描清单中的路径：相对图片目录，统一使用 / 分隔"""
+        return os.path.relpath(path, FOLDERS['img']).replace(os.sep, '/')
+
+    @staticmethod
+    def _manifest_row(path, md5, st=None):
+        """生成 scan_manifest 的一行 (path, size, mtime_ns, inode, md5)"""
+        st = st or os.stat(path)
+        return (MemeService._manifest_key(path), st.st_size, st.st_mtime_ns, st.st_ino, md5)
+
     @staticmethod
     def init_db():
         with MemeService.get_conn() as conn:
@@ -83,57 +590,279 @@ class MemeService:
             except sqlite3.OperationalError as e:
                 print(f"Index creation warning (may already exist): {e}")
 
+            # 后处理任务队列
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, md5 TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER DEFAULT 0, error TEXT,
+                created_at REAL, started_at REAL, finished_at REAL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, job_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_md5 ON jobs(md5)")
+
+            # 文件扫描清单: 文件 stat 未变化时直接复用 md5，避免重复计算
+            conn.execute("""CREATE TABLE IF NOT EXISTS scan_manifest (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, md5 TEXT
+            )""")
+
+            # 分块上传会话
+            conn.execute("""CREATE TABLE IF NOT EXISTS upload_sessions (
+                upload_id TEXT PRIMARY KEY, filename TEXT, total_size INTEGER, expected_md5 TEXT,
+                received INTEGER DEFAULT 0, created_at REAL, updated_at REAL,
+                state TEXT DEFAULT 'uploading'
+            )""")
+            # state 列：finalize 时先原子地把会话从 uploading 改为 finalizing，避免并发重复入库
+            session_columns = {r[1] for r in conn.execute("PRAGMA table_info(upload_sessions)")}
+            if 'state' not in session_columns:
+                conn.execute("ALTER TABLE upload_sessions ADD COLUMN state TEXT DEFAULT 'uploading'")
+
+            # 标签共现矩阵（稀疏）：每对标签存两个方向，按 tag_a 查询邻居
+            conn.execute("""CREATE TABLE IF NOT EXISTS tag_cooccurrence (
+                tag_a TEXT NOT NULL, tag_b TEXT NOT NULL, count INTEGER NOT NULL,
+                PRIMARY KEY (tag_a, tag_b)
+            ) WITHOUT ROWID""")
+
+            # sha1 列：QQ 图片链接的 fileid 中带有文件 sha1，下载前即可据此去重
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(images)")}
+            if 'sha1' not in columns:
+                conn.execute("ALTER TABLE images ADD COLUMN sha1 TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_sha1 ON images(sha1)")
+
             # 插入初始 Meta 记录
             conn.execute("INSERT OR IGNORE INTO system_meta (key, version_id, last_updated_at) VALUES (?, 0, ?)",
                         ('rules_state', time.time()))
             conn.commit()
 
     @staticmethod
-    def rebuild_tags_dict():
-        """
-        重建 tags_dict 表，统计所有图片中每个标签的实际使用次数。
-        在后端启动时调用一次，确保数据准确。
+    def backfill_sha1(batch_size=200, progress=None):
         """
-        print("[Tags Dict] Rebuilding tags dictionary...")
+        为 sha1 为空的旧记录补算 sha1（加列前导入的图片、扫描时命中清单的文件等）。
+        按批读取和提交，中断后再次执行只会处理剩余记录。
 
+        Returns:
+            dict: {"updated": n, "missing": n}
+        """
+        progress = progress or (lambda *args: None)
+        counters = {"updated": 0, "missing": 0}
         with MemeService.get_conn() as conn:
-            # 1. 清空现有数据
-            conn.execute("DELETE FROM tags_dict")
+            total = conn.execute("SELECT COUNT(*) FROM images WHERE sha1 IS NULL").fetchone()[0]
+        if not total:
+            return counters
+
+        print(f"[SHA1 Backfill] Computing sha1 for {total} images...")
+        done = 0
+        last_md5 = ''
+        progress('backfilling_sha1', 0, total)
+        while True:
+            with MemeService.get_conn() as conn:
+                rows = conn.execute("SELECT md5, filename FROM images WHERE sha1 IS NULL AND md5 > ? ORDER BY md5 LIMIT ?",
+                                    (last_md5, batch_size)).fetchall()
+            if not rows:
+                break
+            last_md5 = rows[-1]['md5']
+
+            updates = []
+            for row in rows:
+                path = MemeService.resolve_path('img', row['filename'])
+                if not path:
+                    counters['missing'] += 1
+                    continue
+                try:
+                    _, sha1, _ = MemeService._hash_file(path)
+                except OSError as e:
+                    print(f"[SHA1 Backfill] Read failed {path}: {e}")
+                    counters['missing'] += 1
+                    continue
+                updates.append((sha1, row['md5']))
+
+            with MemeService.get_conn() as conn:
+                conn.executemany("UPDATE images SET sha1=? WHERE md5=? AND sha1 IS NULL", updates)
+                conn.commit()
+            counters['updated'] += len(updates)
+            done += len(rows)
+            progress('backfilling_sha1', done, total)
 
-            # 2. 获取所有图片的标签
-            rows = conn.execute("SELECT tags_text FROM images_fts WHERE tags_text IS NOT NULL AND tags_text != ''").fetchall()
+        print(f"[SHA1 Backfill] Done: updated={counters['updated']} missing={counters['missing']}")
+        return counters
 
-            # 3. 统计每个标签的使用次数
-            tag_counts = {}
-            for row in rows:
-                tags = row['tags_text'].split(' ')
-                for tag in tags:
-                    tag = tag.strip()
-                    if tag:
-                        tag_counts[tag] = tag_counts.get(tag, 0) + 1
-
-            # 4. 批量插入
-            if tag_counts:
-                conn.executemany(
-                    "INSERT INTO tags_dict (name, use_count) VALUES (?, ?)",
-                    [(name, count) for name, count in tag_counts.items()]
-                )
+    @staticmethod
+    def _count_tags(tags_text):
+        """按 rebuild 的口径统计一条 tags_text 中各标签的出现次数"""
+        return Counter(t for t in (tags_text or "").split(' ') if t.strip())
+
+    @staticmethod
+    def rebuild_tags_dict(repair=True):
+        """
+        tags_dict 一致性检查：按 images_fts 重新统计每个标签的使用次数，与表中数据对比。
+
+        use_count 平时由 update_index 增量维护，这里只用于启动和定时校验，报告偏差（drift）并修正。
+        整个检查在一个写事务中完成，期间的 update_index 会等待，不会与修正交错。
 
+        Returns:
+            dict: {'tags', 'missing', 'stale', 'mismatched'}，后三项为偏差的标签数
+        """
+        print("[Tags Dict] Checking tags dictionary...")
+
+        with MemeService.get_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+
+            # 1. 按 images_fts 统计实际使用次数
+            tag_counts = Counter()
+            for row in conn.execute("SELECT tags_text FROM images_fts WHERE tags_text IS NOT NULL AND tags_text != ''"):
+                tag_counts.update(MemeService._count_tags(row['tags_text']))
+
+            # 2. 与 tags_dict 对比
+            stored = {r['name']: r['use_count'] for r in conn.execute("SELECT name, use_count FROM tags_dict")}
+            missing = [(name, n) for name, n in tag_counts.items() if name not in stored]
+            mismatched = [(n, name) for name, n in tag_counts.items() if name in stored and stored[name] != n]
+            stale = [(name,) for name in stored if name not in tag_counts]
+
+            # 3. 修正偏差
+            if repair:
+                conn.executemany("INSERT INTO tags_dict (name, use_count) VALUES (?, ?)", missing)
+                conn.executemany("UPDATE tags_dict SET use_count=? WHERE name=?", mismatched)
+                conn.executemany("DELETE FROM tags_dict WHERE name=?", stale)
             conn.commit()
 
-        print(f"[Tags Dict] Rebuilt with {len(tag_counts)} unique tags.")
+        drift = {"tags": len(tag_counts), "missing": len(missing), "stale": len(stale), "mismatched": len(mismatched)}
+        if missing or stale or mismatched:
+            print(f"[Tags Dict] Drift detected: missing={drift['missing']} stale={drift['stale']} "
+                  f"mismatched={drift['mismatched']} ({'repaired' if repair else 'not repaired'})")
+            for n, name in mismatched[:10]:
+                print(f"  - {name}: stored={stored[name]} actual={n}")
+        # 补全索引按需从 tags_dict 重新加载（顺带消除内存中可能累积的偏差）
+        TagIndex.invalidate()
+        print(f"[Tags Dict] {len(tag_counts)} unique tags checked.")
+        return drift
 
     @staticmethod
-    def update_index(md5, tags):
-        """更新图片的 FTS 索引（不再维护 tags_dict，由启动时重建）"""
+    def _apply_tag_deltas(conn, old_counts, new_counts):
+        """把一张图片标签变化的 +1/-1 增量写入 tags_dict（在调用方的事务中执行），返回增量"""
+        deltas = Counter(new_counts)
+        deltas.subtract(old_counts)
+        increments = [(name, n) for name, n in deltas.items() if n > 0]
+        decrements = [(-n, name) for name, n in deltas.items() if n < 0]
+        if increments:
+            conn.executemany("""INSERT INTO tags_dict (name, use_count) VALUES (?, ?)
+                                ON CONFLICT(name) DO UPDATE SET use_count = use_count + excluded.use_count""",
+                             increments)
+        if decrements:
+            conn.executemany("UPDATE tags_dict SET use_count = use_count - ? WHERE name=?", decrements)
+            # 不再使用的标签从字典中删除（与一致性检查的结果保持一致）
+            conn.executemany("DELETE FROM tags_dict WHERE name=? AND use_count <= 0",
+                             [(name,) for _, name in decrements])
+        return deltas
+
+    @staticmethod
+    def update_index(md5, tags, conn=None):
+        """
+        更新图片的 FTS 索引，并在同一事务中按新旧标签的差异增量维护 tags_dict.use_count。
+
+        Args:
+            conn: 调用方的连接（例如批量导入），由调用方负责 commit 并在提交后调用 TagIndex.apply；
+                  为 None 时自行打开连接并提交
+
+        Returns:
+            Counter: 标签 -> use_count 增量
+        """
+        if conn is None:
+            with MemeService.get_conn() as own_conn:
+                deltas = MemeService.update_index(md5, tags, own_conn)
+                own_conn.commit()
+            TagIndex.apply(deltas)
+            return deltas
+
         clean_tags = [t.strip() for t in tags if t.strip()]
         tags_str = " ".join(clean_tags)
 
+        if not conn.in_transaction:
+            # 读取旧标签前就拿到写锁，避免并发更新同一图片时重复计数
+            conn.execute("BEGIN IMMEDIATE")
+        old = conn.execute("SELECT tags_text FROM images_fts WHERE md5=?", (md5,)).fetchall()
+        old_counts = Counter()
+        for row in old:
+            old_counts.update(MemeService._count_tags(row['tags_text']))
+
+        conn.execute("DELETE FROM images_fts WHERE md5=?", (md5,))
+        if tags_str:
+            conn.execute("INSERT INTO images_fts (md5, tags_text) VALUES (?, ?)", (md5, tags_str))
+        new_counts = MemeService._count_tags(tags_str)
+        MemeService._apply_cooccurrence_deltas(conn, old_counts.keys(), new_counts.keys())
+        return MemeService._apply_tag_deltas(conn, old_counts, new_counts)
+
+    @staticmethod
+    def _tag_pairs(tags):
+        """一张图片上两两共现的标签对（两个方向都包含）"""
+        tags = set(tags)
+        return {(a, b) for a in tags for b in tags if a != b}
+
+    @staticmethod
+    def _apply_cooccurrence_deltas(conn, old_tags, new_tags):
+        """
+        按一张图片新旧标签的差异更新 tag_cooccurrence（在调用方的事务中执行），计数降为 0 的行删除。
+        """
+        old_pairs = MemeService._tag_pairs(old_tags)
+        new_pairs = MemeService._tag_pairs(new_tags)
+        added = new_pairs - old_pairs
+        removed = old_pairs - new_pairs
+        if added:
+            conn.executemany("""INSERT INTO tag_cooccurrence (tag_a, tag_b, count) VALUES (?, ?, 1)
+                                ON CONFLICT(tag_a, tag_b) DO UPDATE SET count = count + 1""", added)
+        if removed:
+            conn.executemany("UPDATE tag_cooccurrence SET count = count - 1 WHERE tag_a=? AND tag_b=?", removed)
+            conn.executemany("DELETE FROM tag_cooccurrence WHERE tag_a=? AND tag_b=? AND count <= 0", removed)
+
+    @staticmethod
+    def ensure_cooccurrence():
+        """
+        首次启动时从 images_fts 全量统计标签共现（只做一次，之后由 update_index 增量维护），
+        完成后在 system_meta 中记录 tag_cooccurrence 标记（version_id 为统计格式版本）。
+
+        版本 1 的表按 top-K 裁剪过，被裁掉的标签对计数已经不准，升级后重新全量统计一次。
+        """
         with MemeService.get_conn() as conn:
-            conn.execute("DELETE FROM images_fts WHERE md5=?", (md5,))
-            if tags_str:
-                conn.execute("INSERT INTO images_fts (md5, tags_text) VALUES (?, ?)", (md5, tags_str))
+            row = conn.execute("SELECT version_id FROM system_meta WHERE key='tag_cooccurrence'").fetchone()
+            if row and row['version_id'] >= 2:
+                return
+            print("[Tag Co-occurrence] Building from images_fts...")
+            start = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            pair_counts = Counter()
+            for row in conn.execute("SELECT tags_text FROM images_fts WHERE tags_text IS NOT NULL AND tags_text != ''"):
+                pair_counts.update(MemeService._tag_pairs(MemeService._count_tags(row['tags_text'])))
+            conn.execute("DELETE FROM tag_cooccurrence")
+            conn.executemany("INSERT INTO tag_cooccurrence (tag_a, tag_b, count) VALUES (?, ?, ?)",
+                             ((a, b, n) for (a, b), n in pair_counts.items()))
+            conn.execute("INSERT OR REPLACE INTO system_meta (key, version_id, last_updated_at) VALUES (?, 2, ?)",
+                         ('tag_cooccurrence', time.time()))
             conn.commit()
+        print(f"[Tag Co-occurrence] {len(pair_counts)} pairs in {time.time() - start:.2f}s")
+
+    @staticmethod
+    def related_tags(tags, limit=TAG_RELATED_DEFAULT_LIMIT, top_k=TAG_COOCCURRENCE_TOP_K):
+        """
+        与给定标签经常一起出现的标签。
+
+        每个给定标签只取共现次数最多的 top_k 个邻居，
+        先按同时关联的给定标签数排序，再按共现次数之和排序；结果不包含给定标签本身。
+
+        Returns:
+            list: [{"name", "count", "matched"}]，matched 为与之共现的给定标签数
+        """
+        tags = list(dict.fromkeys(t for t in tags if t))
+        if not tags:
+            return []
+        placeholders = ",".join("?" * len(tags))
+        with MemeService.get_conn() as conn:
+            rows = conn.execute(f"""
+                SELECT tag_b, SUM(count) AS total, COUNT(*) AS matched FROM (
+                    SELECT tag_b, count,
+                           ROW_NUMBER() OVER (PARTITION BY tag_a ORDER BY count DESC, tag_b) AS rank
+                    FROM tag_cooccurrence WHERE tag_a IN ({placeholders})
+                )
+                WHERE rank <= ? AND tag_b NOT IN ({placeholders})
+                GROUP BY tag_b ORDER BY matched DESC, total DESC, tag_b LIMIT ?
+            """, tags + [top_k] + tags + [limit]).fetchall()
+        return [{"name": r['tag_b'], "count": r['total'], "matched": r['matched']} for r in rows]
 
     @staticmethod
     def get_rules_data(conn):
@@ -310,9 +1039,11 @@ class MemeService:
         result_value = None # 用于存储 write_func 可能返回的值 (如新 ID)
 
         with MemeService.get_conn() as conn:
+            tx_start = time.perf_counter()
             try:
                 # 开始独占事务
                 conn.execute("BEGIN EXCLUSIVE TRANSACTION")
+                METRIC_DB_LOCK_WAIT.observe(time.perf_counter() - tx_start)
 
                 # 读取当前版本号
                 meta = conn.execute("SELECT version_id FROM system_meta WHERE key='rules_state'").fetchone()
@@ -322,6 +1053,8 @@ class MemeService:
                 if current_version != base_version:
                     # 显式回滚事务，释放锁
                     conn.rollback()
+                    METRIC_DB_TRANSACTION.observe(time.perf_counter() - tx_start, "conflict")
+                    METRIC_RULE_CONFLICTS.inc()
 
                     # 在事务外重新查询最新数据（避免持有锁）
                     conflict_count_row = conn.execute(
@@ -352,6 +1085,7 @@ class MemeService:
 
                 # 提交事务
                 conn.commit()
+                METRIC_DB_TRANSACTION.observe(time.perf_counter() - tx_start, "commit")
 
                 response_data = {"success": True, "version_id": new_version, "status": 200}
 
@@ -364,6 +1098,7 @@ class MemeService:
             except Exception as e:
                 # 确保异常时回滚
                 conn.rollback()
+                METRIC_DB_TRANSACTION.observe(time.perf_counter() - tx_start, "error")
                 print(f"Transaction failed: {e}")
                 import traceback
                 traceback.print_exc()  # 打印完整堆栈，便于调试
@@ -687,32 +1422,45 @@ class MemeService:
         return img.copy()
 
     @staticmethod
-    def _create_thumbnail_file(source_path, thumb_path):
+    def _render_thumbnail(img, thumb_path):
+        """从已打开的 Image 对象生成 JPEG 缩略图（不会重新读取文件）"""
+        if not getattr(img, "is_animated", False):
+            # 静态 JPEG 可以直接按缩小比例解码，大图的内存和耗时都显著降低
+            img.draft("RGB", (THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+
+        frame = MemeService._extract_random_frame(img)
+
+        # 转换模式，确保兼容 JPEG
+        if frame.mode not in ("RGB", "L"):
+            frame = frame.convert("RGB")
+        elif frame.mode == "L":
+            frame = frame.convert("RGB") # 强制转RGB以保持一致性
+
+        # 缩放
+        frame.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE), Image.LANCZOS)
+
+        # 保存为 JPEG
+        frame.save(thumb_path, "JPEG", quality=85, optimize=True)
+
+    @staticmethod
+    def _probe_and_thumbnail(source_path, thumb_path):
         """
-        使用指定的参数生成缩略图
+        打开一次原图，同时获取尺寸并生成缩略图
 
         Returns:
-            bool: True 表示成功，False 表示失败
+            tuple: (width, height, ok)，无法解析时尺寸为 (0, 0)
         """
+        # 确保目录存在（降级复制时也需要）
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+
+        w, h = 0, 0
+        start = time.perf_counter()
         try:
             with Image.open(source_path) as img:
-                frame = MemeService._extract_random_frame(img)
-
-                # 转换模式，确保兼容 JPEG
-                if frame.mode not in ("RGB", "L"):
-                    frame = frame.convert("RGB")
-                elif frame.mode == "L":
-                    frame = frame.convert("RGB") # 强制转RGB以保持一致性
-
-                # 缩放
-                frame.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE), Image.LANCZOS)
-
-                # 确保目录存在
-                os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
-
-                # 保存为 JPEG
-                frame.save(thumb_path, "JPEG", quality=85, optimize=True)
-                return True
+                w, h = img.size
+                MemeService._render_thumbnail(img, thumb_path)
+            METRIC_THUMBNAIL.observe(time.perf_counter() - start, "ok")
+            return w, h, True
 
         except Exception as e:
             print(f"Thumbnail generation failed for {source_path}: {e}")
@@ -725,55 +1473,306 @@ class MemeService:
                 print(f"Attempting to copy original as thumbnail fallback...")
                 shutil.copy(source_path, thumb_path)
                 print(f"Fallback successful: copied {source_path} to {thumb_path}")
-                return True
+                METRIC_THUMBNAIL.observe(time.perf_counter() - start, "fallback")
+                return w, h, True
             except Exception as fallback_error:
                 print(f"Fallback copy also failed: {fallback_error}")
-                return False
+                METRIC_THUMBNAIL.observe(time.perf_counter() - start, "failed")
+                return w, h, False
 
     @staticmethod
-    def handle_upload(file_obj):
-        blob = file_obj.read()
-        md5 = hashlib.md5(blob).hexdigest()
-        file_obj.seek(0)
+    def _create_thumbnail_file(source_path, thumb_path):
+        """
+        使用指定的参数生成缩略图
 
-        with MemeService.get_conn() as conn:
-            existing = conn.execute("SELECT 1 FROM images WHERE md5=?", (md5,)).fetchone()
-            if existing:
-                # 重复图片：更新上传时间
-                conn.execute("UPDATE images SET created_at=? WHERE md5=?", (time.time(), md5))
+        Returns:
+            bool: True 表示成功，False 表示失败
+        """
+        return MemeService._probe_and_thumbnail(source_path, thumb_path)[2]
+
+    @staticmethod
+    def _spool_upload(stream, max_size=None):
+        """
+        分块读取上传流，边写临时文件边计算 md5 和 sha1，内存占用与文件大小无关。
+        临时文件位于图片目录内（以 . 开头，扫描时会被忽略），保证之后的 rename 是原子操作。
+
+        Args:
+            max_size: 超过该字节数时中止并抛出 ValueError（压缩包成员不受请求体大小限制）
+
+        Returns:
+            tuple: (tmp_path, md5, sha1, size)
+        """
+        hasher = hashlib.md5()
+        sha1_hasher = hashlib.sha1()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(prefix='.upload-', suffix='.part', dir=FOLDERS['img'])
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ValueError(f"File too large (max {max_size} bytes)")
+                    hasher.update(chunk)
+                    sha1_hasher.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            MemeService._discard_temp(tmp_path)
+            raise
+        METRIC_UPLOAD_SIZE.observe(size)
+        return tmp_path, hasher.hexdigest(), sha1_hasher.hexdigest(), size
+
+    @staticmethod
+    def _discard_temp(tmp_path):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _existing_md5s(conn, md5s):
+        """批量查询已存在的 md5（分段避免超出 SQLite 变量数上限）"""
+        found = set()
+        md5s = list(md5s)
+        for i in range(0, len(md5s), 500):
+            part = md5s[i:i + 500]
+            placeholders = ','.join(['?'] * len(part))
+            found.update(r[0] for r in conn.execute(
+                f"SELECT md5 FROM images WHERE md5 IN ({placeholders})", part))
+        return found
+
+    @staticmethod
+    def _ingest_spooled_batch(spooled):
+        """
+        将已落盘并算好 md5 的临时文件批量入库：去重 -> 原子重命名 -> 尺寸/缩略图 -> 写库。
+        所有新记录和重复记录的时间刷新在同一个事务中提交，临时文件在任何情况下都会被移走或删除；
+        写库失败时本次移入正式目录的文件和缩略图也会删除，不留下没有记录的图片。
+
+        Args:
+            spooled: [(tmp_path, md5, sha1, size, ext), ...]
+
+        Returns:
+            list: [(is_new, md5 或提示信息), ...]，与输入一一对应，语义与 handle_upload 相同
+        """
+        results = [None] * len(spooled)
+        new_items = []
+        committed = False
+        try:
+            with MemeService.get_conn() as conn:
+                existing = MemeService._existing_md5s(conn, {item[1] for item in spooled})
+
+            # 1. 去重并原子重命名为正式文件（同一批内的重复文件也按重复处理）
+            seen = set()
+            dup_md5s = []
+            for i, (tmp_path, md5, sha1, size, ext) in enumerate(spooled):
+                if md5 in existing or md5 in seen:
+                    # 重复图片：更新上传时间
+                    dup_md5s.append(md5)
+                    results[i] = (False, "Duplicate image (timestamp refreshed)")
+                    continue
+                seen.add(md5)
+                filename = f"{md5}{ext}"
+                original_path = MemeService.sharded_path('img', filename)
+                os.makedirs(os.path.dirname(original_path), exist_ok=True)
+                os.replace(tmp_path, original_path)
+                new_items.append({'md5': md5, 'sha1': sha1, 'filename': filename, 'path': original_path,
+                                  'size': size, 'width': 0, 'height': 0,
+                                  'manifest': MemeService._manifest_row(original_path, md5)})
+                results[i] = (True, md5)
+
+            # 2. 同步模式下，一次解码同时获取尺寸并生成缩略图 (强制使用 .jpg)
+            if new_items and not ASYNC_POSTPROCESS:
+                def probe(item):
+                    thumb_path = MemeService.sharded_path('thumb', MemeService.thumb_name(item['md5']))
+                    item['width'], item['height'], _ = MemeService._probe_and_thumbnail(item['path'], thumb_path)
+
+                if len(new_items) == 1:
+                    probe(new_items[0])
+                else:
+                    with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS) as executor:
+                        list(executor.map(probe, new_items))
+
+            # 3. 单个事务写库；异步模式下同时登记后处理任务，尺寸和缩略图由后台 worker 补全
+            now = time.time()
+            with MemeService.get_conn() as conn:
+                if dup_md5s:
+                    conn.executemany("UPDATE images SET created_at=? WHERE md5=?", [(now, m) for m in dup_md5s])
+                if new_items:
+                    # OR IGNORE: 并发上传同一张图时不让整批失败
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO images (md5, filename, created_at, width, height, size, sha1) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(item['md5'], item['filename'], now, item['width'], item['height'], item['size'], item['sha1'])
+                         for item in new_items]
+                    )
+                    conn.executemany("INSERT OR REPLACE INTO scan_manifest (path, size, mtime_ns, inode, md5) VALUES (?, ?, ?, ?, ?)",
+                                     [item['manifest'] for item in new_items])
+                    if ASYNC_POSTPROCESS:
+                        for item in new_items:
+                            JobQueue.enqueue(conn, 'postprocess', item['md5'])
                 conn.commit()
-                return False, "Duplicate image (timestamp refreshed)"
+            committed = True
+
+            if new_items:
+                Md5Index.add_many(item['md5'] for item in new_items)
+            if new_items and ASYNC_POSTPROCESS:
+                JobQueue.notify()
+
+            return results
+        except BaseException:
+            if not committed:
+                for item in new_items:
+                    MemeService._discard_temp(item['path'])
+                    MemeService._discard_temp(MemeService.sharded_path('thumb', MemeService.thumb_name(item['md5'])))
+            raise
+        finally:
+            for tmp_path, *_ in spooled:
+                if os.path.exists(tmp_path):
+                    MemeService._discard_temp(tmp_path)
+
+    @staticmethod
+    def _ingest_spooled(tmp_path, md5, sha1, size, ext):
+        """单个临时文件入库，返回 (is_new, md5 或提示信息)"""
+        return MemeService._ingest_spooled_batch([(tmp_path, md5, sha1, size, ext)])[0]
+
+    @staticmethod
+    def handle_upload(file_obj):
+        ext = os.path.splitext(file_obj.filename)[1].lower() or '.jpg'
+        tmp_path, md5, sha1, size = MemeService._spool_upload(file_obj.stream)
+        return MemeService._ingest_spooled(tmp_path, md5, sha1, size, ext)
+
+    @staticmethod
+    def _is_zip(fileobj):
+        """判断可 seek 的文件对象是否为 zip（不可 seek 的流一律按 tar 处理）"""
+        seekable = getattr(fileobj, 'seekable', None)
+        if not (seekable and seekable()):
+            return False
+        result = zipfile.is_zipfile(fileobj)
+        fileobj.seek(0)
+        return result
+
+    @staticmethod
+    def _iter_archive(archive):
+        """
+        遍历 zip/tar(.gz) 压缩包中的图片文件，产出 (name, stream_opener)。
+        zip 成员可以并行读取；tar 以流模式读取（不需要可 seek 的输入），必须按顺序消费。
+
+        Args:
+            archive: 已打开的 zipfile.ZipFile（opener 在遍历结束后才会调用，由调用方负责关闭），
+                     或 tar(.gz) 文件对象/流
+
+        防止解压炸弹（请求体大小只限制了压缩后的数据）：
+        - 条目数超过 ARCHIVE_MAX_MEMBERS、图片解压后总大小超过 ARCHIVE_MAX_TOTAL_SIZE 时抛出 ValueError
+        - 声明大小超过 MAX_UPLOAD_SIZE 的成员不读取，其 opener 直接抛出 ValueError
+        zip/tar 读取成员时都不会超出其声明的大小，落盘时 _spool_upload 还会再按 MAX_UPLOAD_SIZE 截止。
+        """
+        def supported(name):
+            base = os.path.basename(name)
+            return base and not base.startswith('.') and os.path.splitext(base)[1].lower() in SUPPORTED_EXTENSIONS
+
+        def too_large():
+            raise ValueError(f"File too large (max {MAX_UPLOAD_SIZE} bytes)")
+
+        def check_total(total):
+            if total > ARCHIVE_MAX_TOTAL_SIZE:
+                raise ValueError(f"Archive too large when extracted (max {ARCHIVE_MAX_TOTAL_SIZE} bytes)")
+
+        if isinstance(archive, zipfile.ZipFile):
+            zf = archive
+            infos = zf.infolist()
+            if len(infos) > ARCHIVE_MAX_MEMBERS:
+                raise ValueError(f"Too many archive members (max {ARCHIVE_MAX_MEMBERS})")
+            total = 0
+            for info in infos:
+                if info.is_dir() or not supported(info.filename):
+                    continue
+                name = os.path.basename(info.filename)
+                if info.file_size > MAX_UPLOAD_SIZE:
+                    yield name, too_large
+                    continue
+                total += info.file_size
+                check_total(total)
+                yield name, (lambda info=info: zf.open(info))
+        else:
+            with tarfile.open(fileobj=archive, mode='r|*') as tf:
+                total = 0
+                for count, member in enumerate(tf, 1):
+                    if count > ARCHIVE_MAX_MEMBERS:
+                        raise ValueError(f"Too many archive members (max {ARCHIVE_MAX_MEMBERS})")
+                    if not member.isfile() or not supported(member.name):
+                        continue
+                    name = os.path.basename(member.name)
+                    if member.size > MAX_UPLOAD_SIZE:
+                        yield name, too_large
+                        continue
+                    total += member.size
+                    check_total(total)
+                    stream = tf.extractfile(member)
+                    yield name, (lambda stream=stream: stream)
 
-            ext = os.path.splitext(file_obj.filename)[1].lower() or '.jpg'
-            filename = f"{md5}{ext}"
+    @staticmethod
+    def handle_upload_batch(sources, parallel=True):
+        """
+        批量上传：并行分块读取并计算 md5，再一次性去重和写库。
 
-            # 1. 保存原图
-            original_path = os.path.join(FOLDERS['img'], filename)
-            file_obj.save(original_path)
+        Args:
+            sources: [(name, stream_opener), ...]，stream_opener() 返回可 read(n) 的流
+            parallel: False 时按顺序读取（用于 tar 流等只能顺序读取的来源）
 
-            # 2. 获取原图尺寸 (为了写入数据库)
+        Returns:
+            list: [{"name", "success", "msg"} 或 {"name", "success": False, "error"}, ...]
+        """
+        def spool(source):
+            name, opener = source
+            ext = os.path.splitext(name)[1].lower() or '.jpg'
+            stream = opener()
             try:
-                with Image.open(original_path) as img:
-                    w, h = img.size
-            except:
-                w, h = 0, 0
-
-            # 3. 生成缩略图 (强制使用 .jpg)
-            thumb_filename = f"{md5}_thumbnail.jpg"
-            thumb_path = os.path.join(FOLDERS['thumb'], thumb_filename)
-            MemeService._create_thumbnail_file(original_path, thumb_path)
-
-            # 4. 写入数据库
-            conn.execute("INSERT INTO images (md5, filename, created_at, width, height, size) VALUES (?, ?, ?, ?, ?, ?)",
-                         (md5, filename, time.time(), w, h, len(blob)))
-            conn.commit()
+                tmp_path, md5, sha1, size = MemeService._spool_upload(stream, max_size=MAX_UPLOAD_SIZE)
+            finally:
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            return tmp_path, md5, sha1, size, ext
+
+        spooled = []
+        entries = []
 
-            MemeService.update_index(md5, [])
+        def add(name, func):
+            try:
+                spooled.append(func())
+                entries.append({"name": name})
+            except Exception as e:
+                entries.append({"name": name, "success": False, "error": str(e)})
 
-        return True, md5
+        if parallel:
+            with ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS) as executor:
+                futures = [(src[0], executor.submit(spool, src)) for src in sources]
+                for name, future in futures:
+                    add(name, future.result)
+        else:
+            try:
+                for src in sources:
+                    if len(entries) >= BATCH_UPLOAD_MAX_FILES:
+                        entries.append({"name": src[0], "success": False, "error": "Too many files in batch"})
+                        continue
+                    add(src[0], lambda src=src: spool(src))
+            except BaseException:
+                # 来源本身出错（例如压缩包超出限制）：已落盘的临时文件不再入库
+                for item in spooled:
+                    MemeService._discard_temp(item[0])
+                raise
+
+        ingest_results = iter(MemeService._ingest_spooled_batch(spooled)) if spooled else iter(())
+        for entry in entries:
+            if 'error' not in entry:
+                ok, msg = next(ingest_results)
+                entry.update({"success": ok, "msg": msg})
+        return entries
 
     @staticmethod
-    def scan_and_import_folder():
+    def scan_and_import_folder(full=False, progress=None, paths=None):
         """
         启动时扫描 meme_images 文件夹，自动导入未在数据库中的图片。
         处理文件验证、重命名、去重、缩略图生成。
@@ -783,8 +1782,14 @@ class MemeService:
         2. 批量数据库插入
         3. 移除无意义的空标签索引调用
         4. 线程安全的计数器和文件操作
+        5. scan_manifest 记录 (path, size, mtime_ns, inode) -> md5，stat 未变化的文件不再重新计算 md5
+
+        Args:
+            full: 完整校验模式，忽略清单重新计算所有文件的 md5，并报告与清单不一致的文件
+            progress: 可选进度回调 progress(phase, done, total)，phase 为 'scanning' 或 'thumbnails'
+            paths: 只处理指定的文件（目录监听使用），为 None 时扫描整个图片目录
         """
-        import glob
+        progress = progress or (lambda phase, done, total: None)
         import threading
         from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -795,20 +1800,27 @@ class MemeService:
             print(f"[Folder Scan] Image folder not found: {img_folder}")
             return
 
-        # 支持的图片格式
-        supported_formats = ['*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.bmp']
-
-        # 收集所有文件路径
+        # 收集所有文件路径和 stat（根目录 + 分片子目录，一次遍历完成，跳过隐藏目录）
         all_files = []
-        for pattern in supported_formats:
-            file_pattern = os.path.join(img_folder, pattern)
-            all_files.extend(glob.glob(file_pattern, recursive=False))
-            # 也扫描大写扩展名
-            file_pattern_upper = os.path.join(img_folder, pattern.upper())
-            all_files.extend(glob.glob(file_pattern_upper, recursive=False))
-
-        # 去重（同一文件可能被多个模式匹配）
-        all_files = list(set(all_files))
+        pending_dirs = [] if paths is not None else [img_folder]
+        for fp in paths or []:
+            try:
+                all_files.append((fp, os.stat(fp)))
+            except OSError:
+                continue
+        while pending_dirs:
+            with os.scandir(pending_dirs.pop()) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS:
+                            all_files.append((entry.path, entry.stat()))
+                    except OSError:
+                        continue
+
         total_files = len(all_files)
 
         if total_files == 0:
@@ -816,15 +1828,32 @@ class MemeService:
             return
 
         print(f"[Folder Scan] Found {total_files} files to process...")
+        progress('scanning', 0, total_files)
 
         # 第一阶段：获取数据库中已存在的 MD5 集合
         with MemeService.get_conn() as conn:
             existing_md5s = set(row['md5'] for row in conn.execute("SELECT md5 FROM images").fetchall())
             # 同时获取 md5 -> filename 的映射用于重命名检查
             md5_to_filename = {row['md5']: row['filename'] for row in conn.execute("SELECT md5, filename FROM images").fetchall()}
+            if paths is None:
+                manifest_rows = conn.execute("SELECT path, size, mtime_ns, inode, md5 FROM scan_manifest").fetchall()
+            else:
+                manifest_rows = []
+                keys = [MemeService._manifest_key(fp) for fp, _ in all_files]
+                for i in range(0, len(keys), 500):
+                    part = keys[i:i + 500]
+                    manifest_rows += conn.execute(
+                        f"SELECT path, size, mtime_ns, inode, md5 FROM scan_manifest WHERE path IN ({','.join(['?'] * len(part))})",
+                        part).fetchall()
+            manifest = {row['path']: (row['size'], row['mtime_ns'], row['inode'], row['md5']) for row in manifest_rows}
 
         # 线程安全的计数器（在主线程中更新，无需锁）
-        counters = {'skipped': 0, 'renamed': 0, 'error': 0}
+        counters = {'skipped': 0, 'renamed': 0, 'error': 0, 'unchanged': 0, 'hashed': 0, 'mismatch': 0}
+
+        # 处理后仍留在磁盘上的文件 (path, md5, stat)，用于更新清单（list.append 线程安全）
+        manifest_updates = []
+        unchanged_keys = set()
+        counter_lock = threading.Lock()  # 工作线程中更新的计数器
 
         # 文件操作锁（防止重命名冲突）
         file_op_lock = threading.Lock()
@@ -859,22 +1888,33 @@ class MemeService:
                 print(f"[Folder Scan] Remove failed {path}: {e}")
                 return False
 
-        def process_single_file(file_path):
-            """处理单个文件：计算MD5、重命名、获取尺寸"""
+        def process_single_file(file_path, st, known_md5=None):
+            """处理单个文件：计算MD5（清单命中时跳过）、重命名、获取尺寸"""
             try:
                 # 检查文件是否还存在（可能被其他线程处理了）
                 if not os.path.exists(file_path):
                     return ('skipped', None)
 
-                # 计算文件 MD5
-                try:
-                    with open(file_path, 'rb') as f:
-                        file_data = f.read()
-                except (FileNotFoundError, PermissionError) as e:
-                    # 文件被删除或被占用
-                    return ('skipped', None)
+                if known_md5:
+                    # 清单命中时不重新读取文件，sha1 留空由 backfill_sha1 补全
+                    md5, sha1, file_size = known_md5, None, st.st_size
+                else:
+                    # 分块计算文件 MD5 / SHA1
+                    try:
+                        md5, sha1, file_size = MemeService._hash_file(file_path)
+                    except (FileNotFoundError, PermissionError) as e:
+                        # 文件被删除或被占用
+                        return ('skipped', None)
+                    with counter_lock:
+                        counters['hashed'] += 1
+
+                    # 完整校验模式：与清单中记录的 md5 比对（stat 未变但内容变化说明文件损坏）
+                    cached = manifest.get(MemeService._manifest_key(file_path))
+                    if full and cached and cached[:3] == (st.st_size, st.st_mtime_ns, st.st_ino) and cached[3] != md5:
+                        with counter_lock:
+                            counters['mismatch'] += 1
+                        print(f"[Folder Scan] Integrity mismatch: {file_path} (manifest {cached[3]}, actual {md5})")
 
-                md5 = hashlib.md5(file_data).hexdigest()
                 current_filename = os.path.basename(file_path)
 
                 # 检查是否已存在于数据库
@@ -882,28 +1922,38 @@ class MemeService:
                     # 检查是否需要重命名
                     expected_filename = md5_to_filename.get(md5)
                     if expected_filename and current_filename != expected_filename:
-                        new_path = os.path.join(img_folder, expected_filename)
+                        new_path = MemeService.sharded_path('img', expected_filename)
                         with file_op_lock:
-                            if not os.path.exists(new_path):
+                            if not MemeService.resolve_path('img', expected_filename):
+                                os.makedirs(os.path.dirname(new_path), exist_ok=True)
                                 if safe_rename(file_path, new_path):
+                                    manifest_updates.append((new_path, md5, None))
                                     return ('renamed', None)
+                    manifest_updates.append((file_path, md5, st))
                     return ('skipped', None)
 
                 # 新文件处理
                 ext = os.path.splitext(file_path)[1].lower() or '.jpg'
                 standard_filename = f"{md5}{ext}"
-                standard_path = os.path.join(img_folder, standard_filename)
+                standard_path = MemeService.sharded_path('img', standard_filename)
 
-                # 重命名为标准格式
+                # 重命名为标准格式并移入分片目录
                 if file_path != standard_path:
                     with file_op_lock:
-                        if os.path.exists(standard_path):
-                            # 目标文件已存在，删除当前重复文件
+                        existing = MemeService.resolve_path('img', standard_filename)
+                        if existing and os.path.abspath(existing) != os.path.abspath(file_path):
+                            # 另一份同名文件已存在，删除当前重复文件
                             safe_remove(file_path)
                             return ('skipped', None)
-                        else:
-                            if not safe_rename(file_path, standard_path):
-                                return ('error', None)
+                        # 平铺目录中已按 md5 命名但未入库的文件（resolve_path 找到的就是它自己）也移入分片目录
+                        os.makedirs(os.path.dirname(standard_path), exist_ok=True)
+                        try:
+                            os.replace(file_path, standard_path)
+                        except OSError as e:
+                            print(f"[Folder Scan] Move failed {file_path} -> {standard_path}: {e}")
+                            return ('error', None)
+
+                manifest_updates.append((standard_path, md5, None))
 
                 # 获取图片尺寸
                 try:
@@ -912,8 +1962,6 @@ class MemeService:
                 except Exception:
                     w, h = 0, 0
 
-                file_size = len(file_data)
-
                 try:
                     file_mtime = os.path.getmtime(standard_path)
                 except OSError:
@@ -921,6 +1969,7 @@ class MemeService:
 
                 return ('new', {
                     'md5': md5,
+                    'sha1': sha1,
                     'filename': standard_filename,
                     'path': standard_path,
                     'width': w,
@@ -936,8 +1985,7 @@ class MemeService:
         def generate_thumbnail(item):
             """生成单个缩略图"""
             try:
-                thumb_filename = f"{item['md5']}_thumbnail.jpg"
-                thumb_path = os.path.join(FOLDERS['thumb'], thumb_filename)
+                thumb_path = MemeService.sharded_path('thumb', MemeService.thumb_name(item['md5']))
                 MemeService._create_thumbnail_file(item['path'], thumb_path)
                 return True
             except Exception as e:
@@ -951,11 +1999,25 @@ class MemeService:
         max_workers = min(8, os.cpu_count() or 4)
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = {executor.submit(process_single_file, fp): fp for fp in all_files}
+            futures = {}
+            for fp, st in all_files:
+                key = MemeService._manifest_key(fp)
+                cached = manifest.get(key)
+                known_md5 = None
+                if not full and cached and cached[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+                    known_md5 = cached[3]
+                    # stat 未变化且已是标准文件名的已入库文件，直接跳过
+                    if known_md5 in existing_md5s and os.path.basename(fp) == md5_to_filename.get(known_md5):
+                        counters['unchanged'] += 1
+                        unchanged_keys.add(key)
+                        continue
+                futures[executor.submit(process_single_file, fp, st, known_md5)] = fp
 
-            processed = 0
+            processed = counters['unchanged']
+            progress('scanning', processed, total_files)
             for future in as_completed(futures):
                 processed += 1
+                progress('scanning', processed, total_files)
                 file_path = futures[future]
 
                 try:
@@ -979,6 +2041,24 @@ class MemeService:
                 if processed % 100 == 0:
                     print(f"[Folder Scan] Progress: {processed}/{total_files} files processed...")
 
+        # 更新扫描清单：写入本次处理后仍存在的文件，删除已不存在的路径
+        try:
+            rows = []
+            for path, md5, st in manifest_updates:
+                try:
+                    rows.append(MemeService._manifest_row(path, md5, st))
+                except OSError:
+                    pass
+            keep = unchanged_keys | {row[0] for row in rows}
+            # 部分扫描时 manifest 只包含传入的路径，同样只清理这些路径
+            stale = [(key,) for key in manifest if key not in keep]
+            with MemeService.get_conn() as conn:
+                conn.executemany("INSERT OR REPLACE INTO scan_manifest (path, size, mtime_ns, inode, md5) VALUES (?, ?, ?, ?, ?)", rows)
+                conn.executemany("DELETE FROM scan_manifest WHERE path=?", stale)
+                conn.commit()
+        except Exception as e:
+            print(f"[Folder Scan] Manifest update error: {e}")
+
         # 第三阶段：批量插入数据库
         imported_count = 0
         if batch_insert_data:
@@ -987,11 +2067,12 @@ class MemeService:
             try:
                 with MemeService.get_conn() as conn:
                     conn.executemany(
-                        "INSERT INTO images (md5, filename, created_at, width, height, size) VALUES (?, ?, ?, ?, ?, ?)",
-                        [(item['md5'], item['filename'], item['mtime'], item['width'], item['height'], item['size'])
+                        "INSERT INTO images (md5, filename, created_at, width, height, size, sha1) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(item['md5'], item['filename'], item['mtime'], item['width'], item['height'], item['size'], item['sha1'])
                          for item in batch_insert_data]
                     )
                     conn.commit()
+                Md5Index.add_many(item['md5'] for item in batch_insert_data)
                 imported_count = len(batch_insert_data)
             except Exception as e:
                 print(f"[Folder Scan] Database insert error: {e}")
@@ -1002,12 +2083,14 @@ class MemeService:
         if batch_insert_data:
             print(f"[Folder Scan] Phase 3: Generating {len(batch_insert_data)} thumbnails in parallel...")
 
+            progress('thumbnails', 0, len(batch_insert_data))
             with ThreadPoolExecutor(max_workers=max_workers) as executor:
                 futures = [executor.submit(generate_thumbnail, item) for item in batch_insert_data]
 
                 completed = 0
                 for future in as_completed(futures):
                     completed += 1
+                    progress('thumbnails', completed, len(batch_insert_data))
                     try:
                         if not future.result():
                             thumbnail_errors += 1
@@ -1020,46 +2103,912 @@ class MemeService:
 
         print(f"\n[Folder Scan] Summary:")
         print(f"  - Imported: {imported_count}")
+        print(f"  - Unchanged (hash skipped via manifest): {counters['unchanged']}")
+        print(f"  - Hashed: {counters['hashed']}")
         print(f"  - Skipped (already in DB): {counters['skipped']}")
         print(f"  - Renamed: {counters['renamed']}")
         print(f"  - Errors: {counters['error']}")
         if thumbnail_errors > 0:
             print(f"  - Thumbnail errors: {thumbnail_errors}")
+        if full:
+            print(f"  - Integrity mismatches: {counters['mismatch']}")
         print(f"[Folder Scan] Automatic import completed.\n")
 
-# Initialize DB (轻量操作，可在模块级别执行)
-MemeService.init_db()
+# --- md5 成员索引 ---
+class Md5Index:
+    """
+    images 表中所有 md5 的内存索引，用于快速给出"不存在"的回答。
 
-# --- Routes ---
+    只保存 md5 前 64 位对应的整数（每项远小于完整的 hex 字符串），不在集合中说明一定不存在；
+    命中时仍需查库确认并取出文件名。首次使用时从数据库加载，之后在每次插入后增量更新。
+    """
+    _keys = set()
+    _loaded = False
+    _lock = threading.Lock()
+    _load_lock = threading.Lock()
+
+    @staticmethod
+    def _key(md5):
+        try:
+            return int(md5[:16], 16)
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def ensure_loaded():
+        if Md5Index._loaded:
+            return
+        with Md5Index._load_lock:
+            if Md5Index._loaded:
+                return
+            with MemeService.get_conn() as conn:
+                keys = {Md5Index._key(r[0]) for r in conn.execute("SELECT md5 FROM images")}
+            keys.discard(None)
+            with Md5Index._lock:
+                # 加载期间 add() 的 md5 已在 _keys 中，合并即可
+                Md5Index._keys |= keys
+                Md5Index._loaded = True
+            print(f"[Md5 Index] Loaded {len(keys)} md5 keys")
+
+    @staticmethod
+    def add_many(md5s):
+        """新记录提交后调用"""
+        with Md5Index._lock:
+            for md5 in md5s:
+                key = Md5Index._key(md5)
+                if key is not None:
+                    Md5Index._keys.add(key)
+
+    @staticmethod
+    def might_contain(md5):
+        """False 表示一定不存在，True 表示可能存在（需查库确认）"""
+        Md5Index.ensure_loaded()
+        key = Md5Index._key(md5)
+        return key is not None and key in Md5Index._keys
+
+
+# --- 标签补全索引 ---
+class TagIndex:
+    """
+    tags_dict 的内存索引，供标签补全（/api/meta/tags/suggest）和标签列表（/api/meta/tags）使用。
+
+    标签名经 NFKC 规范化并忽略大小写后（全角/半角字母数字等视为相同）建两类索引：
+    按规范化名排序的列表（二分查找前缀）和 单字/二元组 -> 标签 的倒排表（子串匹配）。
+    use_count 单独保存，update_index 提交后按增量更新，只有标签新增或消失时才改动索引结构。
+    首次使用时从数据库加载，tags_dict 一致性检查后重新加载。
+    """
+    _counts = {}  # 标签 -> use_count
+    _norm = {}  # 标签 -> 规范化名
+    _keys = []  # 有序的 (规范化名, 标签)
+    _grams = {}  # 单字 / 二元组 -> {标签}
+    _ranked = None  # (version, 按 use_count 排序的标签列表)
+    _version = 0
+    _epoch = uuid.uuid4().hex[:8]  # 进程重启后 ETag 不会与旧值相同
+    _loaded = False
+    _lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text):
+        return unicodedata.normalize('NFKC', text).casefold().strip()
+
+    @staticmethod
+    def _grams_of(key):
+        return set(key) | {key[i:i + 2] for i in range(len(key) - 1)}
+
+    @staticmethod
+    def _add(name):
+        """调用方持有 _lock"""
+        key = TagIndex._norm[name] = TagIndex.normalize(name)
+        bisect.insort(TagIndex._keys, (key, name))
+        for gram in TagIndex._grams_of(key):
+            TagIndex._grams.setdefault(gram, set()).add(name)
+
+    @staticmethod
+    def _remove(name):
+        """调用方持有 _lock"""
+        key = TagIndex._norm.pop(name)
+        i = bisect.bisect_left(TagIndex._keys, (key, name))
+        if i < len(TagIndex._keys) and TagIndex._keys[i] == (key, name):
+            del TagIndex._keys[i]
+        for gram in TagIndex._grams_of(key):
+            names = TagIndex._grams.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del TagIndex._grams[gram]
+
+    @staticmethod
+    def ensure_loaded():
+        if TagIndex._loaded:
+            return
+        with TagIndex._lock:
+            if TagIndex._loaded:
+                return
+            with MemeService.get_conn() as conn:
+                counts = {r['name']: r['use_count'] for r in conn.execute(
+                    "SELECT name, use_count FROM tags_dict WHERE use_count > 0")}
+            TagIndex._counts = counts
+            TagIndex._norm = {name: TagIndex.normalize(name) for name in counts}
+            TagIndex._keys = sorted((key, name) for name, key in TagIndex._norm.items())
+            grams = {}
+            for name, key in TagIndex._norm.items():
+                for gram in TagIndex._grams_of(key):
+                    grams.setdefault(gram, set()).add(name)
+            TagIndex._grams = grams
+            TagIndex._version += 1
+            TagIndex._loaded = True
+        print(f"[Tag Index] Loaded {len(counts)} tags, {len(grams)} grams")
+
+    @staticmethod
+    def invalidate():
+        """下次使用时从数据库重新加载"""
+        with TagIndex._lock:
+            TagIndex._loaded = False
+
+    @staticmethod
+    def apply(deltas):
+        """update_index 的增量提交后调用；尚未加载时忽略（加载时会读到最新数据）"""
+        if not deltas:
+            return
+        with TagIndex._lock:
+            if not TagIndex._loaded:
+                return
+            for name, n in deltas.items():
+                if not n:
+                    continue
+                before = TagIndex._counts.get(name, 0)
+                after = before + n
+                if after > 0:
+                    TagIndex._counts[name] = after
+                    if before <= 0:
+                        TagIndex._add(name)
+                elif before > 0:
+                    del TagIndex._counts[name]
+                    TagIndex._remove(name)
+            TagIndex._version += 1
+
+    @staticmethod
+    def etag():
+        TagIndex.ensure_loaded()
+        return f"{TagIndex._epoch}-{TagIndex._version}"
+
+    @staticmethod
+    def ranked():
+        """按 use_count 降序排列的全部标签（按版本缓存）"""
+        TagIndex.ensure_loaded()
+        with TagIndex._lock:
+            cached = TagIndex._ranked
+            if cached and cached[0] == TagIndex._version:
+                return cached[1]
+            counts = TagIndex._counts
+            names = sorted(counts, key=lambda name: (-counts[name], name))
+            TagIndex._ranked = (TagIndex._version, names)
+            return names
+
+    @staticmethod
+    def suggest(query, limit=TAG_SUGGEST_DEFAULT_LIMIT):
+        """
+        返回与 query 匹配的标签，排序：完全匹配 > 前缀匹配 > 子串匹配，同类按 use_count 降序。
+
+        Returns:
+            list: [{"name", "use_count", "match": "exact"/"prefix"/"substring"}]
+        """
+        key = TagIndex.normalize(query or "")
+        if not key:
+            return [{"name": name, "use_count": TagIndex._counts.get(name, 0), "match": "prefix"}
+                    for name in TagIndex.ranked()[:limit]]
+
+        TagIndex.ensure_loaded()
+        with TagIndex._lock:
+            counts, keys = TagIndex._counts, TagIndex._keys
+            matches = {}
+            # 1. 前缀：有序列表中以 key 开头的连续区间
+            i = bisect.bisect_left(keys, (key,))
+            while i < len(keys) and keys[i][0].startswith(key):
+                matches[keys[i][1]] = 0 if keys[i][0] == key else 1
+                i += 1
+
+            # 2. 子串：单字直接查倒排表，多字取各二元组的交集后再校验
+            if len(key) == 1:
+                candidates = TagIndex._grams.get(key, ())
+            else:
+                postings = [TagIndex._grams.get(key[j:j + 2]) for j in range(len(key) - 1)]
+                if all(postings):
+                    postings.sort(key=len)
+                    candidates = set(postings[0]).intersection(*postings[1:])
+                else:
+                    candidates = ()
+            for name in candidates:
+                if name not in matches and key in TagIndex._norm[name]:
+                    matches[name] = 2
+
+            best = heapq.nsmallest(limit, matches.items(), key=lambda m: (m[1], -counts[m[0]], m[0]))
+            kinds = ("exact", "prefix", "substring")
+            return [{"name": name, "use_count": counts[name], "match": kinds[kind]} for name, kind in best]
+
+
+# --- 后处理任务队列 ---
+class JobQueue:
+    """
+    基于 SQLite 的持久化任务队列，重启后未完成的任务会继续执行。
+
+    任务状态: pending -> running -> done / failed（失败次数未达上限时回到 pending）
+    """
+    _wakeup = threading.Event()
+    _workers = []
+    _workers_lock = threading.Lock()
+
+    @staticmethod
+    def enqueue(conn, kind, md5):
+        """在调用方的事务中登记任务，由调用方负责 commit"""
+        cur = conn.execute("INSERT INTO jobs (kind, md5, status, created_at) VALUES (?, ?, 'pending', ?)",
+                           (kind, md5, time.time()))
+        return cur.lastrowid
+
+    @staticmethod
+    def notify():
+        """唤醒空闲 worker（必要时先启动 worker）"""
+        JobQueue.start_workers()
+        JobQueue._wakeup.set()
+
+    @staticmethod
+    def claim():
+        """原子地领取一个待处理任务，没有任务时返回 None"""
+        with MemeService.get_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM jobs WHERE status='pending' ORDER BY job_id LIMIT 1").fetchone()
+            if not row:
+                conn.rollback()
+                return None
+            conn.execute("UPDATE jobs SET status='running', started_at=?, attempts=attempts+1 WHERE job_id=?",
+                         (time.time(), row['job_id']))
+            conn.commit()
+            return dict(row)
+
+    @staticmethod
+    def finish(job_id, error=None):
+        with MemeService.get_conn() as conn:
+            if error is None:
+                conn.execute("UPDATE jobs SET status='done', error=NULL, finished_at=? WHERE job_id=?",
+                             (time.time(), job_id))
+            else:
+                # 未达到最大尝试次数时重新排队
+                conn.execute("""UPDATE jobs SET error=?, finished_at=?,
+                                status=CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+                                WHERE job_id=?""",
+                             (str(error), time.time(), JOB_MAX_ATTEMPTS, job_id))
+            conn.commit()
+
+    @staticmethod
+    def recover():
+        """启动时将上次异常退出时处于 running 状态的任务放回队列"""
+        with MemeService.get_conn() as conn:
+            n = conn.execute("UPDATE jobs SET status='pending' WHERE status='running'").rowcount
+            conn.commit()
+        if n:
+            print(f"[Jobs] Re-queued {n} interrupted jobs.")
+
+    @staticmethod
+    def purge_finished(max_age=JOB_RETENTION_SECONDS):
+        with MemeService.get_conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE status='done' AND finished_at < ?", (time.time() - max_age,))
+            conn.commit()
+
+    @staticmethod
+    def run_job(job):
+        """执行单个任务"""
+        if job['kind'] == 'postprocess':
+            with MemeService.get_conn() as conn:
+                row = conn.execute("SELECT filename FROM images WHERE md5=?", (job['md5'],)).fetchone()
+            if not row:
+                raise ValueError("image record not found")
+            source_path = MemeService.resolve_path('img', row['filename'])
+            if not source_path:
+                raise FileNotFoundError(row['filename'])
+
+            thumb_path = MemeService.sharded_path('thumb', MemeService.thumb_name(job['md5']))
+            w, h, ok = MemeService._probe_and_thumbnail(source_path, thumb_path)
+            with MemeService.get_conn() as conn:
+                conn.execute("UPDATE images SET width=?, height=? WHERE md5=?", (w, h, job['md5']))
+                conn.commit()
+            if not ok:
+                raise RuntimeError("thumbnail generation failed")
+        else:
+            raise ValueError(f"unknown job kind: {job['kind']}")
+
+    @staticmethod
+    def finish_with_retry(job_id, error=None):
+        """finish 遇到数据库繁忙时退避重试直到成功，避免任务停留在 running 状态"""
+        delay = 0.1
+        while True:
+            try:
+                JobQueue.finish(job_id, error)
+                return
+            except sqlite3.OperationalError as e:
+                print(f"[Jobs] Finish job {job_id} failed: {e}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, JOB_POLL_INTERVAL)
+
+    @staticmethod
+    def work_once():
+        """领取并执行一个任务，返回是否领到了任务"""
+        try:
+            job = JobQueue.claim()
+        except sqlite3.OperationalError as e:
+            # 数据库繁忙，稍后重试
+            print(f"[Jobs] Claim failed: {e}")
+            return False
+        if job is None:
+            return False
+
+        error = None
+        try:
+            JobQueue.run_job(job)
+        except Exception as e:
+            print(f"[Jobs] Job {job['job_id']} ({job['kind']} {job['md5']}) failed: {e}")
+            error = e
+        JobQueue.finish_with_retry(job['job_id'], error)
+        return True
+
+    @staticmethod
+    def worker_loop():
+        last_purge = 0
+        while True:
+            try:
+                if JobQueue.work_once():
+                    continue
+                if time.time() - last_purge > 3600:
+                    last_purge = time.time()
+                    JobQueue.purge_finished()
+            except Exception as e:
+                # 异常不能让 worker 线程退出：start_workers 不会补启动，队列将不再消费
+                print(f"[Jobs] Worker error: {e!r}")
+            JobQueue._wakeup.wait(JOB_POLL_INTERVAL)
+            JobQueue._wakeup.clear()
+
+    @staticmethod
+    def start_workers(count=None):
+        """启动后台 worker（每个进程只启动一次）"""
+        with JobQueue._workers_lock:
+            if JobQueue._workers:
+                return
+            for i in range(count or JOB_WORKERS):
+                t = threading.Thread(target=JobQueue.worker_loop, daemon=True, name=f"JobWorker-{i}")
+                t.start()
+                JobQueue._workers.append(t)
+        print(f"[Jobs] Started {len(JobQueue._workers)} workers")
+
+    @staticmethod
+    def get_job(job_id):
+        with MemeService.get_conn() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def jobs_for_md5(md5):
+        with MemeService.get_conn() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE md5=? ORDER BY job_id", (md5,)).fetchall()
+        return [dict(r) for r in rows]
+
+    @staticmethod
+    def stats():
+        """队列深度和延迟（最早的待处理任务已等待的秒数）"""
+        now = time.time()
+        with MemeService.get_conn() as conn:
+            counts = {r['status']: r['n'] for r in
+                      conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")}
+            oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status='pending'").fetchone()[0]
+        return {
+            "pending": counts.get('pending', 0),
+            "running": counts.get('running', 0),
+            "done": counts.get('done', 0),
+            "failed": counts.get('failed', 0),
+            "lag_seconds": round(now - oldest, 3) if oldest else 0,
+            "workers": len(JobQueue._workers),
+        }
 
-@app.route('/')
-def idx(): return send_file('index.html')
+
+# --- 分块续传上传 ---
+class UploadConflict(Exception):
+    """分块上传会话已被另一个请求 finalize（路由返回 409）"""
+
+
+class ChunkedUploads:
+    """
+    分块续传协议: init -> PUT 分块（带 offset） -> finalize。
+    分块直接写入 CHUNKED_UPLOAD_DIR 下的 .part 文件，会话信息保存在 upload_sessions 表中，
+    服务重启后客户端可通过状态接口获取已接收字节数继续上传。
+    """
+
+    @staticmethod
+    def part_path(upload_id):
+        return os.path.join(CHUNKED_UPLOAD_DIR, f"{upload_id}.part")
+
+    @staticmethod
+    def get_session(upload_id):
+        with MemeService.get_conn() as conn:
+            row = conn.execute("SELECT * FROM upload_sessions WHERE upload_id=?", (upload_id,)).fetchone()
+        return dict(row) if row else None
+
+    @staticmethod
+    def init(filename, total_size, expected_md5=None):
+        """创建上传会话，返回会话信息"""
+        if total_size is None or total_size < 0 or total_size > MAX_UPLOAD_SIZE:
+            raise ValueError(f"size must be between 0 and {MAX_UPLOAD_SIZE}")
+
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+        expected_md5 = expected_md5.strip().lower() if expected_md5 else None
+        open(ChunkedUploads.part_path(upload_id), 'wb').close()
+        with MemeService.get_conn() as conn:
+            conn.execute("""INSERT INTO upload_sessions
+                            (upload_id, filename, total_size, expected_md5, received, created_at, updated_at)
+                            VALUES (?, ?, ?, ?, 0, ?, ?)""",
+                         (upload_id, filename, total_size, expected_md5, now, now))
+            conn.commit()
+        return {"upload_id": upload_id, "received": 0, "total_size": total_size,
+                "chunk_size": CHUNKED_UPLOAD_CHUNK_SIZE}
+
+    @staticmethod
+    def write_chunk(session, offset, stream, length=None):
+        """
+        将请求流写入 .part 文件的 offset 处（分块读取，不缓存整块数据）。
+        允许 offset 小于已接收字节数（客户端重传），但不能留下空洞。
+
+        Returns:
+            int: 写入后的已接收字节数
+        """
+        if offset < 0 or offset > session['received']:
+            raise ValueError("offset beyond received bytes")
+        if length is not None and offset + length > session['total_size']:
+            raise ValueError("chunk exceeds declared size")
+        if session.get('state', 'uploading') != 'uploading':
+            raise ValueError("upload is being finalized")
+
+        written = 0
+        with open(ChunkedUploads.part_path(session['upload_id']), 'r+b') as f:
+            f.seek(offset)
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if offset + written + len(chunk) > session['total_size']:
+                    raise ValueError("chunk exceeds declared size")
+                f.write(chunk)
+                written += len(chunk)
+
+        received = max(session['received'], offset + written)
+        with MemeService.get_conn() as conn:
+            conn.execute("UPDATE upload_sessions SET received=?, updated_at=? WHERE upload_id=? AND state='uploading'",
+                         (received, time.time(), session['upload_id']))
+            conn.commit()
+        return received
+
+    @staticmethod
+    def finalize(session):
+        """
+        校验完整性并交给与 handle_upload 相同的去重/入库逻辑。
+        先以 UPDATE ... WHERE state='uploading' 认领会话，并发的重复 finalize 只有一个能继续，
+        其余抛出 UploadConflict。
+
+        Returns:
+            tuple: (is_new, md5 或提示信息)
+        """
+        if session['received'] != session['total_size']:
+            raise ValueError(f"incomplete upload: {session['received']}/{session['total_size']} bytes")
+
+        upload_id = session['upload_id']
+        with MemeService.get_conn() as conn:
+            claimed = conn.execute("UPDATE upload_sessions SET state='finalizing', updated_at=? "
+                                   "WHERE upload_id=? AND state='uploading'",
+                                   (time.time(), upload_id)).rowcount
+            conn.commit()
+        if claimed != 1:
+            raise UploadConflict("upload is already being finalized")
+
+        part_path = ChunkedUploads.part_path(upload_id)
+        try:
+            md5, sha1, _ = MemeService._hash_file(part_path)
+        except OSError:
+            # 读取失败时释放认领，客户端可重试 finalize
+            with MemeService.get_conn() as conn:
+                conn.execute("UPDATE upload_sessions SET state='uploading' WHERE upload_id=?", (upload_id,))
+                conn.commit()
+            raise
+        METRIC_UPLOAD_SIZE.observe(session['total_size'])
+
+        expected = session.get('expected_md5')
+        if expected and expected.lower() != md5:
+            ChunkedUploads.discard(upload_id)
+            raise ValueError(f"md5 mismatch: expected {expected}, got {md5}")
+
+        ChunkedUploads._delete_session_row(upload_id)
+        ext = os.path.splitext(session['filename'] or '')[1].lower() or '.jpg'
+        return MemeService._ingest_spooled(part_path, md5, sha1, session['total_size'], ext)
+
+    @staticmethod
+    def _delete_session_row(upload_id):
+        with MemeService.get_conn() as conn:
+            conn.execute("DELETE FROM upload_sessions WHERE upload_id=?", (upload_id,))
+            conn.commit()
+
+    @staticmethod
+    def discard(upload_id):
+        ChunkedUploads._delete_session_row(upload_id)
+        MemeService._discard_temp(ChunkedUploads.part_path(upload_id))
+
+    @staticmethod
+    def gc(ttl=CHUNKED_SESSION_TTL):
+        """
+        回收超时未活动的会话及其 .part 文件，同时清理孤立的分块文件和残留的上传临时文件。
+
+        Returns:
+            int: 删除的文件数
+        """
+        cutoff = time.time() - ttl
+        with MemeService.get_conn() as conn:
+            expired = [r['upload_id'] for r in conn.execute(
+                "SELECT upload_id FROM upload_sessions WHERE updated_at < ?", (cutoff,))]
+            conn.execute("DELETE FROM upload_sessions WHERE updated_at < ?", (cutoff,))
+            conn.commit()
+            live = {r['upload_id'] for r in conn.execute("SELECT upload_id FROM upload_sessions")}
+
+        removed = 0
+        for upload_id in expired:
+            MemeService._discard_temp(ChunkedUploads.part_path(upload_id))
+            removed += 1
+
+        # 孤立的 .part 文件（会话已删除）以及进程崩溃残留的 .upload-*.part
+        candidates = [(CHUNKED_UPLOAD_DIR, lambda n: n.endswith('.part') and n[:-5] not in live),
+                      (FOLDERS['img'], lambda n: n.startswith('.upload-') and n.endswith('.part'))]
+        for folder, is_garbage in candidates:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file() and is_garbage(entry.name) and entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+
+# --- 目录监听（自动导入新放入的文件） ---
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # 可选依赖，未安装时退回到 stat 轮询
+    Observer = None
+    FileSystemEventHandler = object
+
+
+class FolderWatcher:
+    """
+    监听 meme_images 根目录（同步工具放入新文件的位置），将新文件送入与启动扫描相同的导入流程。
+
+    - 安装了 watchdog 时使用系统通知（Linux 上为 inotify），否则每 WATCH_POLL_INTERVAL 秒轮询一次
+    - 事件先进入待定列表去抖，文件大小和修改时间在 WATCH_SETTLE_SECONDS 内不再变化才视为写入完成
+    - 写入完成的文件按 WATCH_BATCH_SIZE 分批调用 scan_and_import_folder(paths=...)
+    """
+    _pending = {}  # path -> (size, mtime_ns, 最近一次变化的时间)
+    _lock = threading.Lock()
+    _started = False
+    mode = None
+
+    @staticmethod
+    def _is_candidate(path):
+        name = os.path.basename(path)
+        return (os.path.dirname(os.path.abspath(path)) == os.path.abspath(FOLDERS['img'])
+                and not name.startswith('.')
+                and os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS)
+
+    @staticmethod
+    def touch(path):
+        """记录一个可能有变化的文件（可在任意线程调用）"""
+        if FolderWatcher._is_candidate(path):
+            with FolderWatcher._lock:
+                FolderWatcher._pending[path] = (-1, -1, time.time())
+
+    @staticmethod
+    def take_settled(now=None):
+        """取出已经稳定（停止增长）的文件，仍在变化的文件继续等待"""
+        now = now or time.time()
+        settled = []
+        with FolderWatcher._lock:
+            for path, (size, mtime_ns, changed_at) in list(FolderWatcher._pending.items()):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # 文件已被删除或移走
+                    del FolderWatcher._pending[path]
+                    continue
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    FolderWatcher._pending[path] = (st.st_size, st.st_mtime_ns, now)
+                elif now - changed_at >= WATCH_SETTLE_SECONDS:
+                    del FolderWatcher._pending[path]
+                    settled.append(path)
+        return settled
+
+    @staticmethod
+    def _poll_once(snapshot):
+        """轮询模式：对比根目录快照，找出新增或变化的文件"""
+        current = {}
+        with os.scandir(FOLDERS['img']) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        st = entry.stat()
+                        current[entry.path] = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    continue
+        for path, sig in current.items():
+            if snapshot.get(path) != sig:
+                FolderWatcher.touch(path)
+        return current
+
+    @staticmethod
+    def import_settled(now=None):
+        """把已稳定的文件分批送入导入流程"""
+        settled = FolderWatcher.take_settled(now)
+        for i in range(0, len(settled), WATCH_BATCH_SIZE):
+            batch = settled[i:i + WATCH_BATCH_SIZE]
+            print(f"[Watcher] Importing {len(batch)} new files...")
+            try:
+                MemeService.scan_and_import_folder(paths=batch)
+            except Exception as e:
+                print(f"[Watcher] Import failed: {e}")
+        return settled
+
+    @staticmethod
+    def _import_loop():
+        snapshot = {}
+        while True:
+            if FolderWatcher.mode == 'poll':
+                try:
+                    snapshot = FolderWatcher._poll_once(snapshot)
+                except OSError as e:
+                    print(f"[Watcher] Poll failed: {e}")
+
+            FolderWatcher.import_settled()
+            time.sleep(WATCH_POLL_INTERVAL if FolderWatcher.mode == 'poll' else 1.0)
+
+    @staticmethod
+    def start():
+        """启动监听（每个进程只启动一次）"""
+        with FolderWatcher._lock:
+            if FolderWatcher._started:
+                return
+            FolderWatcher._started = True
+
+        if Observer is not None:
+            class Handler(FileSystemEventHandler):
+                def on_created(self, event):
+                    if not event.is_directory:
+                        FolderWatcher.touch(event.src_path)
+
+                def on_modified(self, event):
+                    if not event.is_directory:
+                        FolderWatcher.touch(event.src_path)
+
+                def on_moved(self, event):
+                    if not event.is_directory:
+                        FolderWatcher.touch(event.dest_path)
+
+            observer = Observer()
+            observer.schedule(Handler(), FOLDERS['img'], recursive=False)
+            observer.daemon = True
+            observer.start()
+            FolderWatcher.mode = 'events'
+            # 监听建立前放入的文件也需要处理一次
+            with os.scandir(FOLDERS['img']) as it:
+                for entry in it:
+                    FolderWatcher.touch(entry.path)
+        else:
+            FolderWatcher.mode = 'poll'
+
+        t = threading.Thread(target=FolderWatcher._import_loop, daemon=True, name="FolderWatcher")
+        t.start()
+        print(f"[Watcher] Watching {FOLDERS['img']} (mode: {FolderWatcher.mode})")
+
+
+# --- 启动任务（后台执行，服务立即可用） ---
+class StartupTask:
+    """
+    在后台线程中执行启动扫描和 tags_dict 重建，并记录阶段和进度供 /api/ready 查询。
+
+    未调用 start() 时（例如被其他 WSGI 服务器导入）视为已就绪。
+    """
+    _lock = threading.Lock()
+    _state = {"phase": "ready", "done": 0, "total": 0, "phase_started_at": None,
+              "started_at": None, "finished_at": None, "error": None}
+    PROCESS_STARTED_AT = time.time()
+
+    @staticmethod
+    def set_progress(phase, done=0, total=0):
+        with StartupTask._lock:
+            state = StartupTask._state
+            if state['phase'] != phase:
+                state['phase'] = phase
+                state['phase_started_at'] = time.time()
+            state['done'] = done
+            state['total'] = total
+
+    @staticmethod
+    def is_ready():
+        return StartupTask._state['phase'] in ('ready', 'failed')
+
+    @staticmethod
+    def snapshot():
+        """当前阶段、进度和预计剩余时间（按本阶段已用时间线性估算）"""
+        with StartupTask._lock:
+            state = dict(StartupTask._state)
+        now = time.time()
+        eta = None
+        if state['phase_started_at'] and state['total'] and 0 < state['done'] < state['total']:
+            elapsed = now - state['phase_started_at']
+            eta = round(elapsed / state['done'] * (state['total'] - state['done']), 1)
+        state['eta_seconds'] = eta
+        state['ready'] = state['phase'] in ('ready', 'failed')
+        return state
+
+    @staticmethod
+    def run(full=False):
+        try:
+            JobQueue.recover()
+            JobQueue.start_workers()
+            StartupTask.set_progress('scanning')
+            MemeService.scan_and_import_folder(full=full, progress=StartupTask.set_progress)
+            StartupTask.set_progress('backfilling_sha1')
+            MemeService.backfill_sha1(progress=StartupTask.set_progress)
+            StartupTask.set_progress('rebuilding_tags')
+            MemeService.rebuild_tags_dict()
+            MemeService.ensure_cooccurrence()
+            StartupTask.set_progress('ready')
+        except Exception as e:
+            print(f"[Startup] Background startup failed: {e}")
+            import traceback
+            traceback.print_exc()
+            with StartupTask._lock:
+                StartupTask._state['error'] = str(e)
+            StartupTask.set_progress('failed')
+        finally:
+            with StartupTask._lock:
+                StartupTask._state['finished_at'] = time.time()
+
+        start_tags_dict_updater(900)  # 每 15 分钟校验一次
+        start_upload_gc(3600)  # 每小时回收一次过期上传会话
+        if WATCH_FOLDER_ENABLED:
+            FolderWatcher.start()
+
+    @staticmethod
+    def start(full=False):
+        with StartupTask._lock:
+            StartupTask._state.update({"phase": "starting", "started_at": time.time(),
+                                       "phase_started_at": time.time(), "finished_at": None, "error": None})
+        t = threading.Thread(target=StartupTask.run, args=(full,), daemon=True, name="StartupTask")
+        t.start()
+
+
+def _startup_gauges():
+    state = StartupTask.snapshot()
+    return [({"phase": state['phase'], "kind": "done"}, state['done']),
+            ({"phase": state['phase'], "kind": "total"}, state['total'])]
+
+def _job_gauges():
+    stats = JobQueue.stats()
+    return [({"status": s}, stats[s]) for s in ('pending', 'running', 'done', 'failed')]
+
+Metrics.gauge("bqbq_uptime_seconds", "Seconds since the process started",
+              lambda: [({}, round(time.time() - StartupTask.PROCESS_STARTED_AT, 1))])
+Metrics.gauge("bqbq_startup_progress", "Startup scan progress (items done / total) for the current phase",
+              _startup_gauges)
+Metrics.gauge("bqbq_jobs", "Post-processing jobs by status", _job_gauges)
+Metrics.gauge("bqbq_jobs_lag_seconds", "Age of the oldest pending post-processing job",
+              lambda: [({}, JobQueue.stats()['lag_seconds'])])
+
+# Initialize DB (轻量操作，可在模块级别执行)
+MemeService.init_db()
+
+# --- Routes ---
+
+@app.route('/')
+def idx(): return send_file('index.html')
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
     return send_from_directory('.', filename)
 
 @app.route('/images/<path:f>')
-def serve_img(f): 
-    return send_from_directory(FOLDERS['img'], f)
+def serve_img(f):
+    # 同时兼容分片布局和平铺布局（resolve_path 已校验文件名，防止路径穿越）
+    p = MemeService.resolve_path('img', f)
+    if not p:
+        abort(404)
+    return send_file(p)
 
 # --- 修正后的缩略图读取接口 ---
 @app.route('/thumbnails/<path:f>')
 def serve_thumb(f):
     # 1. 获取不带后缀的文件名 (即 md5)
     base_name = os.path.splitext(f)[0]
-    
+
     # 2. 拼接出强制的 jpg 缩略图文件名 (修改为 _thumbnail.jpg)
-    thumb_name = f"{base_name}_thumbnail.jpg"
-    
-    # 3. 检查 jpg 缩略图是否存在
-    p = os.path.join(FOLDERS['thumb'], thumb_name)
-    if os.path.exists(p):
-        return send_from_directory(FOLDERS['thumb'], thumb_name)
+    thumb_name = MemeService.thumb_name(base_name)
+
+    # 3. 检查 jpg 缩略图是否存在（分片布局优先，兼容平铺布局）
+    p = MemeService.resolve_path('thumb', thumb_name)
+    if not p:
+        # 缩略图可能还在后处理队列中，先返回原图
+        p = MemeService.resolve_path('img', f)
+    if not p:
+        abort(404)
+    return send_file(p)
+
+@app.after_request
+def mark_partial_state(response):
+    """启动扫描未完成时，在 API 响应头中标注当前阶段，提示结果可能不完整"""
+    if not StartupTask.is_ready() and request.path.startswith('/api/'):
+        response.headers['X-Startup-Phase'] = StartupTask.snapshot()['phase']
+    return response
+
+@app.before_request
+def start_request_timer():
+    if METRICS_ENABLED:
+        g.request_started_at = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由模板（而不是实际路径）记录耗时，避免 md5 等路径参数导致标签数量膨胀"""
+    started = g.get('request_started_at')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        METRIC_HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method, response.status_code)
+    return response
+
+@app.route('/api/health', methods=['GET'])
+def api_health():
+    """存活检查：进程能响应请求即返回 200"""
+    state = StartupTask.snapshot()
+    return jsonify({"status": "ok", "uptime": round(time.time() - StartupTask.PROCESS_STARTED_AT, 1),
+                    "phase": state['phase']})
+
+@app.route('/api/ready', methods=['GET'])
+def api_ready():
+    """
+    就绪检查：启动扫描和标签重建完成前返回 503。
+    Response: {"ready": false, "phase": "scanning", "done": 1200, "total": 50000, "eta_seconds": 95.3, ...}
+    """
+    state = StartupTask.snapshot()
+    return jsonify(state), (200 if state['ready'] else 503)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 文本格式的运行指标"""
+    if not METRICS_ENABLED:
+        abort(404)
+    return Metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route('/api/admin/slow_queries', methods=['GET', 'DELETE'])
+def api_slow_queries():
+    """
+    慢查询日志。GET ?limit=50 返回最近的慢查询（含 EXPLAIN QUERY PLAN）和按 SQL 汇总的统计；DELETE 清空。
+    """
+    if request.method == 'DELETE':
+        SlowQueryLog.clear()
+        return jsonify({"success": True})
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        limit = 50
+    return jsonify({"enabled": SLOW_QUERY_LOG_ENABLED, **SlowQueryLog.snapshot(limit)})
 
 @app.route('/api/search', methods=['POST'])
 def api_search():
-    return jsonify(MemeService.search(request.json))
+    result = MemeService.search(request.json)
+    if not StartupTask.is_ready():
+        # 启动导入尚未完成，结果可能缺少新导入的图片
+        result['partial'] = True
+    return jsonify(result)
 
 @app.route('/api/upload', methods=['POST'])
 def api_upload():
@@ -1068,6 +3017,181 @@ def api_upload():
     ok, msg = MemeService.handle_upload(f)
     return jsonify({"success": ok, "msg": msg})
 
+@app.route('/api/upload/batch', methods=['POST'])
+def api_upload_batch():
+    """
+    批量上传图片，单次请求处理多个文件，新记录在同一个事务中写入。
+
+    Request（三选一）:
+        1. multipart/form-data，多个 files 字段
+        2. multipart/form-data，archive 字段为 zip/tar(.gz) 压缩包
+        3. 请求体直接为 zip/tar 流（Content-Type: application/zip 或 application/x-tar 等）
+    Response: {
+        "success": true,
+        "imported": 3, "duplicates": 1, "errors": 0,
+        "results": [{"name": "a.gif", "success": true, "msg": "<md5>"},
+                    {"name": "b.png", "success": false, "msg": "Duplicate image (timestamp refreshed)"}, ...]
+    }
+    """
+    files = request.files.getlist('files') + request.files.getlist('file')
+    archive = request.files.get('archive')
+    spooled_body = None
+
+    try:
+        if files:
+            if len(files) > BATCH_UPLOAD_MAX_FILES:
+                return jsonify({"success": False, "error": f"Too many files (max {BATCH_UPLOAD_MAX_FILES})"}), 400
+            sources = [(f.filename or 'upload.jpg', (lambda f=f: f.stream)) for f in files]
+            results = MemeService.handle_upload_batch(sources)
+        else:
+            if archive:
+                fileobj = archive.stream
+            elif request.mimetype in ('application/zip', 'application/x-zip-compressed'):
+                # zip 需要随机访问，先把请求体落盘
+                fileobj = spooled_body = tempfile.TemporaryFile()
+                while True:
+                    chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    fileobj.write(chunk)
+                fileobj.seek(0)
+            elif request.mimetype in ('application/x-tar', 'application/gzip', 'application/x-gzip'):
+                fileobj = request.stream
+            else:
+                return jsonify({"success": False, "error": "No files or archive provided"}), 400
+
+            if MemeService._is_zip(fileobj):
+                with zipfile.ZipFile(fileobj) as zf:
+                    sources = list(MemeService._iter_archive(zf))
+                    if len(sources) > BATCH_UPLOAD_MAX_FILES:
+                        return jsonify({"success": False, "error": f"Too many files (max {BATCH_UPLOAD_MAX_FILES})"}), 400
+                    results = MemeService.handle_upload_batch(sources)
+            else:
+                # tar 流只能顺序读取
+                results = MemeService.handle_upload_batch(MemeService._iter_archive(fileobj), parallel=False)
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        return jsonify({"success": False, "error": f"Invalid archive: {e}"}), 400
+    except ValueError as e:
+        # 压缩包超出条目数或解压大小限制
+        return jsonify({"success": False, "error": str(e)}), 400
+    except sqlite3.OperationalError as e:
+        # 数据库繁忙等，整批未入库，客户端可重试
+        return jsonify({"success": False, "error": f"Database error: {e}"}), 503
+    except (sqlite3.Error, OSError) as e:
+        return jsonify({"success": False, "error": f"Upload failed: {e}"}), 500
+    finally:
+        if spooled_body is not None:
+            spooled_body.close()
+
+    return jsonify({
+        "success": True,
+        "imported": sum(1 for r in results if r.get('success')),
+        "duplicates": sum(1 for r in results if r.get('success') is False and 'msg' in r),
+        "errors": sum(1 for r in results if 'error' in r),
+        "results": results
+    })
+
+@app.route('/api/upload/chunked/init', methods=['POST'])
+def api_chunked_init():
+    """
+    创建分块上传会话。
+    Request: {"filename": "a.gif", "size": 12345678, "md5": "abc123..." (optional)}
+    Response: {"upload_id": "...", "received": 0, "total_size": 12345678, "chunk_size": 4194304}
+              如果提供的 md5 已存在，直接按重复处理: {"success": false, "duplicate": true, "msg": "..."}
+    """
+    data = request.json or {}
+    filename = data.get('filename')
+    size = data.get('size')
+    md5 = data.get('md5')
+
+    if not filename or size is None:
+        return jsonify({"success": False, "error": "Missing parameters"}), 400
+    if md5 is not None and not isinstance(md5, str):
+        return jsonify({"success": False, "error": "md5 must be a string"}), 400
+    # images.md5 为小写十六进制，统一大小写后再查重/保存
+    md5 = md5.strip().lower() if md5 else None
+
+    if md5:
+        # 已存在的图片无需传输，语义与 handle_upload 的重复处理一致
+        with MemeService.get_conn() as conn:
+            if conn.execute("SELECT 1 FROM images WHERE md5=?", (md5,)).fetchone():
+                conn.execute("UPDATE images SET created_at=? WHERE md5=?", (time.time(), md5))
+                conn.commit()
+                return jsonify({"success": False, "duplicate": True, "msg": "Duplicate image (timestamp refreshed)"})
+
+    try:
+        session = ChunkedUploads.init(filename, int(size), md5)
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify(dict(session, success=True))
+
+@app.route('/api/upload/chunked/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+def api_chunked_session(upload_id):
+    """
+    GET: 查询已接收字节数（断线后据此续传）
+    PUT: 上传一个分块，?offset=N，请求体为原始字节
+    DELETE: 放弃上传
+    """
+    session = ChunkedUploads.get_session(upload_id)
+    if not session:
+        return jsonify({"success": False, "error": "Upload session not found"}), 404
+
+    if request.method == 'GET':
+        return jsonify({"upload_id": upload_id, "received": session['received'],
+                        "total_size": session['total_size']})
+
+    if request.method == 'DELETE':
+        if session.get('state') == 'finalizing':
+            return jsonify({"success": False, "error": "upload is being finalized"}), 409
+        ChunkedUploads.discard(upload_id)
+        return jsonify({"success": True})
+
+    try:
+        offset = int(request.args.get('offset', session['received']))
+        received = ChunkedUploads.write_chunk(session, offset, request.stream, request.content_length)
+    except ValueError as e:
+        # offset 不连续等情况返回 409，客户端应按 received 续传
+        return jsonify({"success": False, "error": str(e), "received": session['received']}), 409
+    return jsonify({"success": True, "received": received, "total_size": session['total_size']})
+
+@app.route('/api/upload/chunked/<upload_id>/finalize', methods=['POST'])
+def api_chunked_finalize(upload_id):
+    """
+    校验 md5 并入库，响应格式与 /api/upload 相同: {"success": true/false, "msg": md5 或提示}
+    会话已被另一个 finalize 请求认领时返回 409
+    """
+    session = ChunkedUploads.get_session(upload_id)
+    if not session:
+        return jsonify({"success": False, "error": "Upload session not found"}), 404
+
+    try:
+        ok, msg = ChunkedUploads.finalize(session)
+    except UploadConflict as e:
+        return jsonify({"success": False, "error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e), "received": session['received']}), 400
+    return jsonify({"success": ok, "msg": msg})
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """查询单个后处理任务状态"""
+    job = JobQueue.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    """
+    按 md5 查询后处理任务，不带 md5 时返回队列统计。
+    Request: /api/jobs?md5=abc123...
+    Response: {"md5": "...", "jobs": [...]} 或 {"pending": 0, "running": 0, ..., "lag_seconds": 0}
+    """
+    md5 = request.args.get('md5')
+    if md5:
+        return jsonify({"md5": md5, "jobs": JobQueue.jobs_for_md5(md5)})
+    return jsonify(JobQueue.stats())
+
 @app.route('/api/update_tags', methods=['POST'])
 def api_update_tags():
     data = request.json
@@ -1393,10 +3517,53 @@ def api_batch_move_hierarchy():
 
 @app.route('/api/meta/tags')
 def api_tags():
-    with MemeService.get_conn() as conn:
-        rows = conn.execute("SELECT name FROM tags_dict ORDER BY use_count DESC")
-        tags = [r[0] for r in rows]
-    return jsonify(tags)
+    """
+    全部标签名（按 use_count 降序），支持 ETag 缓存。
+    可选分页 ?offset=&limit=，总数见响应头 X-Total-Count。
+    """
+    etag = TagIndex.etag()
+    if request.headers.get('If-None-Match') == etag:
+        return '', 304
+
+    tags = TagIndex.ranked()
+    total = len(tags)
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+    if limit is not None:
+        tags = tags[offset:offset + max(0, limit)]
+    elif offset:
+        tags = tags[offset:]
+
+    response = jsonify(tags)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'  # 浏览器每次带 If-None-Match 重新验证
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+@app.route('/api/meta/tags/suggest')
+def api_tags_suggest():
+    """标签补全：?q=输入内容&limit=N，按完全/前缀/子串匹配和 use_count 排序"""
+    try:
+        limit = int(request.args.get('limit', TAG_SUGGEST_DEFAULT_LIMIT))
+    except ValueError:
+        limit = TAG_SUGGEST_DEFAULT_LIMIT
+    limit = max(1, min(limit, TAG_SUGGEST_MAX_LIMIT))
+    q = request.args.get('q', '')
+    return jsonify({"query": q, "tags": TagIndex.suggest(q, limit)})
+
+@app.route('/api/meta/tags/related')
+def api_tags_related():
+    """相关标签：?tags=猫,狗&limit=N（也可重复 tags 参数），返回经常与这些标签一起出现的标签"""
+    tags = [t for value in request.args.getlist('tags') for t in re.split(r'[,，\s]+', value) if t]
+    try:
+        limit = int(request.args.get('limit', TAG_RELATED_DEFAULT_LIMIT))
+    except ValueError:
+        limit = TAG_RELATED_DEFAULT_LIMIT
+    limit = max(1, min(limit, TAG_RELATED_MAX_LIMIT))
+    return jsonify({"tags": tags, "related": MemeService.related_tags(tags, limit)})
 
 @app.route('/api/check_md5', methods=['POST'])
 def api_check_md5():
@@ -1412,6 +3579,12 @@ def api_check_md5():
     if not md5:
         return jsonify({"error": "Missing md5 parameter"}), 400
 
+    if not Md5Index.might_contain(md5):
+        # 内存索引可以直接确认不存在，无需查库
+        if not StartupTask.is_ready():
+            return jsonify({"exists": False, "partial": True})
+        return jsonify({"exists": False})
+
     with MemeService.get_conn() as conn:
         row = conn.execute("SELECT filename FROM images WHERE md5=?", (md5,)).fetchone()
 
@@ -1422,9 +3595,150 @@ def api_check_md5():
                 conn.commit()
                 time_refreshed = True
             return jsonify({"exists": True, "filename": row['filename'], "time_refreshed": time_refreshed})
+        elif not StartupTask.is_ready():
+            # 文件可能已在 meme_images 中但尚未被启动扫描导入
+            return jsonify({"exists": False, "partial": True})
+        else:
+            return jsonify({"exists": False})
+
+@app.route('/api/check_md5/batch', methods=['POST'])
+def api_check_md5_batch():
+    """
+    批量检查 MD5 是否存在，供下载器一次性预检查多张图片。
+    Request: {"md5s": ["abc...", "def..."], "refresh_time": true/false (optional)}
+    Response: {
+        "results": [{"md5": "abc...", "exists": true, "filename": "abc....gif"}, {"md5": "def...", "exists": false}],
+        "time_refreshed": 1
+    }
+    """
+    data = request.json or {}
+    md5s = data.get('md5s')
+    refresh_time = data.get('refresh_time', False)
+
+    if not isinstance(md5s, list) or not md5s:
+        return jsonify({"error": "md5s must be a non-empty array"}), 400
+    if len(md5s) > CHECK_MD5_BATCH_MAX:
+        return jsonify({"error": f"Too many md5s (max {CHECK_MD5_BATCH_MAX})"}), 400
+    if not all(isinstance(m, str) for m in md5s):
+        return jsonify({"error": "md5s must contain only strings"}), 400
+
+    # 内存索引过滤掉一定不存在的 md5，只对可能存在的查库
+    candidates = list({m for m in md5s if Md5Index.might_contain(m)})
+    found = {}
+    if candidates:
+        with MemeService.get_conn() as conn:
+            for i in range(0, len(candidates), 500):
+                part = candidates[i:i + 500]
+                placeholders = ','.join(['?'] * len(part))
+                for row in conn.execute(f"SELECT md5, filename FROM images WHERE md5 IN ({placeholders})", part):
+                    found[row['md5']] = row['filename']
+
+            if refresh_time and found:
+                now = time.time()
+                found_md5s = list(found)
+                for i in range(0, len(found_md5s), 500):
+                    part = found_md5s[i:i + 500]
+                    placeholders = ','.join(['?'] * len(part))
+                    conn.execute(f"UPDATE images SET created_at=? WHERE md5 IN ({placeholders})", [now] + part)
+                conn.commit()
+
+    results = []
+    for m in md5s:
+        if m in found:
+            results.append({"md5": m, "exists": True, "filename": found[m]})
+        else:
+            results.append({"md5": m, "exists": False})
+
+    response = {"results": results, "time_refreshed": len(found) if refresh_time else 0}
+    if not StartupTask.is_ready():
+        response['partial'] = True
+    return jsonify(response)
+
+@app.route('/api/check_sha1', methods=['POST'])
+def api_check_sha1():
+    """
+    按 SHA1 检查图片是否已存在。QQ 图片链接的 fileid 中带有文件 sha1，下载器解析链接后即可预检查，
+    已有的图片无需下载。
+    Request: {"sha1": "da39a3ee...", "refresh_time": true/false (optional)}
+    Response: {"exists": true/false, "md5": "...", "filename": "..." (if exists), "time_refreshed": true/false}
+    """
+    data = request.json or {}
+    sha1 = data.get('sha1')
+    refresh_time = data.get('refresh_time', False)
+
+    if not sha1 or not isinstance(sha1, str):
+        return jsonify({"error": "Missing sha1 parameter"}), 400
+    sha1 = sha1.lower()
+
+    with MemeService.get_conn() as conn:
+        row = conn.execute("SELECT md5, filename FROM images WHERE sha1=?", (sha1,)).fetchone()
+
+        if row:
+            time_refreshed = False
+            if refresh_time:
+                conn.execute("UPDATE images SET created_at=? WHERE md5=?", (time.time(), row['md5']))
+                conn.commit()
+                time_refreshed = True
+            return jsonify({"exists": True, "md5": row['md5'], "filename": row['filename'],
+                            "time_refreshed": time_refreshed})
+        elif not StartupTask.is_ready():
+            # 启动扫描或 sha1 补算尚未完成
+            return jsonify({"exists": False, "partial": True})
         else:
             return jsonify({"exists": False})
 
+@app.route('/api/check_sha1/batch', methods=['POST'])
+def api_check_sha1_batch():
+    """
+    批量按 SHA1 检查图片是否存在。
+    Request: {"sha1s": ["da39...", ...], "refresh_time": true/false (optional)}
+    Response: {
+        "results": [{"sha1": "da39...", "exists": true, "md5": "...", "filename": "..."}, {"sha1": "...", "exists": false}],
+        "time_refreshed": 1
+    }
+    """
+    data = request.json or {}
+    sha1s = data.get('sha1s')
+    refresh_time = data.get('refresh_time', False)
+
+    if not isinstance(sha1s, list) or not sha1s:
+        return jsonify({"error": "sha1s must be a non-empty array"}), 400
+    if len(sha1s) > CHECK_MD5_BATCH_MAX:
+        return jsonify({"error": f"Too many sha1s (max {CHECK_MD5_BATCH_MAX})"}), 400
+    if not all(isinstance(s, str) for s in sha1s):
+        return jsonify({"error": "sha1s must contain only strings"}), 400
+
+    lookup = list({s.lower() for s in sha1s})
+    found = {}
+    with MemeService.get_conn() as conn:
+        for i in range(0, len(lookup), 500):
+            part = lookup[i:i + 500]
+            placeholders = ','.join(['?'] * len(part))
+            for row in conn.execute(f"SELECT sha1, md5, filename FROM images WHERE sha1 IN ({placeholders})", part):
+                found[row['sha1']] = (row['md5'], row['filename'])
+
+        if refresh_time and found:
+            now = time.time()
+            found_md5s = list({md5 for md5, _ in found.values()})
+            for i in range(0, len(found_md5s), 500):
+                part = found_md5s[i:i + 500]
+                placeholders = ','.join(['?'] * len(part))
+                conn.execute(f"UPDATE images SET created_at=? WHERE md5 IN ({placeholders})", [now] + part)
+            conn.commit()
+
+    results = []
+    for s in sha1s:
+        hit = found.get(s.lower())
+        if hit:
+            results.append({"sha1": s, "exists": True, "md5": hit[0], "filename": hit[1]})
+        else:
+            results.append({"sha1": s, "exists": False})
+
+    response = {"results": results, "time_refreshed": len(found) if refresh_time else 0}
+    if not StartupTask.is_ready():
+        response['partial'] = True
+    return jsonify(response)
+
 @app.route('/api/export/all', methods=['GET'])
 def api_export_all():
     """
@@ -1485,6 +3799,8 @@ def api_import_all():
         with MemeService.get_conn() as conn:
             imported_images = 0
             skipped_images = 0
+            new_md5s = []
+            tag_deltas = Counter()
 
             # 1. 导入图片标签数据
             for img in data.get('images', []):
@@ -1498,7 +3814,7 @@ def api_import_all():
                 if existing:
                     # 更新标签
                     tags = img.get('tags', [])
-                    MemeService.update_index(md5, tags)
+                    tag_deltas.update(MemeService.update_index(md5, tags, conn))
                     skipped_images += 1
                 else:
                     # 新图片（但文件可能不存在，仅导入元数据）
@@ -1508,7 +3824,8 @@ def api_import_all():
                          img.get('width', 0), img.get('height', 0), img.get('size', 0))
                     )
                     tags = img.get('tags', [])
-                    MemeService.update_index(md5, tags)
+                    tag_deltas.update(MemeService.update_index(md5, tags, conn))
+                    new_md5s.append(md5)
                     imported_images += 1
 
             # 2. 清空并重建规则树（覆盖模式）
@@ -1543,9 +3860,11 @@ def api_import_all():
             conn.execute("UPDATE system_meta SET version_id=?, last_updated_at=? WHERE key='rules_state'",
                         (rules.get('version_id', 0), time.time()))
 
-            # tags_dict 不再通过导入恢复，由启动时自动重建
+            # tags_dict 不从导出数据恢复，已由 update_index 随标签一起增量更新
 
             conn.commit()
+            Md5Index.add_many(new_md5s)
+            TagIndex.apply(tag_deltas)
 
         return jsonify({
             "success": True,
@@ -1564,10 +3883,10 @@ def api_import_all():
 # --- 定时任务 ---
 def start_tags_dict_updater(interval_seconds=900):
     """
-    启动后台线程，定时更新 tags_dict。
+    启动后台线程，定时校验 tags_dict（use_count 由 update_index 实时维护，这里只检查并修正偏差）。
 
     Args:
-        interval_seconds: 更新间隔，默认 900 秒（15 分钟）
+        interval_seconds: 校验间隔，默认 900 秒（15 分钟）
     """
     def loop():
         while True:
@@ -1575,23 +3894,49 @@ def start_tags_dict_updater(interval_seconds=900):
             try:
                 MemeService.rebuild_tags_dict()
             except Exception as e:
-                print(f"[Tags Dict] Scheduled update failed: {e}")
+                print(f"[Tags Dict] Scheduled check failed: {e}")
 
     t = threading.Thread(target=loop, daemon=True, name="TagsDictUpdater")
     t.start()
-    print(f"[Tags Dict] Scheduled updater started (interval: {interval_seconds}s)")
+    print(f"[Tags Dict] Scheduled consistency check started (interval: {interval_seconds}s)")
+
+
+def start_upload_gc(interval_seconds=3600):
+    """
+    启动后台线程，定时回收过期的分块上传会话和残留临时文件。
+
+    Args:
+        interval_seconds: 回收间隔，默认 3600 秒（1 小时）
+    """
+    def loop():
+        while True:
+            try:
+                removed = ChunkedUploads.gc()
+                if removed:
+                    print(f"[Upload GC] Removed {removed} abandoned upload files")
+            except Exception as e:
+                print(f"[Upload GC] Scheduled cleanup failed: {e}")
+            time.sleep(interval_seconds)
+
+    t = threading.Thread(target=loop, daemon=True, name="UploadGC")
+    t.start()
+    print(f"[Upload GC] Scheduled cleanup started (interval: {interval_seconds}s)")
 
 
 if __name__ == '__main__':
-    # 检查是否是 werkzeug reloader 的子进程
-    # debug 模式下，werkzeug 会启动两个进程，只有 WERKZEUG_RUN_MAIN='true' 的才是实际运行的子进程
-    is_reloader_process = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
-    is_first_run = not is_reloader_process  # 如果不是 reloader 子进程，说明是首次启动
-
-    # 只在首次启动时执行初始化任务（避免 debug 模式下执行两次）
-    if is_first_run:
-        MemeService.scan_and_import_folder()
-        MemeService.rebuild_tags_dict()
-        start_tags_dict_updater(900)  # 每 15 分钟更新一次
-
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="bqbq meme backend")
+    parser.add_argument('--full', action='store_true',
+                        help="启动扫描时忽略清单，重新计算所有文件的 md5 并报告不一致的文件")
+    args = parser.parse_args()
+
+    # debug 模式下 werkzeug 会启动两个进程，只有 WERKZEUG_RUN_MAIN='true' 的子进程实际处理请求。
+    # 启动任务必须在处理请求的进程中执行，/api/ready 才能反映真实进度；
+    # 代码变更触发重载时会重新扫描，但有扫描清单加速，代价很小。
+    is_serving_process = os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not DEBUG
+
+    if is_serving_process:
+        # 扫描和标签重建在后台执行，服务立即开始接受请求
+        StartupTask.start(full=args.full)
+
+    app.run(host='0.0.0.0', port=5000, debug=DEBUG)
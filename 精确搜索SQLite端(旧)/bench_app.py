@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+"""
+后端基准测试 - 在合成图库上测量搜索、规则树和导入性能
+
+生成一个可复现（固定随机种子）的临时图库：
+1. N 张图片的元数据，标签按 Zipf 分布抽取（少数热门标签、大量长尾标签），以中文标签为主
+2. 多层的规则树（分组 + 同义词 + 层级关系）
+3. 若干张真实小图片，用于测量目录扫描导入
+
+然后分别通过 MemeService 直接调用和 Flask test client 跑各场景，结果写入 JSON，
+可用 --compare 与之前的结果对比（例如不同提交之间）。
+
+数据写在临时目录（通过 BQBQ_DATA_DIR），不会影响正式的 meme.db 和图片目录。
+
+使用方式：
+    python bench_app.py [--images 1000] [--seed 42] [--out bench.json] [--compare old.json]
+                        [--scenarios search,rules,try_write,scan,export_import] [--keep]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+ALL_SCENARIOS = ("search", "rules", "try_write", "scan", "export_import")
+
+# 常用汉字区间，组合成 2~4 字的标签
+_CJK_START, _CJK_END = 0x4E00, 0x4E00 + 2500
+_ASCII_TAGS = ["gif", "meme", "cat", "doge", "ok", "233", "qwq", "awsl", "yyds", "xswl"]
+
+
+# ==========================
+#   合成数据
+# ==========================
+def make_vocabulary(rnd, size):
+    """生成不重复的标签词表（约 5% 为英文/数字标签）"""
+    vocab = []
+    seen = set()
+    while len(vocab) < size:
+        if rnd.random() < 0.05:
+            tag = rnd.choice(_ASCII_TAGS) + str(rnd.randint(0, 999))
+        else:
+            tag = "".join(chr(rnd.randint(_CJK_START, _CJK_END)) for _ in range(rnd.randint(2, 4)))
+        if tag not in seen:
+            seen.add(tag)
+            vocab.append(tag)
+    return vocab
+
+
+def zipf_cum_weights(size, s=1.1):
+    total = 0.0
+    cum = []
+    for rank in range(1, size + 1):
+        total += 1.0 / rank ** s
+        cum.append(total)
+    return cum
+
+
+def generate_library(app, rnd, n_images, vocab, cum_weights):
+    """直接写库：images + images_fts（与上传/导入写入的结构一致）"""
+    now = time.time()
+    exts = ['gif'] * 5 + ['jpg'] * 3 + ['png'] * 2 + ['webp']
+    image_rows = []
+    fts_rows = []
+    for i in range(n_images):
+        md5 = hashlib.md5(f"bench-{i}-{rnd.random()}".encode()).hexdigest()
+        n_tags = min(rnd.choices(range(9), weights=[8, 14, 18, 18, 14, 10, 8, 6, 4])[0], len(vocab))
+        tags = list(dict.fromkeys(rnd.choices(vocab, cum_weights=cum_weights, k=n_tags)))
+        image_rows.append((md5, f"{md5}.{rnd.choice(exts)}", now - rnd.random() * 3 * 365 * 86400,
+                           rnd.randint(64, 1200), rnd.randint(64, 1200), rnd.randint(2 * 1024, 4 * 1024 ** 2)))
+        if tags:
+            fts_rows.append((md5, " ".join(tags)))
+
+    with app.MemeService.get_conn() as conn:
+        conn.executemany("INSERT INTO images (md5, filename, created_at, width, height, size) VALUES (?, ?, ?, ?, ?, ?)",
+                         image_rows)
+        conn.executemany("INSERT INTO images_fts (md5, tags_text) VALUES (?, ?)", fts_rows)
+        conn.commit()
+    app.MemeService.rebuild_tags_dict()
+
+
+def generate_rules_tree(app, rnd, vocab, n_groups, depth, synonyms):
+    """
+    生成规则树：n_groups 个分组，每组 synonyms 个同义词（取自词表头部，保证能搜到结果），
+    分组按层级挂成最深 depth 层的树。
+
+    Returns:
+        list: 每个分组的同义词列表（用于构造搜索条件）
+    """
+    groups = []
+    keywords = []
+    hierarchy = []
+    synonym_sets = []
+    levels = [[] for _ in range(depth)]
+    pool = vocab[:max(n_groups * 2, 50)]
+    for gid in range(1, n_groups + 1):
+        groups.append((gid, f"分组{gid}", 1))
+        words = list(dict.fromkeys(rnd.sample(pool, min(synonyms, len(pool)))))
+        synonym_sets.append(words)
+        keywords.extend((w, gid, 1) for w in words)
+        level = min(depth - 1, int(rnd.random() ** 0.7 * depth)) if gid > depth else gid - 1
+        if level > 0:
+            hierarchy.append((rnd.choice(levels[level - 1]), gid))
+        levels[level].append(gid)
+
+    with app.MemeService.get_conn() as conn:
+        conn.executemany("INSERT INTO search_groups (group_id, group_name, is_enabled) VALUES (?, ?, ?)", groups)
+        conn.executemany("INSERT OR IGNORE INTO search_keywords (keyword, group_id, is_enabled) VALUES (?, ?, ?)",
+                         keywords)
+        conn.executemany("INSERT OR IGNORE INTO search_hierarchy (parent_id, child_id) VALUES (?, ?)", hierarchy)
+        conn.commit()
+    return synonym_sets
+
+
+def generate_image_files(folder, rnd, count):
+    """在图片目录根下生成真实的小图片（PNG / JPEG / 两帧 GIF），供扫描导入"""
+    from PIL import Image
+    os.makedirs(folder, exist_ok=True)
+    for i in range(count):
+        size = (rnd.randint(48, 256), rnd.randint(48, 256))
+        img = Image.new("RGB", size, tuple(rnd.randint(0, 255) for _ in range(3)))
+        # 随机像素保证每张图 md5 不同
+        for _ in range(16):
+            img.putpixel((rnd.randrange(size[0]), rnd.randrange(size[1])),
+                         tuple(rnd.randint(0, 255) for _ in range(3)))
+        kind = i % 3
+        if kind == 0:
+            img.save(os.path.join(folder, f"bench_{i}.png"), "PNG")
+        elif kind == 1:
+            img.save(os.path.join(folder, f"bench_{i}.jpg"), "JPEG", quality=90)
+        else:
+            frame2 = img.transpose(Image.FLIP_LEFT_RIGHT)
+            img.save(os.path.join(folder, f"bench_{i}.gif"), "GIF", save_all=True, append_images=[frame2],
+                     duration=100, loop=0)
+
+
+# ==========================
+#   计时
+# ==========================
+def summarize(samples):
+    """毫秒统计"""
+    ms = sorted(s * 1000 for s in samples)
+    if not ms:
+        return {"n": 0}
+
+    def pct(p):
+        return round(ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))], 3)
+
+    return {"n": len(ms), "mean_ms": round(statistics.fmean(ms), 3), "p50_ms": pct(50), "p95_ms": pct(95),
+            "p99_ms": pct(99), "min_ms": round(ms[0], 3), "max_ms": round(ms[-1], 3)}
+
+
+def timed(func, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return samples, result
+
+
+# ==========================
+#   场景
+# ==========================
+def search_shapes(rnd, vocab, synonym_sets, n_images):
+    """各种搜索参数组合：单标签（热门/长尾）、同义词组、多组 AND、排除、交集排除、扩展名、标签数、深翻页"""
+    hot, mid, rare = vocab[0], vocab[min(50, len(vocab) - 1)], vocab[-1]
+    syn = synonym_sets[0] if synonym_sets else [hot]
+    syn2 = synonym_sets[1] if len(synonym_sets) > 1 else [mid]
+    deep = max(0, min(10000, n_images - 50))
+    return {
+        "all_date_desc": {},
+        "hot_tag": {"keywords": [[hot]]},
+        "rare_tag": {"keywords": [[rare]]},
+        "synonym_group": {"keywords": [syn]},
+        "and_3_groups": {"keywords": [[hot], syn, [mid]]},
+        "exclude": {"keywords": [[hot]], "excludes": [[mid], syn2]},
+        "excludes_and": {"keywords": [syn], "excludes_and": [[[hot], [mid]], [syn2, [rare]]]},
+        "extensions": {"keywords": [[hot]], "extensions": ["gif", "webp"], "exclude_extensions": ["png"]},
+        "tag_count_range": {"min_tags": 2, "max_tags": 4},
+        "untagged": {"max_tags": 0},
+        "size_desc": {"keywords": [[mid]], "sort_by": "size_desc"},
+        "deep_offset": {"offset": deep, "limit": 50},
+        "deep_offset_hot": {"keywords": [[hot]], "offset": deep // 4, "limit": 50},
+    }
+
+
+def bench_search(app, client, ctx, repeat):
+    results = {}
+    for name, params in search_shapes(ctx['rnd'], ctx['vocab'], ctx['synonym_sets'], ctx['n_images']).items():
+        samples, result = timed(lambda: app.MemeService.search(dict(params)), repeat)
+        http_samples, _ = timed(lambda: client.post('/api/search', json=params), repeat)
+        results[name] = {"direct": summarize(samples), "http": summarize(http_samples),
+                         "total": result.get('total') if isinstance(result, dict) else None}
+    return results
+
+
+def bench_rules(app, client, ctx, repeat):
+    def direct():
+        with app.MemeService.get_conn() as conn:
+            return app.MemeService.get_rules_data(conn)
+
+    samples, data = timed(direct, repeat)
+    http_samples, _ = timed(lambda: client.get('/api/rules'), repeat)
+    return {"get_rules_data": summarize(samples), "http_get_rules": summarize(http_samples),
+            "groups": len(data['groups']), "keywords": len(data['keywords']), "hierarchy": len(data['hierarchy'])}
+
+
+def bench_try_write(app, client, ctx, threads=8, writes_per_thread=25):
+    """
+    多线程并发写规则，模拟前端的乐观锁用法：每个客户端使用自己上次见到的版本号写入，
+    409 时用响应中的最新版本重试。记录每次 try_write 的耗时和冲突次数。
+    """
+    latencies = []
+    counters = {"ok": 0, "conflict": 0, "error": 0}
+    lock = threading.Lock()
+    group_ids = list(range(1, len(ctx['synonym_sets']) + 1)) or [1]
+
+    def current_version():
+        with app.MemeService.get_conn() as conn:
+            row = conn.execute("SELECT version_id FROM system_meta WHERE key='rules_state'").fetchone()
+            return row['version_id'] if row else 0
+
+    def worker(tid):
+        rnd = random.Random(tid)
+        version = current_version()
+        for i in range(writes_per_thread):
+            while True:
+                start = time.perf_counter()
+                result = app.MemeService.try_write(
+                    version, f"bench-{tid}",
+                    app.MemeService.add_keyword_to_group(rnd.choice(group_ids), f"压测{tid}_{i}"))
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if result['status'] == 409:
+                        counters['conflict'] += 1
+                    elif result['success']:
+                        counters['ok'] += 1
+                    else:
+                        counters['error'] += 1
+                if result['status'] == 409:
+                    version = result['latest_data']['version_id']
+                    continue
+                version = result.get('version_id', version)
+                break
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - start
+    return {"threads": threads, "writes": threads * writes_per_thread, **counters,
+            "writes_per_sec": round(counters['ok'] / wall, 1), "latency": summarize(latencies)}
+
+
+def bench_scan(app, client, ctx, n_files):
+    generate_image_files(app.FOLDERS['img'], ctx['rnd'], n_files)
+    start = time.perf_counter()
+    app.MemeService.scan_and_import_folder()
+    first = time.perf_counter() - start
+    # 第二次扫描：文件都已导入，清单命中
+    start = time.perf_counter()
+    app.MemeService.scan_and_import_folder()
+    rescan = time.perf_counter() - start
+    return {"files": n_files, "first_scan_s": round(first, 3), "files_per_sec": round(n_files / first, 1),
+            "rescan_s": round(rescan, 3)}
+
+
+def bench_export_import(app, client, ctx, fresh_sample=200):
+    result = {}
+    start = time.perf_counter()
+    resp = client.get('/api/export/all')
+    result['export_s'] = round(time.perf_counter() - start, 3)
+    payload = resp.get_data()
+    result['export_bytes'] = len(payload)
+    data = json.loads(payload)
+
+    # 合并导入到当前库（所有图片都已存在，只更新标签 + 覆盖规则树）
+    start = time.perf_counter()
+    resp = client.post('/api/import/all', json=data)
+    result['import_merge_s'] = round(time.perf_counter() - start, 3)
+    result['import_merge_status'] = resp.status_code
+
+    # 导入到空库（只取一部分图片，测新增路径）
+    sample = dict(data, images=data['images'][:fresh_sample])
+    with app.MemeService.get_conn() as conn:
+        conn.execute("DELETE FROM images")
+        conn.execute("DELETE FROM images_fts")
+        conn.commit()
+    start = time.perf_counter()
+    resp = client.post('/api/import/all', json=sample)
+    result['import_fresh_s'] = round(time.perf_counter() - start, 3)
+    result['import_fresh_images'] = len(sample['images'])
+    result['import_fresh_status'] = resp.status_code
+    return result
+
+
+# ==========================
+#   结果
+# ==========================
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(old, new):
+    """打印耗时类指标（*_ms / *_s）的变化"""
+    old_flat = _flatten("", old.get("scenarios", {}), {})
+    new_flat = _flatten("", new.get("scenarios", {}), {})
+    print(f"\n对比 {old.get('meta', {}).get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'指标':<56} {'旧':>10} {'新':>10} {'变化':>8}")
+    for key, value in new_flat.items():
+        if not key.endswith(("_ms", "_s")) or key not in old_flat:
+            continue
+        before = old_flat[key]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "-"
+        print(f"{key:<56} {before:>10} {value:>10} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic-library benchmark for the meme backend")
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--vocab', type=int, default=5000, help="标签词表大小")
+    parser.add_argument('--groups', type=int, default=300, help="规则树分组数")
+    parser.add_argument('--depth', type=int, default=8, help="规则树最大深度")
+    parser.add_argument('--scan-files', type=int, default=300, help="扫描场景生成的真实图片数")
+    parser.add_argument('--repeat', type=int, default=5, help="每个读场景的重复次数")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scenarios', default=",".join(ALL_SCENARIOS))
+    parser.add_argument('--out', default=None, help="结果 JSON 路径（默认 bench-<commit>-<时间>.json）")
+    parser.add_argument('--compare', default=None, help="与之前的结果 JSON 对比")
+    parser.add_argument('--keep', action='store_true', help="保留临时图库")
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(ALL_SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    data_dir = tempfile.mkdtemp(prefix="bqbq-bench-")
+    os.environ['BQBQ_DATA_DIR'] = data_dir
+    # 必须在设置 BQBQ_DATA_DIR 之后导入；关闭慢查询日志避免干扰计时
+    import app
+    app.SLOW_QUERY_LOG_ENABLED = False
+    client = app.app.test_client()
+
+    rnd = random.Random(args.seed)
+    try:
+        t0 = time.perf_counter()
+        vocab = make_vocabulary(rnd, args.vocab)
+        generate_library(app, rnd, args.images, vocab, zipf_cum_weights(len(vocab)))
+        synonym_sets = generate_rules_tree(app, rnd, vocab, args.groups, args.depth, synonyms=4)
+        print(f"[Bench] 合成图库: {args.images} 张图片, {len(vocab)} 个标签, {args.groups} 个分组 "
+              f"({time.perf_counter() - t0:.1f}s) -> {data_dir}")
+
+        ctx = {"rnd": rnd, "vocab": vocab, "synonym_sets": synonym_sets, "n_images": args.images}
+        runners = {
+            "search": lambda: bench_search(app, client, ctx, args.repeat),
+            "rules": lambda: bench_rules(app, client, ctx, args.repeat),
+            "try_write": lambda: bench_try_write(app, client, ctx),
+            "scan": lambda: bench_scan(app, client, ctx, args.scan_files),
+            # 导入会清空部分数据，放在最后
+            "export_import": lambda: bench_export_import(app, client, ctx),
+        }
+        results = {}
+        for name in ALL_SCENARIOS:
+            if name not in scenarios:
+                continue
+            start = time.perf_counter()
+            results[name] = runners[name]()
+            print(f"[Bench] {name}: {time.perf_counter() - start:.1f}s")
+
+        commit = git_commit()
+        output = {
+            "meta": {
+                "commit": commit,
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "platform": platform.platform(),
+                "images": args.images, "vocab": args.vocab, "groups": args.groups, "depth": args.depth,
+                "repeat": args.repeat, "seed": args.seed,
+            },
+            "scenarios": results,
+        }
+        out_path = args.out or f"bench-{commit or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        with open(out_path, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"[Bench] 结果已写入 {out_path}")
+
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                compare(json.load(f), output)
+    finally:
+        if args.keep:
+            print(f"[Bench] 保留临时图库: {data_dir}")
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+图片处理流水线基准测试 - 缩略图生成、尺寸探测、md5 计算
+
+不同格式的处理成本差异很大，本脚本用固定随机种子生成一组各格式的语料（离线、只用 CPU）：
+    jpeg        静态 JPEG 大图
+    png_alpha   带透明通道的 PNG
+    gif_long    长动图 GIF（多帧）
+    webp_anim   动态 WebP
+
+对每种格式分别测量：
+    thumbnail   MemeService._create_thumbnail_file
+    probe       Image.open 读取尺寸
+    md5         MemeService._hash_file（md5 + sha1 流式计算）
+输出每种格式的 p50 / p99 延迟、吞吐量和峰值 RSS（每种格式在独立子进程中运行，峰值互不影响），
+并与仓库中的基准结果 bench_images_baseline.json 对比。
+
+使用方式：
+    python bench_images.py                      # 运行并与基准对比
+    python bench_images.py --check              # 有指标比基准慢超过 --tolerance 时返回非 0
+    python bench_images.py --update-baseline    # 用本次结果覆盖基准
+    python bench_images.py --formats jpeg,gif_long --repeat 5 --out result.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_images_baseline.json")
+DEFAULT_TOLERANCE = 0.25  # 比基准慢 25% 以上视为回退
+MIN_DELTA_MS = 2.0  # 绝对差值小于此值时不算回退（亚毫秒级指标的 p99 抖动很大）
+
+# 每种格式的语料：(文件数, 生成参数)
+CORPUS = {
+    "jpeg": {"files": 6, "size": (2400, 1800)},
+    "png_alpha": {"files": 6, "size": (1200, 1200)},
+    "gif_long": {"files": 3, "size": (320, 240), "frames": 120},
+    "webp_anim": {"files": 3, "size": (400, 400), "frames": 48},
+}
+EXTENSIONS = {"jpeg": ".jpg", "png_alpha": ".png", "gif_long": ".gif", "webp_anim": ".webp"}
+
+
+# ==========================
+#   语料生成
+# ==========================
+def _textured_frame(rnd, size, mode="RGB"):
+    """渐变底色 + 随机色块，既不是纯色（压缩率不真实），也不是纯噪声"""
+    from PIL import Image, ImageDraw
+    w, h = size
+    base = Image.linear_gradient("L").resize(size)
+    channels = [base.rotate(rnd.choice([0, 90, 180, 270])).resize(size) for _ in range(3)]
+    img = Image.merge("RGB", channels)
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rnd.randrange(w), rnd.randrange(h)
+        x1, y1 = min(w, x0 + rnd.randint(8, w // 3)), min(h, y0 + rnd.randint(8, h // 3))
+        draw.rectangle((x0, y0, x1, y1), fill=tuple(rnd.randint(0, 255) for _ in range(3)))
+    if mode == "RGBA":
+        img.putalpha(Image.radial_gradient("L").resize(size))
+    return img
+
+
+def generate_corpus(folder, fmt, seed):
+    """生成一种格式的语料，返回文件路径列表（同一种子生成的文件内容相同）"""
+    from PIL import Image
+    rnd = random.Random(f"{seed}-{fmt}")
+    spec = CORPUS[fmt]
+    paths = []
+    for i in range(spec["files"]):
+        path = os.path.join(folder, f"{fmt}_{i}{EXTENSIONS[fmt]}")
+        if fmt == "jpeg":
+            _textured_frame(rnd, spec["size"]).save(path, "JPEG", quality=90)
+        elif fmt == "png_alpha":
+            _textured_frame(rnd, spec["size"], "RGBA").save(path, "PNG")
+        else:
+            first = _textured_frame(rnd, spec["size"])
+            frames = []
+            for n in range(spec["frames"]):
+                # 逐帧旋转，模拟动图内容变化
+                frames.append(first.rotate(n * 360 / spec["frames"]))
+            if fmt == "gif_long":
+                frames = [f.convert("P", palette=Image.Palette.ADAPTIVE, colors=128) for f in frames]
+                frames[0].save(path, "GIF", save_all=True, append_images=frames[1:], duration=40, loop=0)
+            else:
+                frames[0].save(path, "WEBP", save_all=True, append_images=frames[1:], duration=40, loop=0,
+                               quality=75, method=0)
+        paths.append(path)
+    return paths
+
+
+# ==========================
+#   测量（子进程内执行）
+# ==========================
+def peak_rss_mb():
+    """当前进程的峰值 RSS（MB），平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentiles(samples):
+    ms = sorted(s * 1000 for s in samples)
+
+    def pct(p):
+        return round(ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))], 3)
+
+    return {"n": len(ms), "p50_ms": pct(50), "p99_ms": pct(99), "mean_ms": round(statistics.fmean(ms), 3)}
+
+
+def measure_format(fmt, seed, repeat):
+    """生成语料并测量一种格式，返回结果 dict"""
+    # 使用临时数据目录，避免 import app 时在正式目录下建库
+    data_dir = tempfile.mkdtemp(prefix=f"bqbq-img-bench-{fmt}-")
+    os.environ['BQBQ_DATA_DIR'] = data_dir
+    try:
+        from PIL import Image
+        import app
+
+        corpus_dir = os.path.join(data_dir, "corpus")
+        thumb_dir = os.path.join(data_dir, "thumbs")
+        os.makedirs(corpus_dir)
+        os.makedirs(thumb_dir)
+        paths = generate_corpus(corpus_dir, fmt, seed)
+        total_bytes = sum(os.path.getsize(p) for p in paths)
+        rss_after_corpus = peak_rss_mb()
+
+        # 动图会随机抽帧作为缩略图，固定种子保证每次运行抽到相同的帧
+        random.seed(seed)
+        thumb_samples, probe_samples, hash_samples = [], [], []
+        for _ in range(repeat):
+            for i, path in enumerate(paths):
+                start = time.perf_counter()
+                with Image.open(path) as img:
+                    img.size
+                probe_samples.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                ok = app.MemeService._create_thumbnail_file(path, os.path.join(thumb_dir, f"{i}_thumbnail.jpg"))
+                thumb_samples.append(time.perf_counter() - start)
+                if not ok:
+                    raise RuntimeError(f"thumbnail failed for {path}")
+
+                start = time.perf_counter()
+                app.MemeService._hash_file(path)
+                hash_samples.append(time.perf_counter() - start)
+
+        hash_seconds = sum(hash_samples)
+        return {
+            "files": len(paths),
+            "corpus_bytes": total_bytes,
+            "thumbnail": percentiles(thumb_samples),
+            "probe": percentiles(probe_samples),
+            "md5": {**percentiles(hash_samples),
+                    "mb_per_sec": round(total_bytes * repeat / (1024 * 1024) / hash_seconds, 1) if hash_seconds else None},
+            "peak_rss_mb": peak_rss_mb(),
+            "corpus_rss_mb": rss_after_corpus,
+        }
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def run_child(fmt, seed, repeat):
+    """在子进程中测量一种格式（峰值 RSS 只反映该格式）"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", fmt, "--seed", str(seed), "--repeat", str(repeat)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
+    if proc.returncode != 0:
+        raise RuntimeError(f"{fmt} benchmark failed:\n{proc.stderr[-2000:]}")
+    # app 导入时会打印日志，结果在最后一行
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# ==========================
+#   基准对比
+# ==========================
+def compare_with_baseline(results, baseline, tolerance):
+    """打印与基准的对比，返回超出容忍度的指标列表"""
+    regressions = []
+    print(f"\n与基准对比（{baseline.get('meta', {}).get('platform', '?')}，"
+          f"Pillow {baseline.get('meta', {}).get('pillow', '?')}）")
+    print(f"{'格式':<12} {'指标':<20} {'基准':>10} {'本次':>10} {'变化':>8}")
+    for fmt, result in results.items():
+        base = baseline.get("formats", {}).get(fmt)
+        if not base:
+            continue
+        for stage in ("thumbnail", "probe", "md5"):
+            for key in ("p50_ms", "p99_ms"):
+                before, after = base[stage][key], result[stage][key]
+                change = (after - before) / before if before else 0.0
+                flag = " !" if change > tolerance and after - before > MIN_DELTA_MS else ""
+                print(f"{fmt:<12} {stage + '.' + key:<20} {before:>10} {after:>10} {change * 100:>+7.1f}%{flag}")
+                if flag:
+                    regressions.append(f"{fmt}.{stage}.{key}")
+        if base.get("peak_rss_mb") and result.get("peak_rss_mb"):
+            print(f"{fmt:<12} {'peak_rss_mb':<20} {base['peak_rss_mb']:>10} {result['peak_rss_mb']:>10}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Image pipeline micro-benchmark (thumbnail / probe / md5)")
+    parser.add_argument('--formats', default=",".join(CORPUS), help="逗号分隔: " + ", ".join(CORPUS))
+    parser.add_argument('--repeat', type=int, default=3, help="每个文件的重复次数")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--out', default=None, help="结果 JSON 路径")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help="把本次结果写为新的基准")
+    parser.add_argument('--check', action='store_true', help="有指标超出容忍度时返回退出码 1")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_format(args.child, args.seed, args.repeat)))
+        return
+
+    formats = [f for f in args.formats.split(",") if f]
+    unknown = set(formats) - set(CORPUS)
+    if unknown:
+        parser.error(f"unknown formats: {', '.join(sorted(unknown))}")
+
+    from PIL import Image
+    results = {}
+    print(f"{'格式':<12} {'缩略图 p50/p99 (ms)':>22} {'探测 p50/p99 (ms)':>20} {'md5 MB/s':>10} {'峰值 RSS':>10}")
+    for fmt in formats:
+        r = results[fmt] = run_child(fmt, args.seed, args.repeat)
+        print(f"{fmt:<12} {r['thumbnail']['p50_ms']:>10} / {r['thumbnail']['p99_ms']:<9} "
+              f"{r['probe']['p50_ms']:>8} / {r['probe']['p99_ms']:<9} {r['md5']['mb_per_sec']:>10} "
+              f"{r['peak_rss_mb']:>8} MB")
+
+    output = {
+        "meta": {"timestamp": time.time(), "python": platform.python_version(), "pillow": Image.__version__,
+                 "platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "seed": args.seed, "repeat": args.repeat},
+        "formats": results,
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\n基准已更新: {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n超出容忍度 ({args.tolerance:.0%}): {', '.join(regressions)}")
+            if args.check:
+                sys.exit(1)
+    else:
+        print(f"\n没有基准文件 {args.baseline}，可用 --update-baseline 生成")
+
+
+if __name__ == "__main__":
+    main()
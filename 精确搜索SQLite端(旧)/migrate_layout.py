@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+图片目录布局迁移工具 - 将平铺的 meme_images / meme_images_thumbnail 迁移为分片布局
+
+    meme_images/<md5>.<ext>  ->  meme_images/ab/cd/<md5>.<ext>
+
+特点：
+1. 可在服务运行时执行（serve_img / serve_thumb 同时兼容两种布局）
+2. 分批移动，每批之间可暂停，降低磁盘压力
+3. 可中断：重新执行时只会处理仍在平铺目录中的文件
+
+使用方式：
+    python migrate_layout.py [--kind img|thumb|all] [--batch-size 500] [--pause 0.5] [--dry-run]
+"""
+
+import argparse
+
+from app import MemeService
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate flat image folders to the sharded layout")
+    parser.add_argument('--kind', choices=['img', 'thumb', 'all'], default='all')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    kinds = ['img', 'thumb'] if args.kind == 'all' else [args.kind]
+    for kind in kinds:
+        print(f"[Layout Migration] Migrating '{kind}' folder...")
+        counters = MemeService.migrate_to_sharded_layout(
+            kind, batch_size=args.batch_size, pause=args.pause, dry_run=args.dry_run
+        )
+        print(f"[Layout Migration] {kind}: moved={counters['moved']} duplicates={counters['duplicates']} "
+              f"skipped={counters['skipped']} errors={counters['errors']}")
+
+
+if __name__ == '__main__':
+    main()
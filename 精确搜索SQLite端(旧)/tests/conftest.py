@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+测试使用独立的临时数据目录（BQBQ_DATA_DIR），必须在导入 app 之前设置。
+"""
+import io
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+os.environ.setdefault('BQBQ_DATA_DIR', tempfile.mkdtemp(prefix="bqbq-test-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def make_image():
+    """生成内容随机（md5 各不相同）的小 JPEG，返回字节"""
+    from PIL import Image
+
+    def make(size=(16, 16)):
+        img = Image.new("RGB", size)
+        img.putdata([tuple(random.randrange(256) for _ in range(3)) for _ in range(size[0] * size[1])])
+        buf = io.BytesIO()
+        img.save(buf, "JPEG")
+        return buf.getvalue()
+    return make
+
+
+@pytest.fixture
+def image_row():
+    """按 md5 查询 images 表中的记录"""
+    def get(md5):
+        with app.MemeService.get_conn() as conn:
+            return conn.execute("SELECT * FROM images WHERE md5=?", (md5,)).fetchone()
+    return get
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import hashlib
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("bad", [123, None, ["abc"], {"md5": "abc"}])
+def test_md5_batch_rejects_non_string_entries(client, bad):
+    resp = client.post('/api/check_md5/batch', json={"md5s": ["0" * 32, bad]})
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("bad", [123, None, ["abc"], {"sha1": "abc"}])
+def test_sha1_batch_rejects_non_string_entries(client, bad):
+    resp = client.post('/api/check_sha1/batch', json={"sha1s": ["0" * 40, bad]})
+    assert resp.status_code == 400
+
+
+def test_md5_batch_reports_existing(client, make_image):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    resp = client.post('/api/upload/chunked/init', json={"filename": "a.jpg", "size": len(data)})
+    upload_id = resp.get_json()['upload_id']
+    client.put(f'/api/upload/chunked/{upload_id}?offset=0', data=data)
+    client.post(f'/api/upload/chunked/{upload_id}/finalize')
+
+    results = client.post('/api/check_md5/batch', json={"md5s": [md5, "0" * 32]}).get_json()['results']
+    assert [r['exists'] for r in results] == [True, False]
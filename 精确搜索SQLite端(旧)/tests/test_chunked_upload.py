@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def _upload(client, data, md5=None):
+    resp = client.post('/api/upload/chunked/init', json={"filename": "a.jpg", "size": len(data), "md5": md5})
+    upload_id = resp.get_json()['upload_id']
+    resp = client.put(f'/api/upload/chunked/{upload_id}?offset=0', data=data)
+    assert resp.status_code == 200
+    return upload_id
+
+
+def test_init_uppercase_md5_hits_existing_image(client, make_image):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    upload_id = _upload(client, data)
+    assert client.post(f'/api/upload/chunked/{upload_id}/finalize').get_json() == {"success": True, "msg": md5}
+
+    resp = client.post('/api/upload/chunked/init', json={"filename": "a.jpg", "size": len(data),
+                                                         "md5": md5.upper()})
+    assert resp.get_json()["duplicate"] is True
+
+
+def test_init_stores_lowercase_md5(client, make_image):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    upload_id = _upload(client, data, md5=md5.upper())
+    assert app.ChunkedUploads.get_session(upload_id)['expected_md5'] == md5
+
+
+def test_init_rejects_non_string_md5(client):
+    resp = client.post('/api/upload/chunked/init', json={"filename": "a.jpg", "size": 10, "md5": 123})
+    assert resp.status_code == 400
+
+
+def test_concurrent_finalize_loser_gets_409(client, make_image, monkeypatch):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    upload_id = _upload(client, data)
+
+    # 放慢哈希，让两个请求都在会话删除前读到它
+    hash_file = app.MemeService._hash_file
+
+    def slow_hash(path):
+        time.sleep(0.3)
+        return hash_file(path)
+    monkeypatch.setattr(app.MemeService, '_hash_file', staticmethod(slow_hash))
+
+    statuses = []
+
+    def finalize():
+        resp = app.app.test_client().post(f'/api/upload/chunked/{upload_id}/finalize')
+        statuses.append((resp.status_code, resp.get_json()))
+
+    threads = [threading.Thread(target=finalize) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(code for code, _ in statuses) == [200, 409]
+    assert (200, {"success": True, "msg": md5}) in statuses
+    assert app.ChunkedUploads.get_session(upload_id) is None
+
+
+def test_chunk_rejected_while_finalizing(client, make_image):
+    data = make_image()
+    upload_id = _upload(client, data)
+    with app.MemeService.get_conn() as conn:
+        conn.execute("UPDATE upload_sessions SET state='finalizing' WHERE upload_id=?", (upload_id,))
+        conn.commit()
+
+    assert client.put(f'/api/upload/chunked/{upload_id}?offset=0', data=data).status_code == 409
+    assert client.delete(f'/api/upload/chunked/{upload_id}').status_code == 409
+    assert client.post(f'/api/upload/chunked/{upload_id}/finalize').status_code == 409
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import uuid
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def tag():
+    """本测试独有的标签名前缀，避免与其他测试写入的数据混在一起"""
+    prefix = uuid.uuid4().hex[:8]
+    return lambda name: f"{prefix}{name}"
+
+
+def _count(a, b):
+    with app.MemeService.get_conn() as conn:
+        row = conn.execute("SELECT count FROM tag_cooccurrence WHERE tag_a=? AND tag_b=?", (a, b)).fetchone()
+    return row['count'] if row else 0
+
+
+def test_counts_stay_exact_beyond_top_k(tag):
+    # 标签 x 与 4 个标签共现，超过 top_k=2 的邻居计数也必须保留
+    x, neighbours = tag("x"), [tag(f"n{i}") for i in range(4)]
+    images = []
+    for i, n in enumerate(neighbours):
+        for _ in range(i + 1):
+            md5 = uuid.uuid4().hex
+            images.append(md5)
+            app.MemeService.update_index(md5, [x, n])
+
+    assert [_count(x, n) for n in neighbours] == [1, 2, 3, 4]
+    assert [_count(n, x) for n in neighbours] == [1, 2, 3, 4]
+
+    related = app.MemeService.related_tags([x], top_k=2)
+    assert [(r['name'], r['count']) for r in related] == [(neighbours[3], 4), (neighbours[2], 3)]
+
+    # 去掉一张 (x, n0) 图片后计数精确降为 0，不会因曾被裁剪而残留或重置
+    app.MemeService.update_index(images[0], [])
+    assert _count(x, neighbours[0]) == 0
+    app.MemeService.update_index(images[0], [x, neighbours[0]])
+    assert _count(x, neighbours[0]) == 1
+
+
+def test_pruned_table_is_recounted_once(tag):
+    a, b = tag("a"), tag("b")
+    app.MemeService.update_index(uuid.uuid4().hex, [a, b])
+    with app.MemeService.get_conn() as conn:
+        # 模拟旧版本：按 top-K 裁剪过的表（计数丢失）
+        conn.execute("DELETE FROM tag_cooccurrence WHERE tag_a IN (?, ?)", (a, b))
+        conn.execute("INSERT OR REPLACE INTO system_meta (key, version_id, last_updated_at) VALUES ('tag_cooccurrence', 1, 0)")
+        conn.commit()
+
+    app.MemeService.ensure_cooccurrence()
+    assert _count(a, b) == _count(b, a) == 1
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+
+import app
+
+
+def _drop(data, name):
+    path = os.path.join(app.FOLDERS['img'], name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_flat_md5_named_file_is_moved_into_shard_and_imported(make_image, image_row):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    flat = _drop(data, f"{md5}.jpg")
+
+    app.MemeService.scan_and_import_folder()
+
+    sharded = app.MemeService.sharded_path('img', f"{md5}.jpg")
+    assert not os.path.exists(flat)
+    with open(sharded, 'rb') as f:
+        assert f.read() == data
+    assert image_row(md5)['filename'] == f"{md5}.jpg"
+
+
+def test_flat_md5_named_file_is_imported_with_paths(make_image, image_row):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    flat = _drop(data, f"{md5}.jpg")
+
+    app.MemeService.scan_and_import_folder(paths=[flat])
+
+    assert os.path.isfile(app.MemeService.sharded_path('img', f"{md5}.jpg"))
+    assert image_row(md5) is not None
+
+
+def test_duplicate_of_existing_sharded_file_is_removed(make_image):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    app.MemeService.scan_and_import_folder(paths=[_drop(data, "first.jpg")])
+    sharded = app.MemeService.sharded_path('img', f"{md5}.jpg")
+    assert os.path.isfile(sharded)
+
+    # 同一内容以其他名字再次放入（md5 未入库时的去重分支由 resolve_path 命中分片文件触发）
+    with app.MemeService.get_conn() as conn:
+        conn.execute("DELETE FROM images WHERE md5=?", (md5,))
+        conn.commit()
+    copy = _drop(data, "copy.jpg")
+    app.MemeService.scan_and_import_folder(paths=[copy])
+
+    assert not os.path.exists(copy)
+    assert os.path.isfile(sharded)
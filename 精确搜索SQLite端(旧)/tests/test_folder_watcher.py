@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import time
+
+import app
+
+
+def test_md5_named_drop_in_is_imported(make_image, image_row):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    path = os.path.join(app.FOLDERS['img'], f"{md5}.jpg")
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    now = time.time()
+    app.FolderWatcher.touch(path)
+    assert app.FolderWatcher.import_settled(now) == []  # 第一次只记录大小，等待稳定
+    assert app.FolderWatcher.import_settled(now + app.WATCH_SETTLE_SECONDS) == [path]
+
+    assert not os.path.exists(path)
+    with open(app.MemeService.sharded_path('img', f"{md5}.jpg"), 'rb') as f:
+        assert f.read() == data
+    assert image_row(md5) is not None
+
+
+def test_files_outside_root_are_ignored(tmp_path):
+    other = tmp_path / "a.jpg"
+    other.write_bytes(b"x")
+    app.FolderWatcher.touch(str(other))
+    assert str(other) not in app.FolderWatcher._pending
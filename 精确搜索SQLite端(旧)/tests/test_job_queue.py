@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import time
+
+import app
+
+
+def _insert_job(status):
+    with app.MemeService.get_conn() as conn:
+        job_id = conn.execute("INSERT INTO jobs (kind, md5, status, created_at, attempts) VALUES (?, ?, ?, ?, 1)",
+                              ('postprocess', '0' * 32, status, time.time())).lastrowid
+        conn.commit()
+    return job_id
+
+
+def test_finish_retries_while_database_is_locked(monkeypatch):
+    job_id = _insert_job('running')
+    finish = app.JobQueue.finish
+    calls = []
+
+    def flaky_finish(job_id, error=None):
+        calls.append(job_id)
+        if len(calls) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        finish(job_id, error)
+    monkeypatch.setattr(app.JobQueue, 'finish', staticmethod(flaky_finish))
+    monkeypatch.setattr(app.time, 'sleep', lambda s: None)
+
+    app.JobQueue.finish_with_retry(job_id)
+    assert len(calls) == 3
+    assert app.JobQueue.get_job(job_id)['status'] == 'done'
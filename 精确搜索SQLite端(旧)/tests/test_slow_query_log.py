@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import time
+
+import pytest
+
+import app
+
+ROWS = 20
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    """每行取数耗时约 5ms 的内存库；execute 只执行到第一行，不会单独越过 50ms 阈值"""
+    monkeypatch.setattr(app, 'SLOW_QUERY_THRESHOLD_MS', 50)
+    app.SlowQueryLog.clear()
+    conn = sqlite3.connect(':memory:', factory=app.InstrumentedConnection)
+    conn.create_function('sleepy', 1, lambda x: time.sleep(0.005) or x)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(ROWS)])
+    yield conn
+    conn.close()
+    app.SlowQueryLog.clear()
+
+
+def _logged():
+    return [e['sql'] for e in app.SlowQueryLog.snapshot()['entries']]
+
+
+@pytest.mark.parametrize("consume", [
+    lambda cur: [r for rows in iter(lambda: cur.fetchmany(3), []) for r in rows],
+    lambda cur: cur.fetchall(),
+], ids=["fetchmany", "fetchall"])
+def test_fetch_time_counts_towards_slow_query(conn, consume):
+    rows = consume(conn.execute("SELECT sleepy(x) FROM t"))
+    assert len(rows) == ROWS
+    assert _logged() == ["SELECT sleepy(x) FROM t"]
+
+
+def test_row_iteration_is_not_timed(conn):
+    # 逐行迭代不包装（避免每行的计时开销），只有 execute 本身的耗时参与判断
+    assert type(conn.execute("SELECT x FROM t")).__next__ is app.sqlite3.Cursor.__next__
+    assert len(list(conn.execute("SELECT sleepy(x) FROM t"))) == ROWS
+    assert _logged() == []
+
+
+def test_abandoned_cursor_recorded_on_close(conn):
+    cur = conn.execute("SELECT sleepy(x) FROM t")
+    cur.fetchmany(ROWS // 2)
+    assert _logged() == []
+    cur.close()
+    assert _logged() == ["SELECT sleepy(x) FROM t"]
+
+
+def test_fast_query_not_recorded(conn):
+    assert len(conn.execute("SELECT x FROM t").fetchall()) == ROWS
+    assert _logged() == []
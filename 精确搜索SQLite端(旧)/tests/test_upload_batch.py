@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import glob
+import hashlib
+import io
+import os
+import sqlite3
+import tarfile
+import zipfile
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def _temp_files():
+    return glob.glob(os.path.join(app.FOLDERS['img'], '.upload-*'))
+
+
+def _zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def _tar(members):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tf:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def _post(client, body, mimetype):
+    return client.post('/api/upload/batch', data=body, content_type=mimetype)
+
+
+@pytest.mark.parametrize("pack, mimetype", [(_zip, 'application/zip'), (_tar, 'application/gzip')])
+def test_oversized_member_is_rejected_without_extracting(client, monkeypatch, make_image, pack, mimetype):
+    monkeypatch.setattr(app, "MAX_UPLOAD_SIZE", 4096)
+    body = pack([("bomb.jpg", b"\0" * 1024 * 1024), ("ok.jpg", make_image())])
+    assert len(body) < 64 * 1024
+
+    r = _post(client, body, mimetype)
+    assert r.status_code == 200
+    results = {item['name']: item for item in r.json['results']}
+    assert "File too large" in results['bomb.jpg']['error']
+    assert results['ok.jpg']['success'] is True
+    assert _temp_files() == []
+
+
+@pytest.mark.parametrize("pack, mimetype", [(_zip, 'application/zip'), (_tar, 'application/gzip')])
+def test_archive_total_size_is_capped(client, monkeypatch, make_image, pack, mimetype):
+    images = [make_image() for _ in range(3)]
+    monkeypatch.setattr(app, "ARCHIVE_MAX_TOTAL_SIZE", sum(map(len, images[:2])))
+    r = _post(client, pack([(f"{i}.jpg", data) for i, data in enumerate(images)]), mimetype)
+    assert r.status_code == 400
+    assert "too large" in r.json['error']
+    assert _temp_files() == []
+
+
+@pytest.mark.parametrize("pack, mimetype", [(_zip, 'application/zip'), (_tar, 'application/gzip')])
+def test_archive_member_count_is_capped(client, monkeypatch, pack, mimetype):
+    monkeypatch.setattr(app, "ARCHIVE_MAX_MEMBERS", 5)
+    r = _post(client, pack([(f"{i}.txt", b"x") for i in range(6)]), mimetype)
+    assert r.status_code == 400
+    assert "Too many archive members" in r.json['error']
+
+
+def test_spool_upload_stops_at_max_size():
+    with pytest.raises(ValueError):
+        app.MemeService._spool_upload(io.BytesIO(b"x" * (3 * app.UPLOAD_CHUNK_SIZE)), max_size=app.UPLOAD_CHUNK_SIZE)
+    assert _temp_files() == []
+
+
+def test_raw_zip_temp_file_and_archive_are_closed(client, monkeypatch, make_image):
+    body = _zip([("a.jpg", make_image())])
+    opened = []
+    temporary_file = app.tempfile.TemporaryFile
+    zip_file = app.zipfile.ZipFile
+
+    def tracking_temp(*args, **kwargs):
+        opened.append(temporary_file(*args, **kwargs))
+        return opened[-1]
+
+    class TrackingZip(zip_file):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            opened.append(self)
+
+    monkeypatch.setattr(app.tempfile, 'TemporaryFile', tracking_temp)
+    monkeypatch.setattr(app.zipfile, 'ZipFile', TrackingZip)
+
+    r = _post(client, body, 'application/zip')
+    assert r.status_code == 200
+    assert r.json['imported'] == 1
+    temp, archive = opened
+    assert temp.closed
+    assert archive.fp is None
+
+
+def test_failed_commit_leaves_no_orphan_files(client, monkeypatch, make_image, image_row):
+    data = make_image()
+    md5 = hashlib.md5(data).hexdigest()
+    get_conn = app.MemeService.get_conn
+    calls = []
+
+    class LockedConn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def execute(self, *args):
+            raise sqlite3.OperationalError("database is locked")
+        executemany = execute
+
+    def flaky_get_conn():
+        calls.append(1)
+        # 第一次为查重，之后的写库连接一律失败
+        return get_conn() if len(calls) == 1 else LockedConn()
+    monkeypatch.setattr(app.MemeService, 'get_conn', staticmethod(flaky_get_conn))
+
+    r = client.post('/api/upload/batch', data={"files": [(io.BytesIO(data), "a.jpg")]},
+                    content_type='multipart/form-data')
+    assert r.status_code == 503
+    assert "locked" in r.json['error']
+    monkeypatch.undo()
+
+    assert image_row(md5) is None
+    assert not os.path.exists(app.MemeService.sharded_path('img', f"{md5}.jpg"))
+    assert not os.path.exists(app.MemeService.sharded_path('thumb', app.MemeService.thumb_name(md5)))
+    assert _temp_files() == []